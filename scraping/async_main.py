@@ -0,0 +1,259 @@
+import asyncio
+import functools
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+
+from datasources import cache
+from datasources import ratelimit
+from main import LyricScraper
+
+
+class AsyncLyricScraper(LyricScraper):
+
+    def __init__(self, charts, max_connections=1000,
+                 max_connections_per_host=50, max_songs_in_flight=500,
+                 max_blocking_threads=32, **kwargs):
+        """
+        Event loop driven version of LyricScraper. Every chart of a week
+        and every song of a chart is scheduled on one event loop, the
+        scrapers with an async variant (AZLyrics, Genius, MetroLyrics,
+        Spotify) share one aiohttp connection pool, and everything that
+        is still blocking (Billboard, Wikia, MusiXMatch, lyric analysis,
+        Elasticsearch) runs on a small thread pool.
+
+        :param charts: list of billboard chart names (str)
+        :param max_connections: max open connections across all hosts (int)
+        :param max_connections_per_host: max open connections per host (int)
+        :param max_songs_in_flight: max songs being scraped at once (int)
+        :param max_blocking_threads: size of the thread pool used for
+            blocking calls (int)
+        :param kwargs: any other LyricScraper arguments
+        """
+        super().__init__(charts, **kwargs)
+        self.max_connections = max_connections
+        self.max_connections_per_host = max_connections_per_host
+        self.max_songs_in_flight = max_songs_in_flight
+        self.executor = ThreadPoolExecutor(max_workers=max_blocking_threads)
+        self.song_semaphore = None
+
+    def run(self):
+        """
+        Main run loop, drives run_async on a fresh event loop
+
+        :return: None
+        """
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self.run_async())
+        finally:
+            loop.close()
+            self.executor.shutdown()
+
+    def run_leased(self, lease_table, poll_seconds=10):
+        """
+        Sharded runs aren't supported on the async engine yet, the
+        threaded loop LyricScraper.run_leased would bypass it
+
+        :raises NotImplementedError: always
+        """
+        raise NotImplementedError("The async engine can't claim units "
+                                  "from a lease table, use LyricScraper")
+
+    async def run_async(self):
+        """
+        Async main run loop, all charts of a week are scraped
+        concurrently over one shared connection pool
+
+        :return: None
+        """
+        begin = time.time()
+        cur_date = self.start_date
+        self.song_semaphore = asyncio.Semaphore(self.max_songs_in_flight)
+        connector = aiohttp.TCPConnector(
+            limit=self.max_connections,
+            limit_per_host=self.max_connections_per_host)
+
+        async with aiohttp.ClientSession(connector=connector) as client:
+            session = client
+            if self.rate_limiter is not None:
+                session = ratelimit.ThrottledClientSession(session,
+                                                           self.rate_limiter)
+            if self.response_cache is not None:
+                session = cache.CachingClientSession(session,
+                                                     self.response_cache,
+                                                     self.executor)
+            while (time.strptime(cur_date, "%Y-%m-%d") > time.strptime(self.stop_date, "%Y-%m-%d")) and \
+                    (self.max_records == 0 or self.records_processed < self.max_records):
+
+                # A chart that fails is left undone for the next run,
+                # the other charts of the week carry on
+                results = await asyncio.gather(*[
+                    self.get_augmented_chart_list_async(session, chart, cur_date)
+                    for chart in self.charts
+                    if not self._unit_done(chart, cur_date)
+                ], return_exceptions=True)
+                for result in results:
+                    if isinstance(result, Exception):
+                        traceback.print_exception(type(result), result,
+                                                  result.__traceback__)
+
+                # All charts are done for this time period. Cleanup:
+                await self._run_blocking(self.log_performance, begin)
+                cur_date = self.BB.rewind_one_week(cur_date)
+
+        await self._run_blocking(self._close_storage)
+
+    async def get_augmented_chart_list_async(self, session, chart: str,
+                                             date: str):
+        """
+        Async variant of get_augmented_chart_list, every entry of
+        the chart is scraped concurrently
+
+        :param session: aiohttp ClientSession
+        :param chart: name of billboard chart (str)
+        :param date: date to poll charts for
+        :return: None
+        """
+        chart_dict = await self._run_blocking(self.BB.get_chart,
+                                              chart_name=chart, date_str=date)
+        if "Error" in chart_dict.keys():
+            print({"Bad Billboard Chart": chart_dict["Error"]})
+            return
+
+        known_songs = await self._run_blocking(self._get_known_songs,
+                                               chart_dict)
+        restored = await self._run_blocking(self._restore_songs, chart, date)
+
+        entries = []
+        for key, val in chart_dict.items():
+            if self.max_records != 0 and \
+                    self.records_processed + len(entries) >= self.max_records:
+                break
+            if key in ["Billboard_Chart", "Year", "Month", "Day"]:
+                continue
+            entries.append(val)
+
+        results = await asyncio.gather(*[
+            self._get_new_song_async(session, chart, date, val,
+                                     self._master_key(val) in known_songs,
+                                     restored.get(self._master_key(val)))
+            for val in entries
+        ])
+
+        master_dict = {}
+        for master_key, song_dict in results:
+            if song_dict is not None:
+                master_dict[master_key] = song_dict
+
+        await self._run_blocking(self._add_spotify_artist_info, master_dict)
+        await self._run_blocking(self._store_chart, master_dict, chart, date)
+        await self._run_blocking(self._unit_stored, chart, date,
+                                 list(master_dict))
+
+    async def _get_new_song_async(self, session, chart: str, date: str,
+                                  val: dict, known: bool,
+                                  restored=None) -> tuple:
+        """
+        Scrapes one chart entry if it isn't already known
+
+        :param session: aiohttp ClientSession
+        :param chart: name of billboard chart (str)
+        :param date: date of chart (str)
+        :param val: dict containing song info
+        :param known: boolean of whether song is already stored
+        :param restored: song dict an interrupted run already scraped,
+            none if the song still has to be scraped
+        :return: tuple of (master key, song dict or None if the song
+            is already known or has no lyrics)
+        """
+        master_key = self._master_key(val)
+        date_str = val["BB_Chart_Discovered"]["Date"]
+        status = "No Update"
+        song_dict = None
+
+        async with self.song_semaphore:
+            if not known:
+                if restored is not None:
+                    song_dict = restored
+                else:
+                    try:
+                        await self._run_blocking(self._start_song, chart,
+                                                 date, master_key)
+                        song_dict = await self._get_song_data_async(
+                            session, val, True)
+                        await self._run_blocking(self._finish_song, chart,
+                                                 date, master_key, song_dict)
+                    except Exception:
+                        # Only this song is lost, like a failed task of
+                        # the threaded scraper only loses its chart
+                        traceback.print_exc()
+                        return master_key, None
+                if not self._has_lyrics(song_dict):
+                    return master_key, None
+                status = "New Entry"
+                self.unique_songs += 1
+
+        print(self._progress_message(status, chart, date_str,
+                                     val, self.records_processed))
+        self.records_processed += 1
+        return master_key, song_dict
+
+    async def _get_song_data_async(self, session, val: dict,
+                                   flatten_lyrics=False) -> dict:
+        """
+        Async variant of _get_song_data, all sources are queried
+        at the same time
+
+        :param session: aiohttp ClientSession
+        :param val: dict containing song info
+        :param flatten_lyrics: boolean value to flatten lyrics
+        :return: dict of aggregate data
+        """
+        song_dict = val
+        artist_name = val["BB_Artist"]
+        track_title = val["BB_Song_Title"]
+
+        calls = []
+        for data in self.data_sources:
+            if hasattr(data, "get_song_data_async"):
+                calls.append(data.get_song_data_async(
+                    session, artist_name=artist_name,
+                    track_title=track_title, flatten_lyrics=flatten_lyrics))
+            else:
+                calls.append(self._run_blocking(
+                    data.get_song_data, artist_name=artist_name,
+                    track_title=track_title, flatten_lyrics=flatten_lyrics))
+        # Every source gets to finish before an error is passed on, so
+        # none is left running unwatched
+        results = await asyncio.gather(*calls, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+            song_dict.update(result)
+
+        if song_dict["Spotify_Artist_ID"] == "Not Found":
+            song_dict.update(await self._run_blocking(
+                self.MM.get_song_data, artist_name, track_title))
+        # Add basic lyric analytics:
+        if self.analysis_pool is None:
+            stats = await self._run_blocking(self._get_lyric_stats, song_dict)
+        else:
+            stats = await asyncio.wrap_future(
+                self.analysis_pool.submit(self._lyrics_list(song_dict)))
+        song_dict.update(stats)
+        return song_dict
+
+    def _run_blocking(self, func, *args, **kwargs):
+        """
+        Runs a blocking call on the thread pool so it doesn't
+        stall the event loop
+
+        :param func: callable to run
+        :return: awaitable future of the call's result
+        """
+        return asyncio.get_event_loop().run_in_executor(
+            self.executor, functools.partial(func, *args, **kwargs))
@@ -0,0 +1,319 @@
+import copy
+import itertools
+import json
+import random
+import threading
+import time
+
+
+class FakeIndices:
+
+    def __init__(self, es):
+        """
+        indices namespace of FakeElasticsearch
+
+        :param es: FakeElasticsearch the indices belong to
+        """
+        self.es = es
+
+    def create(self, index: str, body=None, **kwargs) -> dict:
+        """
+        Creates an empty index, keeping the mapping it was given.
+        Unlike a real cluster an existing index is left as it is
+
+        :param index: name of index (str)
+        :param body: index settings and mappings (dict)
+        :return: dict of form {"acknowledged": bool, "index": str}
+        """
+        self.es.call("indices.create", 0)
+        with self.es.lock:
+            self.es.docs.setdefault(index, {})
+            self.es.mappings[index] = body
+        return {"acknowledged": True, "index": index}
+
+    def exists(self, index: str, **kwargs) -> bool:
+        self.es.call("indices.exists", 0)
+        with self.es.lock:
+            return index in self.es.docs
+
+
+class FakeElasticsearch:
+
+    def __init__(self, latency_ms=0.0, per_doc_ms=0.0, jitter_ms=0.0,
+                 reject_rate=0.0, seed=None):
+        """
+        In-process stand-in for an elasticsearch client, covering the
+        calls the scraper makes: ping, exists, index, mget, bulk,
+        indices.create and search with scroll (for helpers.scan). Each
+        call sleeps for latency_ms, plus per_doc_ms for every document
+        it reads or writes, so ingest code can be timed against a
+        cluster of known speed. Documents are kept in dicts and
+        serialized on the way in, as a real client would.
+
+        :param latency_ms: delay of every call (float)
+        :param per_doc_ms: delay per document of a call (float)
+        :param jitter_ms: max random delay added on top (float)
+        :param reject_rate: share of bulk items rejected with a 429,
+            like a full write queue (float between 0 and 1)
+        :param seed: random seed of jitter and rejections
+        """
+        self.latency_ms = latency_ms
+        self.per_doc_ms = per_doc_ms
+        self.jitter_ms = jitter_ms
+        self.reject_rate = reject_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.indices = FakeIndices(self)
+        self.docs = {}          # index: {id: source}
+        self.mappings = {}      # index: mapping body
+        self.scrolls = {}       # scroll id: (page size, list of hits left)
+        self.scroll_ids = itertools.count(1)
+
+        self.calls = {}         # endpoint: count of calls
+        self.docs_written = 0
+        self.docs_rejected = 0
+        self.bytes_received = 0
+
+    def options(self, **kwargs):
+        return self
+
+    def ping(self, **kwargs) -> bool:
+        self.call("ping", 0)
+        return True
+
+    def exists(self, index: str, id: str, **kwargs) -> bool:
+        self.call("exists", 1)
+        with self.lock:
+            return id in self.docs.get(index, {})
+
+    def get(self, index: str, id: str, **kwargs) -> dict:
+        self.call("get", 1)
+        with self.lock:
+            found = id in self.docs.get(index, {})
+            hit = {"_index": index, "_id": id, "found": found}
+            if found:
+                hit["_source"] = copy.deepcopy(self.docs[index][id])
+        return hit
+
+    def index(self, index: str, id: str = None, body=None, document=None,
+              **kwargs) -> dict:
+        self.call("index", 1)
+        source = body if body is not None else document
+        raw = json.dumps(source)
+        with self.lock:
+            result = self._store(index, id, json.loads(raw))
+            self.bytes_received += len(raw)
+        return result
+
+    def mget(self, index: str, body=None, ids=None, _source=True,
+             **kwargs) -> dict:
+        ids = (body or {}).get("ids", ids or [])
+        self.call("mget", len(ids))
+        docs = []
+        with self.lock:
+            stored = self.docs.get(index, {})
+            for doc_id in ids:
+                doc = {"_index": index, "_id": doc_id,
+                       "found": doc_id in stored}
+                if doc["found"] and _source:
+                    doc["_source"] = copy.deepcopy(stored[doc_id])
+                docs.append(doc)
+        return {"docs": docs}
+
+    def bulk(self, body=None, operations=None, index=None, **kwargs) -> dict:
+        """
+        Applies index actions of a bulk body, given as NDJSON text or
+        as a list of action and source dicts
+
+        :return: dict of form {"took": int, "errors": bool,
+            "items": [{"index": {"_id": str, "status": int}}]}
+        """
+        lines = body if body is not None else operations
+        if isinstance(lines, bytes):
+            lines = lines.decode('utf-8')
+        if isinstance(lines, str):
+            size = len(lines)
+            lines = [json.loads(line) for line in lines.splitlines() if line]
+        else:
+            size = sum(len(json.dumps(line)) for line in lines)
+        actions = list(zip(lines[0::2], lines[1::2]))
+
+        begin = time.perf_counter()
+        self.call("bulk", len(actions))
+        items = []
+        with self.lock:
+            self.bytes_received += size
+            for action, source in actions:
+                op, meta = next(iter(action.items()))
+                if op not in ("index", "create"):
+                    raise NotImplementedError("bulk " + op)
+                doc_index = meta.get("_index", index)
+                if self.random.random() < self.reject_rate:
+                    self.docs_rejected += 1
+                    items.append({op: {
+                        "_index": doc_index, "_id": meta.get("_id"),
+                        "status": 429,
+                        "error": {"type": "es_rejected_execution_exception",
+                                  "reason": "rejected by fake"}}})
+                    continue
+                items.append({op: self._store(doc_index, meta.get("_id"),
+                                              source)})
+        took = int((time.perf_counter() - begin) * 1000)
+        return {"took": took,
+                "errors": any("error" in item[op] for item in items
+                              for op in item),
+                "items": items}
+
+    def search(self, index: str = None, body=None, scroll=None, size=10,
+               from_=0, _source=True, query=None, **kwargs) -> dict:
+        """
+        Answers match_all and ids queries, other queries raise
+        NotImplementedError. With scroll the hits are paged through
+        scroll like a scroll cursor
+
+        :return: dict of form {"_scroll_id": str, "_shards": dict,
+            "hits": {"total": {"value": int}, "hits": list}}
+        """
+        body = dict(body or {})
+        if query is not None:
+            body["query"] = query
+        size = body.get("size", size)
+        from_ = body.get("from", from_)
+        query = body.get("query", {"match_all": {}})
+
+        with self.lock:
+            stored = self.docs.get(index, {}) if index else \
+                {doc_id: doc for docs in self.docs.values()
+                 for doc_id, doc in docs.items()}
+            if "match_all" in query:
+                ids = list(stored)
+            elif "ids" in query:
+                ids = [doc_id for doc_id in query["ids"]["values"]
+                       if doc_id in stored]
+            else:
+                raise NotImplementedError("query " + json.dumps(query))
+            hits = [{"_index": index, "_id": doc_id,
+                     "_source": copy.deepcopy(stored[doc_id])
+                     if _source else None}
+                    for doc_id in ids]
+        for hit in hits:
+            if hit["_source"] is None:
+                del hit["_source"]
+
+        response = {"took": 0, "timed_out": False,
+                    "_shards": {"total": 1, "successful": 1,
+                                "skipped": 0, "failed": 0},
+                    "hits": {"total": {"value": len(hits),
+                                       "relation": "eq"}}}
+        if scroll:
+            scroll_id = str(next(self.scroll_ids))
+            with self.lock:
+                self.scrolls[scroll_id] = (size, hits[size:])
+            hits = hits[:size]
+            response["_scroll_id"] = scroll_id
+        else:
+            hits = hits[from_:from_ + size]
+        self.call("search", len(hits))
+        response["hits"]["hits"] = hits
+        return response
+
+    def scroll(self, scroll_id: str = None, body=None, scroll=None,
+               **kwargs) -> dict:
+        scroll_id = scroll_id or body["scroll_id"]
+        with self.lock:
+            size, left = self.scrolls.get(scroll_id, (0, []))
+            page = left[:size]
+            self.scrolls[scroll_id] = (size, left[size:])
+        self.call("scroll", len(page))
+        return {"_scroll_id": scroll_id,
+                "_shards": {"total": 1, "successful": 1,
+                            "skipped": 0, "failed": 0},
+                "hits": {"hits": page}}
+
+    def clear_scroll(self, scroll_id=None, body=None, **kwargs) -> dict:
+        ids = scroll_id or (body or {}).get("scroll_id", [])
+        if isinstance(ids, str):
+            ids = [ids]
+        with self.lock:
+            for sid in ids:
+                self.scrolls.pop(sid, None)
+        return {"succeeded": True, "num_freed": len(ids)}
+
+    def count(self, index: str, **kwargs) -> dict:
+        self.call("count", 0)
+        with self.lock:
+            return {"count": len(self.docs.get(index, {}))}
+
+    def load(self, index: str, docs: dict):
+        """
+        Puts documents in without latency or counting, to start a
+        benchmark from a populated index
+
+        :param index: name of index (str)
+        :param docs: dict of {id: source}
+        """
+        with self.lock:
+            self.docs.setdefault(index, {}).update(
+                (doc_id, json.loads(json.dumps(source)))
+                for doc_id, source in docs.items())
+
+    def call(self, endpoint: str, docs: int):
+        """
+        Counts a call and sleeps for its latency
+
+        :param endpoint: name of the endpoint (str)
+        :param docs: documents read or written by the call (int)
+        """
+        with self.lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+            delay = self.latency_ms + docs * self.per_doc_ms + \
+                self.random.uniform(0, self.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+
+    def get_usage_report(self) -> dict:
+        """
+        :return: dict of form {
+            "Fake_ES_Report": {
+                "Calls": {"endpoint": int},
+                "Docs_Written": int,
+                "Docs_Rejected": int,
+                "Megabytes_Received": float,
+                "Indices": {"index": int}
+            }
+        }
+        """
+        with self.lock:
+            return {
+                "Fake_ES_Report": {
+                    "Calls": dict(sorted(self.calls.items())),
+                    "Docs_Written": self.docs_written,
+                    "Docs_Rejected": self.docs_rejected,
+                    "Megabytes_Received": self.bytes_received / 1024.0 ** 2,
+                    "Indices": {index: len(docs)
+                                for index, docs in sorted(self.docs.items())}
+                }
+            }
+
+    def clear_usage_stats(self):
+        with self.lock:
+            self.calls = {}
+            self.docs_written = 0
+            self.docs_rejected = 0
+            self.bytes_received = 0
+
+    def _store(self, index: str, doc_id, source: dict) -> dict:
+        """
+        Writes a document, called with the lock held. Indices are
+        made on first write, like ES does by default
+
+        :return: bulk style item result (dict)
+        """
+        docs = self.docs.setdefault(index, {})
+        if doc_id is None:
+            doc_id = "fake-" + str(len(docs) + 1)
+        result = "updated" if doc_id in docs else "created"
+        docs[doc_id] = source
+        self.docs_written += 1
+        return {"_index": index, "_id": doc_id, "result": result,
+                "status": 200 if result == "updated" else 201}
@@ -0,0 +1,257 @@
+"""
+Ingest throughput of LyricScraper._put_data_in_es and
+ElasticSearch.log_usage against the in-process FakeElasticsearch, so
+existence checks, single and bulk writes and usage logging can be
+timed without the docker-compose cluster. Songs come from scraper
+output files, or are made up when none are given. Part of them is put
+in the index beforehand to exercise the already stored path. Run from
+scraping/:
+
+    python -m benchmarks.ingest --charts 200 --latency-ms 5
+    python -m benchmarks.ingest sample_results --no-bulk --threads 5
+    python -m benchmarks.ingest --bloom
+
+With --bloom the seen index isn't warmed, the songs put in the index
+beforehand are only known to a saved Bloom filter, like after earlier
+runs of a single writer. New songs then skip the mget.
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+import main
+import read_dict
+from benchmarks import fakees
+from benchmarks import stubserver
+from benchmarks.pipeline import latency_report
+from datasources import cache
+from processing import seenindex
+from processing import streamstats
+
+WORDS = ["love", "baby", "night", "heart", "never", "know", "time", "yeah",
+         "girl", "want", "feel", "light", "fire", "dance", "home", "road",
+         "rain", "gold", "dream", "money", "party", "crazy", "alone", "sky"]
+TAGS = ["NN", "NNS", "VB", "VBP", "JJ", "RB", "UH"]
+
+
+def synthetic_song(number: int, rng: random.Random) -> dict:
+    """
+    Makes up a song record of about the size and shape the scraper
+    stores: four lyric sources, stats and a shared bag of words
+
+    :param number: song number, makes the master key unique (int)
+    :param rng: random.Random
+    :return: song dict with a "Master_Key" field
+    """
+    lyrics = " ".join(rng.choice(WORDS) for _ in range(rng.randint(150, 400)))
+    shared = rng.sample(WORDS, rng.randint(8, len(WORDS)))
+    song = {
+        "BB_Artist": "Artist " + str(number),
+        "BB_Featuring": "",
+        "BB_Song_Title": "Song " + str(number),
+        "BB_Chart_Discovered": {"Chart_Name": "hot-100",
+                                "Peak_Position": rng.randint(1, 100),
+                                "Date": "2018-10-13"},
+        "Genius_Lyrics": lyrics,
+        "AZ_Lyrics": lyrics,
+        "Wikia_Lyrics": lyrics if rng.random() < 0.5 else "",
+        "MetroLyrics": lyrics if rng.random() < 0.5 else "",
+        "Spotify_Artist_ID": "artist" + str(number),
+        "Genres": ["pop"],
+        "Percent_Agreed": rng.random(),
+        "Unique_Word_Count": len(shared),
+        "Total_Word_Count": len(lyrics.split()),
+        "Repetition_Coeff": rng.uniform(1, 20),
+        "Lyric_Sources": rng.randint(2, 4),
+        "BoW_Shared": [{"Word": word, "Count": rng.randint(1, 30),
+                        "POS_Type": rng.choice(TAGS)} for word in shared]
+    }
+    song["Master_Key"] = main.LyricScraper._master_key(song)
+    return song
+
+
+def load_songs(paths: list, limit: int) -> list:
+    """
+    Reads up to limit songs from scraper output files
+
+    :param paths: list of file or directory paths (str)
+    :param limit: max songs to read (int)
+    :return: list of song dicts with a "Master_Key" field
+    """
+    songs = []
+    for path in read_dict.find_files(paths):
+        for song in read_dict.read_songs(path):
+            song = dict(song)
+            song.setdefault("Master_Key", main.LyricScraper._master_key(song))
+            songs.append(song)
+            if len(songs) >= limit:
+                return songs
+    return songs
+
+
+def make_charts(songs: list, chart_size: int) -> list:
+    """
+    Groups songs into master dicts like _put_data_in_es gets them
+
+    :param songs: list of song dicts with a "Master_Key" field
+    :param chart_size: songs per chart (int)
+    :return: list of dicts of {master key: song dict}
+    """
+    charts = []
+    for i in range(0, len(songs), chart_size):
+        master_dict = {}
+        for song in songs[i:i + chart_size]:
+            song = dict(song)
+            master_dict[song.pop("Master_Key")] = song
+        charts.append(master_dict)
+    return charts
+
+
+if __name__ == "__main__":
+    with open('run.json', 'r') as file:
+        param = json.load(file)
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark ES ingest against an in-process fake")
+    parser.add_argument("songs", nargs="*",
+                        help="scraper output files or directories, "
+                             "songs are made up if not given")
+    parser.add_argument("--charts", type=int, default=100)
+    parser.add_argument("--chart-size", type=int, default=100)
+    parser.add_argument("--known-share", type=float, default=0.3,
+                        help="share of songs put in the index beforehand")
+    parser.add_argument("--threads", type=int, default=param["max_threads"])
+    parser.add_argument("--log-every", type=int, default=20,
+                        help="charts between usage logs")
+    parser.add_argument("--no-bulk", action="store_true")
+    parser.add_argument("--no-seen-index", action="store_true")
+    parser.add_argument("--bloom", action="store_true",
+                        help="check new songs against a saved Bloom "
+                             "filter instead of warming the seen index")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--per-doc-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--reject-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    total = args.charts * args.chart_size
+    if args.songs:
+        songs = load_songs(args.songs, total)
+    else:
+        songs = [synthetic_song(i, rng) for i in range(total)]
+    charts = make_charts(songs, args.chart_size)
+
+    fake = fakees.FakeElasticsearch(
+        latency_ms=args.latency_ms, per_doc_ms=args.per_doc_ms,
+        jitter_ms=args.jitter_ms, reject_rate=args.reject_rate,
+        seed=args.seed)
+    known = rng.sample(songs, int(len(songs) * args.known_share))
+    fake.load("song_data", {song["Master_Key"]: song for song in known})
+
+    seen_index_config = None
+    config = param.get("seen_index")
+    if not args.no_seen_index and config is not None and \
+            config.get("enabled", True):
+        seen_index_config = dict(config, bloom_path=None)
+    bloom_dir = None
+    if seen_index_config is not None and args.bloom:
+        bloom_dir = tempfile.TemporaryDirectory()
+        bloom = seenindex.BloomFilter(
+            config.get("bloom_capacity", 5000000),
+            config.get("bloom_error_rate", 0.001))
+        for song in known:
+            bloom.add(song["Master_Key"])
+        seen_index_config.update(
+            warm_from_es=False, single_writer=True,
+            bloom_path=os.path.join(bloom_dir.name, "seen.bloom"))
+        bloom.save(seen_index_config["bloom_path"])
+    bulk_config = None
+    config = param.get("es_bulk")
+    if not args.no_bulk and config is not None and config.get("enabled", True):
+        bulk_config = config
+
+    print("Benchmarking For Parameters:")
+    print("Songs :", len(songs))
+    print("Charts :", len(charts))
+    print("Known Share :", args.known_share)
+    print("Bulk? :", bulk_config is not None)
+    print("Seen Index? :", seen_index_config is not None)
+    print("Bloom Filter? :", bloom_dir is not None)
+
+    # Spotify asks for tokens on startup, the stub answers those
+    with tempfile.TemporaryDirectory() as fixtures_dir:
+        server = stubserver.StubServer(cache.ResponseCache(fixtures_dir))
+        adapter = stubserver.StubAdapter(stub_url=server.start())
+        with stubserver.redirect_requests(adapter):
+            begin = time.perf_counter()
+            LS = main.LyricScraper(
+                charts=[],
+                es=True,
+                max_threads=args.threads,
+                seen_index_config=seen_index_config,
+                bulk_config=bulk_config,
+                nltk_config=param.get("nltk"),
+                es_config={"startup_delay": 0},
+                es_client=fake)
+            startup = time.perf_counter() - begin
+        server.stop()
+    fake.clear_usage_stats()
+
+    put_stats = streamstats.OnlineStats()
+    log_stats = streamstats.OnlineStats()
+    usage_bytes = streamstats.OnlineStats()
+    lock = Lock()
+    stored = [0, 0]     # charts, songs
+
+    def put_chart(master_dict: dict):
+        # Like get_augmented_chart_list, one batched lookup and then
+        # only the new songs are stored
+        start = time.perf_counter()
+        known = LS.ES.songs_in_db(list(master_dict))
+        LS._put_data_in_es({key: val for key, val in master_dict.items()
+                            if key not in known}, checked=True)
+        elapsed = (time.perf_counter() - start) * 1000.0
+        with lock:
+            put_stats.add(elapsed)
+            stored[0] += 1
+            stored[1] += len(master_dict)
+            log_now = stored[0] % args.log_every == 0
+            records = stored[1]
+        if log_now:
+            with LS.log_lock:
+                start = time.perf_counter()
+                LS.ES.flush()
+                usage = LS.get_usage_reports()
+                LS.ES.log_usage(usage, time.perf_counter() - begin, records)
+                elapsed = (time.perf_counter() - start) * 1000.0
+            with lock:
+                log_stats.add(elapsed)
+                usage_bytes.add(len(json.dumps(usage)))
+
+    begin = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        list(pool.map(put_chart, charts))
+    LS.ES.close()
+    wall_time = time.perf_counter() - begin
+
+    report = {
+        "Songs": stored[1],
+        "Charts": stored[0],
+        "Startup_s": startup,
+        "Wall_Time_s": wall_time,
+        "Songs_Per_Sec": stored[1] / wall_time if wall_time else 0.0,
+        "Put_Chart": latency_report(put_stats),
+        "Log_Usage": latency_report(log_stats),
+        "Usage_Doc_KB": usage_bytes.get_report()["Mean"] / 1024.0
+        if log_stats.count else 0.0
+    }
+    report.update(LS.ES.get_usage_report())
+    report.update(fake.get_usage_report())
+    print(json.dumps(report, indent=4))
@@ -0,0 +1,137 @@
+"""
+Micro-benchmark of the lyric page extractors. Times the fast path
+(lxml, only the needed elements) against the full html.parser tree on
+saved pages and checks that both give the same output. Pages come from
+the on-disk response cache or from a directory with azlyrics/, genius/
+and metrolyrics/ subdirectories of .html files. Run from scraping/:
+
+    python -m benchmarks.parsers --cache cache/http --limit 200
+    python -m benchmarks.parsers --pages saved_pages
+"""
+import argparse
+import json
+import os
+import time
+
+from datasources import azlyrics
+from datasources import cache
+from datasources import genius
+from datasources import htmlparse
+from datasources import metrolyrics
+
+SOURCE_HOSTS = {
+    "azlyrics": ["azlyrics.com", "www.azlyrics.com"],
+    "genius": ["genius.com"],
+    "metrolyrics": ["www.metrolyrics.com"]
+}
+
+
+def cached_pages(cache_dir: str, hosts: list, limit=None) -> list:
+    """
+    :param cache_dir: response cache directory (str)
+    :param hosts: list of host names (str)
+    :param limit: max number of pages (int)
+    :return: list of html pages (str)
+    """
+    response_cache = cache.ResponseCache(cache_dir)
+    return [body.decode(encoding or 'utf-8', errors='replace')
+            for body, encoding in response_cache.saved_bodies(hosts,
+                                                              limit=limit)]
+
+
+def saved_pages(directory: str, limit=None) -> list:
+    """
+    :param directory: directory of .html files (str)
+    :param limit: max number of pages (int)
+    :return: list of html pages (str)
+    """
+    if not os.path.isdir(directory):
+        return []
+    names = sorted(name for name in os.listdir(directory)
+                   if name.endswith('.html'))[:limit]
+    pages = []
+    for name in names:
+        with open(os.path.join(directory, name), 'r', encoding='utf-8',
+                  errors='replace') as file:
+            pages.append(file.read())
+    return pages
+
+
+def extractors() -> dict:
+    """
+    :return: dict of {"source": callable taking (html_text, fast)}
+    """
+    AZ = azlyrics.AZLyricsScraper()
+    ML = metrolyrics.MetroLyrics()
+    return {
+        "azlyrics": lambda text, fast: AZ._extract_info(text, fast=fast),
+        "genius": lambda text, fast:
+            genius.GeniusScraper._extract_lyrics(text, fast),
+        "metrolyrics": lambda text, fast: ML._extract_lyrics(text, fast)
+    }
+
+
+def _outcome(extract, text: str, fast: bool):
+    try:
+        return extract(text, fast)
+    except Exception as e:
+        return "Raised " + type(e).__name__
+
+
+def _time_ms(extract, pages: list, fast: bool, repeat: int) -> float:
+    begin = time.perf_counter()
+    for _ in range(repeat):
+        for text in pages:
+            _outcome(extract, text, fast)
+    return (time.perf_counter() - begin) * 1000.0 / (repeat * len(pages))
+
+
+def benchmark(pages: list, extract, repeat=5) -> dict:
+    """
+    :param pages: list of html pages (str)
+    :param extract: callable taking (html_text, fast)
+    :param repeat: timed passes over all pages (int)
+    :return: dict of form {
+        "Pages": int,
+        "Mismatches": int,
+        "Reference_ms": float (per page),
+        "Fast_ms": float (per page),
+        "Speedup": float
+    }
+    """
+    mismatches = sum(_outcome(extract, text, False) !=
+                     _outcome(extract, text, True) for text in pages)
+    reference = _time_ms(extract, pages, False, repeat)
+    fast = _time_ms(extract, pages, True, repeat)
+    return {
+        "Pages": len(pages),
+        "Mismatches": mismatches,
+        "Reference_ms": reference,
+        "Fast_ms": fast,
+        "Speedup": reference / fast if fast else None
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark html extractors")
+    parser.add_argument("--cache", default=None,
+                        help="response cache directory to read pages from")
+    parser.add_argument("--pages", default=None,
+                        help="directory of saved pages, one subdirectory "
+                             "per source")
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    if args.cache is None and args.pages is None:
+        parser.error("one of --cache or --pages is required")
+
+    print("Fast Parser :", htmlparse.FAST_PARSER)
+    results = {}
+    for source, extract in extractors().items():
+        if args.pages is not None:
+            pages = saved_pages(os.path.join(args.pages, source), args.limit)
+        else:
+            pages = cached_pages(args.cache, SOURCE_HOSTS[source], args.limit)
+        if pages:
+            results[source] = benchmark(pages, extract, args.repeat)
+    print(json.dumps(results, indent=4))
@@ -0,0 +1,238 @@
+"""
+End to end throughput benchmark of LyricScraper without network access.
+Billboard, AZLyrics, Genius, Wikia, MetroLyrics, Spotify and MusiXMatch
+requests are answered by a local stub server from recorded fixtures,
+with optional latency and error injection. Reports songs/sec, latency
+per stage and per host, and peak RSS. Run from scraping/, first once
+online to record the fixtures, then as often as needed offline:
+
+    python -m benchmarks.pipeline --record --weeks 2
+    python -m benchmarks.pipeline --weeks 2 --latency-ms 50 --error-rate 0.01
+
+With --leased the run goes through a fresh lease table like a sharded
+run, and fails if any unit is left undone at the end.
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+import leases
+import main
+from benchmarks import stubserver
+from datasources import billboards
+from datasources import cache
+from processing import streamstats
+
+
+def latency_report(stats: streamstats.OnlineStats) -> dict:
+    """
+    :param stats: OnlineStats of latencies in ms
+    :return: dict of form {
+        "Count": int,
+        "Mean_ms": float,
+        "P50_ms": float,
+        "P95_ms": float,
+        "P99_ms": float,
+        "Max_ms": float
+    }
+    """
+    report = stats.get_report(percentiles=(50, 95, 99))
+    return {
+        "Count": report["Count"],
+        "Mean_ms": report["Mean"],
+        "P50_ms": report["P50"],
+        "P95_ms": report["P95"],
+        "P99_ms": report["P99"],
+        "Max_ms": report["Max"]
+    }
+
+
+def peak_rss_megabytes(who=resource.RUSAGE_SELF) -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(who).ru_maxrss
+    return rss / 1024.0 ** 2 if sys.platform == 'darwin' else rss / 1024.0
+
+
+class StageTimer:
+
+    def __init__(self):
+        """
+        Latency of the stages of a LyricScraper run: the chart fetch,
+        every data source, Spotify artist lookups, lyric analysis and
+        storage. Wraps the methods of one scraper object, the classes
+        are left alone
+        """
+        self.lock = threading.Lock()
+        self.stages = {}    # stage name: streamstats.OnlineStats of ms
+
+    def instrument(self, scraper: main.LyricScraper):
+        self._wrap(scraper.BB, "get_chart", "Billboard_Chart")
+        for source in scraper.data_sources:
+            self._wrap(source, "get_song_data", type(source).__name__)
+        self._wrap(scraper.MM, "get_song_data", type(scraper.MM).__name__)
+        self._wrap(scraper.SS, "get_artist_info_list", "Spotify_Artist_Info")
+        self._wrap(scraper, "_store_chart", "Store")
+
+        # Analysis may run in another process, its own timing comes back
+        # through record_stats either way
+        record_stats = scraper.Proc.record_stats
+
+        def timed_record_stats(stats, elapsed, *args):
+            self.add("Analysis", elapsed * 1000.0)
+            return record_stats(stats, elapsed, *args)
+        scraper.Proc.record_stats = timed_record_stats
+
+    def add(self, stage: str, elapsed_ms: float):
+        with self.lock:
+            if stage not in self.stages:
+                self.stages[stage] = streamstats.OnlineStats()
+            self.stages[stage].add(elapsed_ms)
+
+    def get_report(self) -> dict:
+        with self.lock:
+            return {stage: latency_report(stats)
+                    for stage, stats in sorted(self.stages.items())}
+
+    def _wrap(self, obj, method: str, stage: str):
+        func = getattr(obj, method)
+
+        def timed(*args, **kwargs):
+            begin = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(stage, (time.perf_counter() - begin) * 1000.0)
+        setattr(obj, method, timed)
+
+
+def stop_date(start_date: str, weeks: int) -> str:
+    date = start_date
+    for _ in range(weeks):
+        date = billboards.BillboardScraper.rewind_one_week(date)
+    return date
+
+
+if __name__ == "__main__":
+    with open('run.json', 'r') as file:
+        param = json.load(file)
+
+    parser = argparse.ArgumentParser(description="Benchmark LyricScraper")
+    parser.add_argument("--fixtures", default="cache/fixtures",
+                        help="directory of recorded responses")
+    parser.add_argument("--record", action="store_true",
+                        help="run against the real sites and save their "
+                             "responses as fixtures")
+    parser.add_argument("--charts", nargs="+", default=param["charts"][:2])
+    parser.add_argument("--start", default=param["start_date"])
+    parser.add_argument("--weeks", type=int, default=1)
+    parser.add_argument("--max-records", type=int, default=0)
+    parser.add_argument("--threads", type=int, default=param["max_threads"])
+    parser.add_argument("--fan-out", action="store_true",
+                        default=param.get("fan_out_sources", False))
+    parser.add_argument("--analysis-processes", type=int,
+                        default=param.get("analysis_processes", 0))
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--host-settings", type=json.loads, default=None,
+                        help='JSON of per host overrides, e.g. '
+                             '\'{"genius.com": {"latency_ms": 200}}\'')
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--leased", action="store_true",
+                        help="claim the units from a lease table")
+    args = parser.parse_args()
+
+    # Lexicons are left out so every run starts from the same state
+    analyst_settings = {}
+    for key in ["stem_cache", "pos_cache"]:
+        config = param.get(key)
+        if config is not None and config.get("enabled", True):
+            analyst_settings[key + "_config"] = dict(config, lexicon_path=None)
+
+    fixtures = cache.ResponseCache(args.fixtures, max_bytes=1024 ** 4,
+                                   default_ttl=None, not_found_ttl=None)
+    server = None
+    recorder = None
+    if args.record:
+        recorder = stubserver.Recorder(fixtures)
+        adapter = stubserver.StubAdapter(recorder=recorder)
+    else:
+        server = stubserver.StubServer(
+            fixtures, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+            error_rate=args.error_rate, error_status=args.error_status,
+            hosts=args.host_settings, seed=args.seed)
+        adapter = stubserver.StubAdapter(stub_url=server.start())
+
+    print("Benchmarking For Parameters:")
+    print("Charts :", args.charts)
+    print("Start Date : ", args.start)
+    print("Weeks :", args.weeks)
+    print("Mode :", "record" if args.record else "replay")
+
+    timer = StageTimer()
+    with tempfile.TemporaryDirectory() as output_dir, \
+            stubserver.redirect_requests(adapter):
+        LS = main.LyricScraper(
+            charts=args.charts,
+            start_date=args.start,
+            stop_date=stop_date(args.start, args.weeks),
+            backtrack=True,
+            es=False,
+            max_records=args.max_records,
+            max_threads=args.threads,
+            fan_out=args.fan_out,
+            pool_sizes=param.get("connection_pool_sizes"),
+            union_engine=param.get("bow_union_engine", "dict"),
+            nltk_config=param.get("nltk"),
+            analysis_workers=args.analysis_processes,
+            sink_config={"directory": output_dir},
+            **analyst_settings)
+        timer.instrument(LS)
+        lease_table = None
+        if args.leased:
+            lease_table = leases.LeaseTable(
+                os.path.join(output_dir, "leases.sqlite"))
+            lease_table.populate(LS.charts, LS.start_date, LS.stop_date,
+                                 billboards.BillboardScraper.rewind_one_week)
+        begin = time.perf_counter()
+        if lease_table is not None:
+            LS.run_leased(lease_table, poll_seconds=1)
+        else:
+            LS.run()
+        wall_time = time.perf_counter() - begin
+        if lease_table is not None:
+            lease_report = lease_table.get_usage_report()
+            units_left = lease_table.remaining()
+    if server is not None:
+        server.stop()
+    if recorder is not None:
+        recorder.save()
+
+    with adapter.lock:
+        hosts = {host: dict(latency_report(stats),
+                            Errors=adapter.errors.get(host, 0))
+                 for host, stats in sorted(adapter.latency.items())}
+    report = {
+        "Records_Processed": LS.records_processed,
+        "Unique_Songs": LS.unique_songs,
+        "Wall_Time_s": wall_time,
+        "Songs_Per_Sec": LS.records_processed / wall_time
+        if wall_time else 0.0,
+        "Peak_RSS_MB": peak_rss_megabytes(),
+        "Peak_RSS_Children_MB": peak_rss_megabytes(resource.RUSAGE_CHILDREN),
+        "Stages": timer.get_report(),
+        "Hosts": hosts
+    }
+    if server is not None:
+        report.update(server.get_usage_report())
+    if lease_table is not None:
+        report.update(lease_report)
+    print(json.dumps(report, indent=4))
+    if lease_table is not None and units_left:
+        sys.exit("Lease table units left undone: " + str(units_left))
@@ -0,0 +1,267 @@
+import json
+import os
+import random
+import socketserver
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from processing import streamstats
+
+# Header carrying the scheme and host a redirected request was meant for
+ORIGIN_HEADER = 'X-Stub-Origin'
+
+
+class Recorder:
+
+    def __init__(self, fixtures):
+        """
+        Saves live responses as fixtures for StubServer. Bodies go into
+        a cache.ResponseCache, redirects, which the cache doesn't keep,
+        into redirects.json next to it
+
+        :param fixtures: cache.ResponseCache with no TTLs
+        """
+        self.fixtures = fixtures
+        self.lock = threading.Lock()
+        self.redirects_path = os.path.join(fixtures.cache_dir,
+                                           'redirects.json')
+        self.redirects = load_redirects(self.redirects_path)
+
+    def record(self, url: str, response: requests.Response):
+        if response.is_redirect:
+            with self.lock:
+                self.redirects[url] = response.headers['Location']
+        else:
+            self.fixtures.store(url, None, response.status_code,
+                                response.content, response.encoding)
+
+    def save(self):
+        with self.lock:
+            with open(self.redirects_path, 'w') as file:
+                json.dump(self.redirects, file, indent=4)
+
+
+def load_redirects(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as file:
+        return json.load(file)
+
+
+class _ThreadingServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubServer:
+
+    def __init__(self, fixtures, latency_ms=0.0, jitter_ms=0.0,
+                 error_rate=0.0, error_status=503, hosts=None, seed=None):
+        """
+        Local HTTP server that answers requests meant for the real
+        sites with recorded responses. Clients send the original scheme
+        and host in the X-Stub-Origin header (see StubAdapter). Every
+        answer can be delayed and a share of them replaced by errors,
+        per host if needed. Spotify token requests get a made up token,
+        anything without a fixture gets a 404.
+
+        :param fixtures: cache.ResponseCache of recorded responses
+        :param latency_ms: delay of every answer (float)
+        :param jitter_ms: max random delay added on top (float)
+        :param error_rate: share of requests answered with error_status
+            instead (float between 0 and 1)
+        :param error_status: http status of injected errors (int)
+        :param hosts: dict of {"host": dict of latency_ms, jitter_ms,
+            error_rate and error_status} overriding the defaults
+        :param seed: random seed of jitter and errors
+        """
+        self.fixtures = fixtures
+        self.defaults = {"latency_ms": latency_ms, "jitter_ms": jitter_ms,
+                         "error_rate": error_rate, "error_status": error_status}
+        self.hosts = hosts or {}
+        self.random = random.Random(seed)
+        self.redirects = load_redirects(os.path.join(fixtures.cache_dir,
+                                                     'redirects.json'))
+        self.lock = threading.Lock()
+        self.server = None
+        self.thread = None
+
+        self.requests = 0
+        self.fixture_hits = 0
+        self.fixture_misses = 0
+        self.injected_errors = 0
+
+    def start(self) -> str:
+        """
+        Starts serving on a free local port
+
+        :return: base url of the server (str)
+        """
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                self._answer()
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                self._answer()
+
+            def _answer(self):
+                origin = self.headers.get(ORIGIN_HEADER, '')
+                status, headers, body = stub.respond(self.command,
+                                                     origin + self.path)
+                self.send_response(status)
+                for key, val in headers.items():
+                    self.send_header(key, val)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = _ThreadingServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+        return 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def respond(self, method: str, url: str) -> tuple:
+        """
+        Answers one request, after the host's latency
+
+        :param method: http method (str)
+        :param url: original url of the request (str)
+        :return: tuple of (status (int), headers (dict), body (bytes))
+        """
+        settings = dict(self.defaults)
+        settings.update(self.hosts.get(urlsplit(url).hostname, {}))
+        with self.lock:
+            self.requests += 1
+            delay = settings["latency_ms"] + \
+                self.random.uniform(0, settings["jitter_ms"])
+            failed = self.random.random() < settings["error_rate"]
+        time.sleep(delay / 1000.0)
+
+        if failed:
+            with self.lock:
+                self.injected_errors += 1
+            return settings["error_status"], {'Retry-After': '1'}, b''
+        if method == 'POST' and urlsplit(url).path.endswith('/api/token'):
+            body = json.dumps({"access_token": "stub", "token_type": "Bearer",
+                               "expires_in": 3600}).encode('utf-8')
+            return 200, {'Content-Type': 'application/json'}, body
+        if method == 'GET' and url in self.redirects:
+            return 301, {'Location': self.redirects[url]}, b''
+
+        cached = self.fixtures.lookup(url) if method == 'GET' else None
+        with self.lock:
+            if cached is None:
+                self.fixture_misses += 1
+            else:
+                self.fixture_hits += 1
+        if cached is None:
+            return 404, {}, b''
+        status, body, encoding = cached
+        return status, {'Content-Type': 'text/html; charset=' +
+                                        (encoding or 'utf-8')}, body
+
+    def get_usage_report(self) -> dict:
+        """
+        :return: dict of form {
+            "Stub_Server_Report": {
+                "Requests": int,
+                "Fixture_Hits": int,
+                "Fixture_Misses": int,
+                "Injected_Errors": int
+            }
+        }
+        """
+        with self.lock:
+            return {
+                "Stub_Server_Report": {
+                    "Requests": self.requests,
+                    "Fixture_Hits": self.fixture_hits,
+                    "Fixture_Misses": self.fixture_misses,
+                    "Injected_Errors": self.injected_errors
+                }
+            }
+
+
+class StubAdapter(HTTPAdapter):
+
+    def __init__(self, stub_url=None, recorder=None, pool_maxsize=100):
+        """
+        Transport adapter for every requests session of the process
+        (see redirect_requests). Sends requests to the stub server at
+        stub_url instead of the real host, or, without a stub_url, to
+        the real host while the recorder saves the responses. Times
+        every request per original host either way.
+
+        :param stub_url: base url of a StubServer (str)
+        :param recorder: Recorder to save live responses with
+        :param pool_maxsize: max pooled connections (int)
+        """
+        super().__init__(pool_connections=10, pool_maxsize=pool_maxsize)
+        self.stub_url = stub_url
+        self.recorder = recorder
+        self.lock = threading.Lock()
+        self.latency = {}   # host: streamstats.OnlineStats of ms
+        self.errors = {}    # host: count of error responses
+
+    def send(self, request, **kwargs):
+        url = request.url
+        parts = urlsplit(url)
+        if self.stub_url is not None:
+            request.headers[ORIGIN_HEADER] = parts.scheme + '://' + parts.netloc
+            request.url = self.stub_url + (parts.path or '/') + \
+                ('?' + parts.query if parts.query else '')
+            kwargs['proxies'] = {}
+        begin = time.perf_counter()
+        try:
+            response = super().send(request, **kwargs)
+        finally:
+            request.url = url
+        elapsed = (time.perf_counter() - begin) * 1000.0
+        response.url = url
+        if self.recorder is not None and request.method == 'GET':
+            self.recorder.record(url, response)
+
+        with self.lock:
+            if parts.hostname not in self.latency:
+                self.latency[parts.hostname] = streamstats.OnlineStats()
+            self.latency[parts.hostname].add(elapsed)
+            if response.status_code >= 500 or response.status_code == 429:
+                self.errors[parts.hostname] = \
+                    self.errors.get(parts.hostname, 0) + 1
+        return response
+
+
+@contextmanager
+def redirect_requests(adapter: HTTPAdapter):
+    """
+    Routes every requests session of the process through adapter while
+    the context is open, including the sessions third party clients
+    (billboard.py, PyLyrics, pymusixmatch) make for themselves
+
+    :param adapter: StubAdapter
+    """
+    get_adapter = requests.Session.get_adapter
+    requests.Session.get_adapter = lambda session, url: adapter
+    try:
+        yield adapter
+    finally:
+        requests.Session.get_adapter = get_adapter
@@ -0,0 +1,184 @@
+import json
+import os
+import sqlite3
+import threading
+import zlib
+
+
+class Checkpoint:
+
+    def __init__(self, path='cache/checkpoint.sqlite'):
+        """
+        Crash safe journal of a run's progress. Finished (chart, date)
+        units are recorded so a restarted run can skip them, and every
+        song of the unit in progress is journaled as it's scraped, so a
+        unit cut short by a crash only has to redo the songs that were
+        in flight. Writes go to an sqlite WAL, which survives the
+        process dying at any point.
+
+        :param path: path to sqlite file (str)
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path, isolation_level=None,
+                                  check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS units ('
+                        'chart TEXT, date TEXT, PRIMARY KEY (chart, date))')
+        self.db.execute('CREATE TABLE IF NOT EXISTS songs ('
+                        'chart TEXT, date TEXT, key TEXT, data BLOB, '
+                        'PRIMARY KEY (chart, date, key))')
+        self.done = set(self.db.execute('SELECT chart, date FROM units'))
+
+        self.units_skipped = 0
+        self.units_completed = 0
+        self.songs_restored = 0
+        self.songs_journaled = 0
+
+    def reset(self):
+        """
+        Forgets all progress, for a run that should start over
+
+        :return: None
+        """
+        with self.lock:
+            self.db.execute('DELETE FROM units')
+            self.db.execute('DELETE FROM songs')
+            self.done = set()
+
+    def is_done(self, chart: str, date: str) -> bool:
+        """
+        Checks if a unit was finished by this or an earlier run,
+        and counts it as skipped if so
+
+        :param chart: name of billboard chart (str)
+        :param date: date of chart (str) (YYYY-MM-DD)
+        :return: boolean
+        """
+        with self.lock:
+            done = (chart, date) in self.done
+            if done:
+                self.units_skipped += 1
+        return done
+
+    def start_song(self, chart: str, date: str, key: str):
+        """
+        Records that a song of a unit is being scraped
+
+        :param chart: name of billboard chart (str)
+        :param date: date of chart (str) (YYYY-MM-DD)
+        :param key: unique key identifying song (str)
+        :return: None
+        """
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO songs VALUES (?, ?, ?, ?)',
+                            (chart, date, key, None))
+
+    def finish_song(self, chart: str, date: str, key: str, song_dict: dict):
+        """
+        Journals a scraped song so it survives a crash before
+        its unit is done
+
+        :param chart: name of billboard chart (str)
+        :param date: date of chart (str) (YYYY-MM-DD)
+        :param key: unique key identifying song (str)
+        :param song_dict: dict of aggregate song data
+        :return: None
+        """
+        blob = zlib.compress(json.dumps(song_dict).encode('utf-8'))
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO songs VALUES (?, ?, ?, ?)',
+                            (chart, date, key, blob))
+            self.songs_journaled += 1
+
+    def restore_songs(self, chart: str, date: str) -> dict:
+        """
+        Reads the songs an earlier, interrupted run already scraped
+        for a unit
+
+        :param chart: name of billboard chart (str)
+        :param date: date of chart (str) (YYYY-MM-DD)
+        :return: dict of {"key": song dict}
+        """
+        with self.lock:
+            rows = self.db.execute('SELECT key, data FROM songs '
+                                   'WHERE chart = ? AND date = ? '
+                                   'AND data IS NOT NULL',
+                                   (chart, date)).fetchall()
+            self.songs_restored += len(rows)
+        return {key: json.loads(zlib.decompress(data).decode('utf-8'))
+                for key, data in rows}
+
+    def complete(self, units: list):
+        """
+        Marks units as done and drops their journaled songs, only call
+        once the units' data is durably stored
+
+        :param units: list of (chart, date) tuples
+        :return: None
+        """
+        if not units:
+            return
+        with self.lock:
+            self.db.execute('BEGIN')
+            self.db.executemany('INSERT OR IGNORE INTO units VALUES (?, ?)',
+                                units)
+            self.db.executemany('DELETE FROM songs '
+                                'WHERE chart = ? AND date = ?', units)
+            self.db.execute('COMMIT')
+            self.done.update(units)
+            self.units_completed += len(units)
+
+    def get_resume_report(self) -> dict:
+        """
+        Returns what an earlier run left behind
+
+        :return: dict of form {
+            "Units_Done": int,
+            "Songs_Journaled": int,
+            "Songs_In_Flight": int
+        }
+        """
+        with self.lock:
+            journaled, in_flight = self.db.execute(
+                'SELECT COUNT(data), COUNT(*) - COUNT(data) '
+                'FROM songs').fetchone()
+            return {
+                "Units_Done": len(self.done),
+                "Songs_Journaled": journaled,
+                "Songs_In_Flight": in_flight
+            }
+
+    def get_usage_report(self) -> dict:
+        """
+        Returns checkpoint activity since the last clear
+
+        :return: dict of form {
+            "Checkpoint_Report": {
+                "Units_Skipped": int,
+                "Units_Completed": int,
+                "Songs_Restored": int,
+                "Songs_Journaled": int
+            }
+        }
+        """
+        with self.lock:
+            return {
+                "Checkpoint_Report": {
+                    "Units_Skipped": self.units_skipped,
+                    "Units_Completed": self.units_completed,
+                    "Songs_Restored": self.songs_restored,
+                    "Songs_Journaled": self.songs_journaled
+                }
+            }
+
+    def clear_usage_stats(self):
+        with self.lock:
+            self.units_skipped = 0
+            self.units_completed = 0
+            self.songs_restored = 0
+            self.songs_journaled = 0
@@ -1,17 +1,32 @@
-from bs4 import BeautifulSoup
-import requests
 import string
 import json
+from datasources import htmlparse
+from datasources import sessions
+from processing import streamstats
+
+# Elements the extractors read: the bare lyrics div, the writer
+# credits and the album panel
+PAGE_XPATH = '//div[not(@class) and not(@id)] | //small | ' \
+             '//div[@class="panel songlist-panel noprint"]'
 
 
 class AZLyricsScraper:
 
-    def __init__(self):
+    def __init__(self, session_pool=None):
+        """
+        Initialize AZLyricsScraper Object
+
+        :param session_pool: shared sessions.SessionPool, a private
+            one is made if not given
+        """
+        self.session_pool = session_pool or sessions.SessionPool()
+        self.hosts = ['azlyrics.com', 'www.azlyrics.com']
         self.bad_response_count = 0     # Number of bad/null/404 responses from azlyrics
         self.missed_genre = 0           # Number of items that couldn't find genres
         self.missed_album_year = 0      # Number of items that couldn't find album and year
         self.missed_writer = 0          # Number of items that couldn't find writers
         self.total_attempts = 0         # Total attempts to process a song
+        self.latency = streamstats.LatencyTracker()     # Fetch, Parse
         self.headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) '
                                       'AppleWebKit/537.36 (KHTML, like Gecko) '
                                       'Chrome/60.0.3112.113 Safari/537.36'}
@@ -32,15 +47,48 @@ class AZLyricsScraper:
                               song_title=track_title)
         self.total_attempts += 1
         try:
-            response = self._get_html(url)
+            with self.latency.time("Fetch"):
+                response = self._get_html(url)
         except:
             self.bad_response_count += 1
             return {"AZ_Lyrics": ""}
         if response is "":
             self.bad_response_count += 1
             return {"AZ_Lyrics": ""}
-        return self._extract_info(html_text=response,
-                                  flatten_lyrics=flatten_lyrics)
+        with self.latency.time("Parse"):
+            return self._extract_info(html_text=response,
+                                      flatten_lyrics=flatten_lyrics)
+
+    async def get_song_data_async(self, session, artist_name: str,
+                                  track_title: str,
+                                  flatten_lyrics=False) -> dict:
+        """
+        Async variant of get_song_data, fetches the page through
+        the given aiohttp session so many songs can be in flight
+        on one event loop
+
+        :param session: aiohttp ClientSession
+        :param artist_name: name of artist (str)
+        :param track_title: name of track (str)
+        :param flatten_lyrics: boolean option - true
+            to get rid of all punctuation and uppercase in lyrics
+        :return: dict of all data (see _extract_info for structure)
+        """
+        url = self._build_url(artist_name=artist_name,
+                              song_title=track_title)
+        self.total_attempts += 1
+        try:
+            with self.latency.time("Fetch"):
+                response = await self._get_html_async(session, url)
+        except Exception:
+            self.bad_response_count += 1
+            return {"AZ_Lyrics": ""}
+        if response == "":
+            self.bad_response_count += 1
+            return {"AZ_Lyrics": ""}
+        with self.latency.time("Parse"):
+            return self._extract_info(html_text=response,
+                                      flatten_lyrics=flatten_lyrics)
 
     def get_usage_report(self):
         """
@@ -54,7 +102,25 @@ class AZLyricsScraper:
             "Missed_Album_and_Year": int,
             "Missed_Genre": int,
             "Bad_Response_Count": int,
-            "Bad_Response_Items": self.bad_response_items
+            "Connection_Pool": {
+                "Requests": int,
+                "New_Connections": int,
+                "Reused_Connections": int
+            },
+            "Response_Cache": {
+                "Hits": int,
+                "Misses": int
+            },
+            "Rate_Limit": {
+                "host": dict (see ratelimit.RateLimiter)
+            },
+            "Latency": {
+                "Fetch": dict (see streamstats.LatencyHistogram),
+                "Parse": dict
+            },
+            "Request_Latency": {
+                "host": dict (see streamstats.LatencyHistogram)
+            }
         }
         """
         usage = {
@@ -63,7 +129,16 @@ class AZLyricsScraper:
                 "Missed_Writer": self.missed_writer,
                 "Missed_Album_and_Year": self.missed_album_year,
                 "Missed_Genre": self.missed_genre,
-                "Bad_Response_Count": self.bad_response_count
+                "Bad_Response_Count": self.bad_response_count,
+                "Connection_Pool":
+                    self.session_pool.get_usage_report(self.hosts),
+                "Response_Cache":
+                    self.session_pool.get_cache_report(self.hosts),
+                "Rate_Limit":
+                    self.session_pool.get_rate_report(self.hosts),
+                "Latency": self.latency.get_report(),
+                "Request_Latency":
+                    self.session_pool.get_latency_report(self.hosts)
             }
         }
         return usage
@@ -74,8 +149,11 @@ class AZLyricsScraper:
         self.missed_album_year = 0
         self.missed_album_year = 0
         self.bad_response_count = 0
+        self.latency.clear_usage_stats()
+        self.session_pool.clear_usage_stats(self.hosts)
 
-    def _extract_info(self, html_text: str, flatten_lyrics=False) -> dict:
+    def _extract_info(self, html_text: str, flatten_lyrics=False,
+                      fast=True) -> dict:
         """
         Top level method that takes in the html text returned from
         the http request and parses it into a dictionary of lyrics,
@@ -84,6 +162,8 @@ class AZLyricsScraper:
         :param html_text: html from AZ lyrics web page
         :param flatten_lyrics: boolean option to get rid of punctuation and
             upper case letters in the lyrics
+        :param fast: boolean option - false to parse the whole page
+            with html.parser instead of only the needed elements
         :return: dictionary of all parsed values, looks like:
             {
              "lyrics": str,
@@ -96,7 +176,7 @@ class AZLyricsScraper:
              "Source": "str",
             }
         """
-        soup = BeautifulSoup(html_text, 'html.parser')
+        soup = htmlparse.parse(html_text, xpath=PAGE_XPATH, fast=fast)
 
         data_dict = self._get_lyrics(soup, flatten_lyrics)
         data_dict.update(self._get_writers(soup))
@@ -165,11 +245,24 @@ class AZLyricsScraper:
         :param url: url of azlyrics as string
         :return: html page as string
         """
-        r = requests.get(url, headers=self.headers)
+        r = self.session_pool.get(url, headers=self.headers)
         if r.status_code != 200:
             return ""
         return r.text
 
+    async def _get_html_async(self, session, url: str) -> str:
+        """
+        Async variant of _get_html
+
+        :param session: aiohttp ClientSession
+        :param url: url of azlyrics as string
+        :return: html page as string
+        """
+        async with session.get(url, headers=self.headers) as r:
+            if r.status != 200:
+                return ""
+            return await r.text()
+
     def _build_url(self, artist_name: str, song_title: str):
         """
         Builds url to access azlyrics for given artist's song
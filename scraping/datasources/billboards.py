@@ -1,13 +1,34 @@
 import billboard
 import json
 import datetime
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datasources import ratelimit
+from processing import streamstats
+
+# Stand-in for billboard.ChartEntry when a chart is read from the store
+ChartEntry = namedtuple('ChartEntry', ['rank', 'artist', 'title', 'peakPos'])
 
 
 class BillboardScraper:
 
-    def __init__(self):
+    def __init__(self, chart_store=None, limiter=None):
+        """
+        Initialize BillboardScraper Object
+
+        :param chart_store: chartstore.ChartStore to read charts from
+            before going to the network, none if not given
+        :param limiter: ratelimit.RateLimiter chart fetches wait on,
+            no limits if not given
+        """
+        self.chart_store = chart_store
+        self.limiter = limiter
+        self.host = 'www.billboard.com'
         self.charts_processed = 0   # total number of charts processed
         self.entries_processed = 0  # total number of entries processed
+        self.store_hits = 0         # charts read from the chart store
+        self.charts_fetched = 0     # charts fetched from billboard
+        self.latency = streamstats.LatencyTracker()     # Store, Fetch
 
     def get_chart(self, chart_name: str, date_str=None) -> dict:
         """
@@ -21,17 +42,51 @@ class BillboardScraper:
         """
         self.charts_processed += 1
         master_dict = {}
-        try:
-            chart = billboard.ChartData(name=chart_name, date=date_str)
-        except billboard.BillboardParseException:
-            return {"Error": "Parse"}
-        except billboard.BillboardNotFoundException:
-            return {"Error": "NotFound"}
-        for song in chart:
+        entries = self._get_chart_entries(chart_name, date_str)
+        if isinstance(entries, dict):
+            return entries
+        for song in entries:
             master_dict.update(
                 self._extract_song_info(song, chart_name, date_str))
         return master_dict
 
+    def prefetch_range(self, chart_names: list, start_date: str,
+                       stop_date: str, max_threads=5) -> int:
+        """
+        Fills the chart store with every week of the given charts
+        from start_date back to stop_date, skipping charts that are
+        already stored
+
+        :param chart_names: list of chart names (str)
+        :param start_date: newest date to fetch (str) (YYYY-MM-DD)
+        :param stop_date: oldest date to fetch (str) (YYYY-MM-DD)
+        :param max_threads: number of charts fetched at once (int)
+        :return: number of charts fetched from billboard (int)
+        """
+        if self.chart_store is None:
+            raise ValueError("prefetch_range needs a chart store")
+
+        todo = []
+        cur_date = start_date
+        while cur_date > stop_date:
+            for chart_name in chart_names:
+                if not self.chart_store.has(chart_name, cur_date):
+                    todo.append((chart_name, cur_date))
+            cur_date = self.rewind_one_week(cur_date)
+
+        fetched = 0
+        with ThreadPoolExecutor(max_workers=max_threads) as pool:
+            results = pool.map(lambda args: self._get_chart_entries(*args),
+                               todo)
+            for (chart_name, date_str), entries in zip(todo, results):
+                if isinstance(entries, dict):
+                    print({"Bad Billboard Chart": entries["Error"],
+                           "Chart": chart_name, "Date": date_str})
+                else:
+                    fetched += 1
+                    print("Prefetched :", chart_name, ":", date_str)
+        return fetched
+
     def get_usage_report(self):
         """
         returns dict of usage of billboards
@@ -39,14 +94,28 @@ class BillboardScraper:
         :return: dict of form {
             "Billboard_Usage_Report": {
                 "Charts_Processed": int,
-                "Entries_Processed": int
+                "Entries_Processed": int,
+                "Chart_Store_Hits": int,
+                "Charts_Fetched": int,
+                "Rate_Limit": {
+                    "host": dict (see ratelimit.RateLimiter)
+                },
+                "Latency": {
+                    "Store": dict (see streamstats.LatencyHistogram),
+                    "Fetch": dict
+                }
             }
         }
         """
         usage = {
             "Billboard_Usage_Report": {
                 "Charts_Processed": self.charts_processed,
-                "Entries_Processed": self.entries_processed
+                "Entries_Processed": self.entries_processed,
+                "Chart_Store_Hits": self.store_hits,
+                "Charts_Fetched": self.charts_fetched,
+                "Rate_Limit": self.limiter.get_usage_report([self.host])
+                if self.limiter is not None else {},
+                "Latency": self.latency.get_report()
             }
         }
         return usage
@@ -54,6 +123,50 @@ class BillboardScraper:
     def clear_usage_stats(self):
         self.charts_processed = 0
         self.entries_processed = 0
+        self.store_hits = 0
+        self.charts_fetched = 0
+        self.latency.clear_usage_stats()
+        if self.limiter is not None:
+            self.limiter.clear_usage_stats([self.host])
+
+    def _get_chart_entries(self, chart_name: str, date_str=None):
+        """
+        Gets the raw entries of a chart, from the chart store if it has
+        them, otherwise from billboard (storing them for next time).
+        The latest chart (date_str None) is never stored.
+
+        :param chart_name: name of chart as str (i.e. hot-100)
+        :param date_str: date of chart to poll (str) (YYYY-MM-DD)
+        :return: list of ChartEntry, or dict of {"Error": str}
+        """
+        use_store = self.chart_store is not None and date_str is not None
+        if use_store:
+            with self.latency.time("Store"):
+                stored = self.chart_store.get(chart_name, date_str)
+            if stored is not None:
+                self.store_hits += 1
+                return [ChartEntry(**entry) for entry in stored]
+
+        with ratelimit.limited(self.limiter, self.host) as outcome:
+            try:
+                with self.latency.time("Fetch"):
+                    chart = billboard.ChartData(name=chart_name,
+                                                date=date_str)
+            except billboard.BillboardParseException:
+                outcome["status"] = 200
+                return {"Error": "Parse"}
+            except billboard.BillboardNotFoundException:
+                outcome["status"] = 404
+                return {"Error": "NotFound"}
+            outcome["status"] = 200
+        self.charts_fetched += 1
+        entries = [ChartEntry(rank=song.rank, artist=song.artist,
+                              title=song.title, peakPos=song.peakPos)
+                   for song in chart]
+        if use_store:
+            self.chart_store.put(chart_name, date_str,
+                                 [entry._asdict() for entry in entries])
+        return entries
 
     def _extract_song_info(self, song, chart: str,
                            date: str) -> dict:
@@ -0,0 +1,369 @@
+import asyncio
+import functools
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+
+class ResponseCache:
+
+    # Params that don't change the response and would otherwise
+    # split the same request across many keys:
+    IGNORED_PARAMS = ('access_token',)
+    CACHEABLE_STATUSES = (200, 404)
+
+    def __init__(self, cache_dir='cache/http', max_bytes=2 * 1024 ** 3,
+                 ttls=None, default_ttl=0, not_found_ttl=86400):
+        """
+        Persistent on-disk cache of http responses. Bodies are stored
+        gzipped in files named by the hash of the normalized request,
+        an sqlite index keeps size and access time of every entry so
+        the least recently used ones can be evicted once the cache
+        grows past max_bytes.
+
+        TTLs are set per host (i.e. per source) in seconds. A TTL of
+        None never expires, a TTL of 0 turns caching off for that host.
+        404s expire after not_found_ttl at the latest, lyrics that
+        aren't posted yet are looked for again.
+
+        :param cache_dir: directory to keep the cache in (str)
+        :param max_bytes: size cap of all cached bodies (int)
+        :param ttls: dict of {"host": ttl in seconds or None}
+        :param default_ttl: ttl of hosts not in ttls
+        :param not_found_ttl: max ttl of 404 responses in seconds, None
+            to keep them as long as the host's other responses
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttls = ttls or {}
+        self.default_ttl = default_ttl
+        self.not_found_ttl = not_found_ttl
+        self.lock = threading.Lock()
+
+        self.hits = {}          # per host count of cache hits
+        self.misses = {}        # per host count of cache misses
+        self.evictions = 0      # entries evicted to stay under max_bytes
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(self.cache_dir, 'index.sqlite'),
+                                  check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS entries ('
+                        'key TEXT PRIMARY KEY, host TEXT, status INTEGER, '
+                        'encoding TEXT, size INTEGER, created REAL, '
+                        'last_access REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS entries_lru '
+                        'ON entries (last_access)')
+        self.db.commit()
+        self.total_bytes = self.db.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    def cacheable(self, url: str) -> bool:
+        """
+        Checks if responses from the url's host are cached at all
+
+        :param url: url of request (str)
+        :return: boolean
+        """
+        return self._ttl(urlsplit(url).hostname) != 0
+
+    def lookup(self, url: str, params=None):
+        """
+        Looks up a cached response for a GET request
+
+        :param url: url of request (str)
+        :param params: dict of query params
+        :return: tuple of (status (int), body (bytes), encoding (str))
+            or None on a miss
+        """
+        key = self.request_key(url, params)
+        host = urlsplit(url).hostname
+        now = time.time()
+        with self.lock:
+            row = self.db.execute('SELECT status, encoding, created FROM entries '
+                                  'WHERE key = ?', (key,)).fetchone()
+            ttl = None if row is None else self._ttl(host, row[0])
+            if row is not None and ttl is not None and now - row[2] > ttl:
+                self._delete(key)
+                row = None
+            body = None
+            if row is not None:
+                try:
+                    with gzip.open(self._path(key), 'rb') as file:
+                        body = file.read()
+                except (OSError, EOFError):
+                    self._delete(key)
+            if body is None:
+                self.misses[host] = self.misses.get(host, 0) + 1
+                return None
+            self.db.execute('UPDATE entries SET last_access = ? WHERE key = ?',
+                            (now, key))
+            self.db.commit()
+            self.hits[host] = self.hits.get(host, 0) + 1
+        return row[0], body, row[1]
+
+    def store(self, url: str, params, status: int, body: bytes,
+              encoding: str):
+        """
+        Stores the response of a GET request, evicting least recently
+        used entries if the cache is over its size cap
+
+        :param url: url of request (str)
+        :param params: dict of query params
+        :param status: http status code (int)
+        :param body: raw response body (bytes)
+        :param encoding: text encoding of the body (str)
+        :return: None
+        """
+        if status not in self.CACHEABLE_STATUSES or not self.cacheable(url):
+            return
+        key = self.request_key(url, params)
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Unique temp name, containers sharing the cache volume can
+        # have the same pids and thread idents
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path),
+                                         suffix='.tmp', delete=False) as tmp:
+            with gzip.GzipFile(fileobj=tmp, mode='wb') as file:
+                file.write(body)
+        os.replace(tmp.name, path)
+        size = os.path.getsize(path)
+        now = time.time()
+
+        with self.lock:
+            old = self.db.execute('SELECT size FROM entries WHERE key = ?',
+                                  (key,)).fetchone()
+            if old is not None:
+                self.total_bytes -= old[0]
+            self.db.execute('INSERT OR REPLACE INTO entries VALUES '
+                            '(?, ?, ?, ?, ?, ?, ?)',
+                            (key, urlsplit(url).hostname, status, encoding,
+                             size, now, now))
+            self.total_bytes += size
+            self._evict()
+            self.db.commit()
+
+    def saved_bodies(self, hosts: list, status=200, limit=None):
+        """
+        Reads cached bodies of some hosts without touching hit counts
+        or access times, e.g. to replay saved pages offline
+
+        :param hosts: list of host names (str)
+        :param status: http status code of the responses (int)
+        :param limit: max number of bodies (int), all if not given
+        :return: generator of (body (bytes), encoding (str)) tuples
+        """
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT key, encoding FROM entries WHERE status = ? AND '
+                'host IN (' + ','.join('?' * len(hosts)) + ') '
+                'ORDER BY created LIMIT ?',
+                [status] + list(hosts) + [-1 if limit is None else limit]
+            ).fetchall()
+        for key, encoding in rows:
+            try:
+                with gzip.open(self._path(key), 'rb') as file:
+                    yield file.read(), encoding
+            except (OSError, EOFError):
+                continue
+
+    def get_usage_report(self, hosts=None) -> dict:
+        """
+        Returns hit and miss counts, of all hosts or only the
+        given ones
+
+        :param hosts: list of host names (str), None for all hosts
+        :return: dict of form {
+            "Hits": int,
+            "Misses": int
+        }
+        """
+        with self.lock:
+            if hosts is None:
+                hosts = set(self.hits.keys()) | set(self.misses.keys())
+            return {
+                "Hits": sum(self.hits.get(h, 0) for h in hosts),
+                "Misses": sum(self.misses.get(h, 0) for h in hosts)
+            }
+
+    def get_cache_report(self) -> dict:
+        """
+        Returns usage report of the whole cache
+
+        :return: dict of form {
+            "Response_Cache_Usage_Report": {
+                "Hits": int,
+                "Misses": int,
+                "Evictions": int,
+                "Entries": int,
+                "Megabytes": float
+            }
+        }
+        """
+        usage = self.get_usage_report()
+        with self.lock:
+            usage["Evictions"] = self.evictions
+            usage["Entries"] = self.db.execute(
+                'SELECT COUNT(*) FROM entries').fetchone()[0]
+            usage["Megabytes"] = self.total_bytes / 1024.0 ** 2
+        return {"Response_Cache_Usage_Report": usage}
+
+    def clear_usage_stats(self, hosts=None):
+        with self.lock:
+            for host in (hosts if hosts is not None else list(self.hits.keys())):
+                self.hits.pop(host, None)
+            for host in (hosts if hosts is not None else list(self.misses.keys())):
+                self.misses.pop(host, None)
+            if hosts is None:
+                self.evictions = 0
+
+    def request_key(self, url: str, params=None) -> str:
+        """
+        Hashes a normalized GET request: lower case scheme and host,
+        query params merged from the url and params dict, sorted,
+        and stripped of IGNORED_PARAMS
+
+        :param url: url of request (str)
+        :param params: dict of query params
+        :return: hex digest (str)
+        """
+        parts = urlsplit(url)
+        query = parse_qsl(parts.query, keep_blank_values=True)
+        if params:
+            query += [(k, str(v)) for k, v in params.items()]
+        query = sorted((k, v) for k, v in query
+                       if k not in self.IGNORED_PARAMS)
+        normalized = 'GET ' + parts.scheme.lower() + '://' + \
+                     parts.netloc.lower() + parts.path + '?' + urlencode(query)
+        return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+    def _ttl(self, host: str, status=200):
+        ttl = self.ttls.get(host, self.default_ttl)
+        if status == 404 and self.not_found_ttl is not None:
+            return self.not_found_ttl if ttl is None \
+                else min(ttl, self.not_found_ttl)
+        return ttl
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key + '.gz')
+
+    def _delete(self, key: str):
+        """
+        Removes an entry from index and disk, caller holds the lock
+
+        :param key: request key (str)
+        :return: None
+        """
+        row = self.db.execute('SELECT size FROM entries WHERE key = ?',
+                              (key,)).fetchone()
+        if row is not None:
+            self.total_bytes -= row[0]
+        self.db.execute('DELETE FROM entries WHERE key = ?', (key,))
+        self.db.commit()
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _evict(self):
+        """
+        Drops least recently used entries until the cache is under
+        its size cap, caller holds the lock
+
+        :return: None
+        """
+        while self.total_bytes > self.max_bytes:
+            rows = self.db.execute('SELECT key, size FROM entries '
+                                   'ORDER BY last_access LIMIT 100').fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self.total_bytes <= self.max_bytes:
+                    break
+                self.db.execute('DELETE FROM entries WHERE key = ?', (key,))
+                self.total_bytes -= size
+                self.evictions += 1
+                try:
+                    os.remove(self._path(key))
+                except OSError:
+                    pass
+
+
+class CachingClientSession:
+
+    def __init__(self, session, cache: ResponseCache, executor=None):
+        """
+        Wraps an aiohttp ClientSession so the async scrapers read
+        from and fill the same ResponseCache as the sync ones. Cache
+        lookups and stores hit sqlite and disk, so they run on an
+        executor instead of stalling the event loop
+
+        :param session: aiohttp ClientSession
+        :param cache: ResponseCache
+        :param executor: concurrent.futures executor for cache calls,
+            the event loop's default one if not given
+        """
+        self.session = session
+        self.cache = cache
+        self.executor = executor
+
+    def get(self, url: str, params=None, **kwargs):
+        """
+        Same call signature as aiohttp's ClientSession.get, use
+        with "async with"
+
+        :param url: url of request (str)
+        :param params: dict of query params
+        :return: async context manager yielding a response
+        """
+        if not self.cache.cacheable(url):
+            return self.session.get(url, params=params, **kwargs)
+        return _CachingRequest(self, url, params, kwargs)
+
+
+class _CachingRequest:
+
+    def __init__(self, client, url, params, kwargs):
+        self.client = client
+        self.url = url
+        self.params = params
+        self.kwargs = kwargs
+
+    async def __aenter__(self):
+        cache = self.client.cache
+        cached = await self._run_blocking(cache.lookup, self.url, self.params)
+        if cached is None:
+            async with self.client.session.get(self.url, params=self.params,
+                                               **self.kwargs) as response:
+                cached = (response.status, await response.read(),
+                          response.charset)
+            await self._run_blocking(cache.store, self.url, self.params,
+                                     *cached)
+        return _CachedResponse(*cached)
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def _run_blocking(self, func, *args):
+        return asyncio.get_event_loop().run_in_executor(
+            self.client.executor, functools.partial(func, *args))
+
+
+class _CachedResponse:
+
+    def __init__(self, status, body, encoding):
+        self.status = status
+        self.body = body
+        self.encoding = encoding or 'utf-8'
+
+    async def text(self):
+        return self.body.decode(self.encoding, errors='replace')
+
+    async def json(self):
+        return json.loads(await self.text())
@@ -0,0 +1,79 @@
+import json
+import os
+import sqlite3
+import threading
+import zlib
+
+
+class ChartStore:
+
+    def __init__(self, path='cache/charts.sqlite'):
+        """
+        Local store of historical billboard charts. A chart for a given
+        name and date never changes once published, so it only has to
+        be fetched over the network once. Entries are kept as zlib
+        compressed JSON in an sqlite table keyed by (chart, date).
+
+        :param path: path to sqlite file (str)
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS charts ('
+                        'chart TEXT, date TEXT, entries BLOB, '
+                        'PRIMARY KEY (chart, date))')
+        self.db.commit()
+
+    def get(self, chart_name: str, date_str: str):
+        """
+        Reads a stored chart
+
+        :param chart_name: name of chart as str (i.e. hot-100)
+        :param date_str: date of chart (str) (YYYY-MM-DD)
+        :return: list of entry dicts of form {
+            "rank": int,
+            "artist": str,
+            "title": str,
+            "peakPos": int
+        } or None if the chart isn't stored
+        """
+        with self.lock:
+            row = self.db.execute('SELECT entries FROM charts '
+                                  'WHERE chart = ? AND date = ?',
+                                  (chart_name, date_str)).fetchone()
+        if row is None:
+            return None
+        return json.loads(zlib.decompress(row[0]).decode('utf-8'))
+
+    def put(self, chart_name: str, date_str: str, entries: list):
+        """
+        Stores a chart
+
+        :param chart_name: name of chart as str (i.e. hot-100)
+        :param date_str: date of chart (str) (YYYY-MM-DD)
+        :param entries: list of entry dicts (see get)
+        :return: None
+        """
+        blob = zlib.compress(json.dumps(entries).encode('utf-8'))
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO charts VALUES (?, ?, ?)',
+                            (chart_name, date_str, blob))
+            self.db.commit()
+
+    def has(self, chart_name: str, date_str: str) -> bool:
+        """
+        Checks if a chart is stored
+
+        :param chart_name: name of chart as str (i.e. hot-100)
+        :param date_str: date of chart (str) (YYYY-MM-DD)
+        :return: boolean
+        """
+        with self.lock:
+            row = self.db.execute('SELECT 1 FROM charts '
+                                  'WHERE chart = ? AND date = ?',
+                                  (chart_name, date_str)).fetchone()
+        return row is not None
@@ -1,19 +1,29 @@
-from bs4 import BeautifulSoup
+from bs4 import SoupStrainer
 import json
 import string
-import requests
+from datasources import htmlparse
+from datasources import sessions
+from processing import streamstats
+
+LYRICS_ONLY = SoupStrainer("div", class_=htmlparse.has_class("lyrics"))
+LYRICS_XPATH = htmlparse.class_xpath("div", "lyrics")
 
 
 class GeniusScraper:
 
-    def __init__(self, token: str):
+    def __init__(self, token: str, session_pool=None):
         """
         Initialize GeniusScraper Object
 
         :param token: api token for Genius API (str)
+        :param session_pool: shared sessions.SessionPool, a private
+            one is made if not given
         """
+        self.session_pool = session_pool or sessions.SessionPool()
+        self.hosts = ['api.genius.com', 'genius.com']
         self.song_not_found_count = 0   # count of songs not found by genius api
         self.total_count = 0            # Count of total attempts to process a song
+        self.latency = streamstats.LatencyTracker()     # per stage
         self.base_url = 'https://api.genius.com'
         self.token = token
         self.headers = {'Authorization': 'Bearer ' + self.token}
@@ -32,12 +42,14 @@ class GeniusScraper:
         :return: dict of lyrics or empty string if no lyrics found
         """
         self.total_count += 1
-        song_id = self._find_song_id(artist_name=artist_name,
-                                     song_title=track_title)
+        with self.latency.time("Search"):
+            song_id = self._find_song_id(artist_name=artist_name,
+                                         song_title=track_title)
         if song_id is "":
             return {"Genius_Lyrics": ""}
 
-        html_path = self._get_html_path_from_song_id(song_api_path=song_id)
+        with self.latency.time("Song_Lookup"):
+            html_path = self._get_html_path_from_song_id(song_api_path=song_id)
         lyrics = self._get_lyrics_from_html_path(html_path=html_path)
 
         if flatten_lyrics:
@@ -45,6 +57,47 @@ class GeniusScraper:
 
         return {"Genius_Lyrics": lyrics}
 
+    async def get_song_data_async(self, session, artist_name: str,
+                                  track_title: str,
+                                  flatten_lyrics=False) -> dict:
+        """
+        Async variant of get_song_data, makes all three genius
+        requests through the given aiohttp session
+
+        :param session: aiohttp ClientSession
+        :param artist_name: name of artist (str)
+        :param track_title: name of song title (str)
+        :param flatten_lyrics: boolean option as described above
+        :return: dict of lyrics or empty string if no lyrics found
+        """
+        self.total_count += 1
+        try:
+            with self.latency.time("Search"):
+                song_id = await self._find_song_id_async(
+                    session, artist_name=artist_name, song_title=track_title)
+            if song_id == "":
+                return {"Genius_Lyrics": ""}
+
+            with self.latency.time("Song_Lookup"):
+                html_path = await self._get_html_path_from_song_id_async(
+                    session, song_api_path=song_id)
+            with self.latency.time("Fetch"):
+                async with session.get(html_path) as page:
+                    html_text = await page.text()
+            with self.latency.time("Parse"):
+                lyrics = self._extract_lyrics(html_text)
+        except Exception as e:
+            # Bad api answers, timeouts and pages without a lyrics div
+            # only cost this song its genius lyrics
+            print({"Genius Error": repr(e)})
+            self.song_not_found_count += 1
+            return {"Genius_Lyrics": ""}
+
+        if flatten_lyrics:
+            lyrics = self._string_strip_lyrics(" ".join(lyrics.split()))
+
+        return {"Genius_Lyrics": lyrics}
+
     def get_usage_report(self):
         """
         Returns usage report of total scraping behaviour
@@ -52,13 +105,43 @@ class GeniusScraper:
         :return: dict of form {
         "Genius_Usage_Report": {
             "Song_Not_Found": int,
-            "Total_Attempts": int
+            "Total_Attempts": int,
+            "Connection_Pool": {
+                "Requests": int,
+                "New_Connections": int,
+                "Reused_Connections": int
+            },
+            "Response_Cache": {
+                "Hits": int,
+                "Misses": int
+            },
+            "Rate_Limit": {
+                "host": dict (see ratelimit.RateLimiter)
+            },
+            "Latency": {
+                "Search": dict (see streamstats.LatencyHistogram),
+                "Song_Lookup": dict,
+                "Fetch": dict,
+                "Parse": dict
+            },
+            "Request_Latency": {
+                "host": dict (see streamstats.LatencyHistogram)
+            }
         }
         """
         usage = {
             "Genius_Usage_Report": {
                 "Song_Not_Found": self.song_not_found_count,
-                "Total_Attempts": self.total_count
+                "Total_Attempts": self.total_count,
+                "Connection_Pool":
+                    self.session_pool.get_usage_report(self.hosts),
+                "Response_Cache":
+                    self.session_pool.get_cache_report(self.hosts),
+                "Rate_Limit":
+                    self.session_pool.get_rate_report(self.hosts),
+                "Latency": self.latency.get_report(),
+                "Request_Latency":
+                    self.session_pool.get_latency_report(self.hosts)
             }
         }
         return usage
@@ -66,6 +149,8 @@ class GeniusScraper:
     def clear_usage_stats(self):
         self.song_not_found_count = 0
         self.total_count = 0
+        self.latency.clear_usage_stats()
+        self.session_pool.clear_usage_stats(self.hosts)
 
     def _find_song_id(self, artist_name: str, song_title: str) -> str:
         """
@@ -80,8 +165,36 @@ class GeniusScraper:
         """
         search_url = self.base_url + '/search'
         params = {'q': song_title + ' ' + artist_name}
-        response = requests.get(search_url, params=params, headers=self.headers)
-        json_response = response.json()
+        response = self.session_pool.get(search_url, params=params,
+                                         headers=self.headers)
+        return self._match_song_id(response.json(), artist_name)
+
+    async def _find_song_id_async(self, session, artist_name: str,
+                                  song_title: str) -> str:
+        """
+        Async variant of _find_song_id
+
+        :param session: aiohttp ClientSession
+        :param artist_name: name of artist as a string
+        :param song_title: title of song as a string
+        :return: string of song id from genius or blank string if not found
+        """
+        search_url = self.base_url + '/search'
+        params = {'q': song_title + ' ' + artist_name}
+        async with session.get(search_url, params=params,
+                               headers=self.headers) as response:
+            json_response = await response.json()
+        return self._match_song_id(json_response, artist_name)
+
+    def _match_song_id(self, json_response: dict, artist_name: str) -> str:
+        """
+        Filters the hits of a genius search response by artist name
+        and returns the api path of the first match
+
+        :param json_response: decoded search response (dict)
+        :param artist_name: name of artist as a string
+        :return: string of song id from genius or blank string if not found
+        """
         for hit in json_response["response"]["hits"]:
             if artist_name.lower() in hit["result"]["primary_artist"]["name"].lower():
                 return hit["result"]["api_path"]
@@ -97,21 +210,49 @@ class GeniusScraper:
         :return: url path to genius lyrics page (str)
         """
         song_url = self.base_url + song_api_path
-        response = requests.get(song_url, headers=self.headers)
+        response = self.session_pool.get(song_url, headers=self.headers)
         json_response = response.json()
         path = json_response["response"]["song"]["path"]
         return "http://genius.com" + path
 
-    @staticmethod
-    def _get_lyrics_from_html_path(html_path: str) -> str:
+    async def _get_html_path_from_song_id_async(self, session,
+                                                song_api_path: str) -> str:
+        """
+        Async variant of _get_html_path_from_song_id
+
+        :param session: aiohttp ClientSession
+        :param song_api_path: song id from genius api (str)
+        :return: url path to genius lyrics page (str)
+        """
+        song_url = self.base_url + song_api_path
+        async with session.get(song_url, headers=self.headers) as response:
+            json_response = await response.json()
+        path = json_response["response"]["song"]["path"]
+        return "http://genius.com" + path
+
+    def _get_lyrics_from_html_path(self, html_path: str) -> str:
         """
         Returns lyrics from a given genius url path
 
         :param html_path: path to genius lyrics page
         :return: lyrics as str
         """
-        page = requests.get(html_path)
-        html = BeautifulSoup(page.text, "html.parser")
+        with self.latency.time("Fetch"):
+            page = self.session_pool.get(html_path)
+        with self.latency.time("Parse"):
+            return self._extract_lyrics(page.text)
+
+    @staticmethod
+    def _extract_lyrics(html_text: str, fast=True) -> str:
+        """
+        Parses the lyrics out of a genius lyrics page
+
+        :param html_text: html of genius lyrics page (str)
+        :param fast: boolean option - false to parse the whole page
+            with html.parser instead of only the lyrics div
+        :return: lyrics as str
+        """
+        html = htmlparse.parse(html_text, LYRICS_ONLY, LYRICS_XPATH, fast)
         [h.extract() for h in html('script')]
         return html.find('div', class_='lyrics').get_text()
 
@@ -0,0 +1,118 @@
+import re
+from html.entities import name2codepoint
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+try:
+    import lxml.html
+    from lxml import etree
+except ImportError:
+    lxml = None
+
+FAST_PARSER = 'lxml' if lxml is not None else 'html.parser'
+
+# Markup libxml2 turns into different text than html.parser does:
+# carriage returns and NULs, CDATA sections, and in text any named
+# entity that isn't a known one closed with a semicolon
+_LXML_DIFFERS = re.compile(
+    r'[\r\x00]|<!\[|>[^<]*&(?!(?:' +
+    '|'.join(sorted(set(name2codepoint) | {'apos'}, key=len, reverse=True)) +
+    r');)[A-Za-z]')
+
+# Tags that make libxml2 close an open <p>, html.parser keeps the
+# paragraph open until its </p>
+_BLOCK_TAGS = 'address|article|aside|blockquote|center|dd|details|dialog|' \
+              'dir|div|dl|dt|fieldset|figcaption|figure|footer|form|' \
+              'h[1-6]|header|hr|li|listing|main|menu|nav|ol|p|plaintext|' \
+              'pre|section|summary|table|ul|xmp'
+
+
+def closes_paragraphs(html_text: str, name: str) -> bool:
+    """
+    Checks if any paragraph of a class holds a block tag, where lxml
+    and html.parser would end the paragraph in different places
+
+    :param html_text: html of the page (str)
+    :param name: class name of the paragraphs (str)
+    :return: boolean
+    """
+    pattern = r'<p\s[^>]*\b' + re.escape(name) + \
+              r'\b[^>]*>(?:(?!</p\s*>)[\s\S])*?<(?:' + _BLOCK_TAGS + r')[\s/>]'
+    return re.search(pattern, html_text, re.IGNORECASE) is not None
+
+
+def class_xpath(tag: str, name: str) -> str:
+    """
+    XPath of the tags having a class among several, the way
+    BeautifulSoup matches class_
+
+    :param tag: tag name (str)
+    :param name: class name (str)
+    :return: xpath (str)
+    """
+    return '//{}[contains(concat(" ", normalize-space(@class), " "), ' \
+           '" {} ")]'.format(tag, name)
+
+
+def has_class(name: str):
+    """
+    Strainer attribute rule for a class among several, SoupStrainer
+    would compare a plain string against the whole class attribute
+
+    :param name: class name (str)
+    :return: callable taking the attribute value
+    """
+    def matches(value) -> bool:
+        if value is None:
+            return False
+        if isinstance(value, str):
+            value = value.split()
+        return name in value
+    return matches
+
+
+def parse(html_text: str, only: SoupStrainer = None, xpath: str = None,
+          fast=True) -> BeautifulSoup:
+    """
+    Parses only the parts of a lyrics page an extractor looks at.
+    With lxml installed the page is parsed in C, the elements matching
+    xpath are found there and only their markup is handed to
+    BeautifulSoup, so the extractors keep working on the same soup API
+    at a fraction of the cost. Without lxml, or for pages with markup
+    libxml2 would read differently, html.parser builds tree nodes only
+    for the elements matched by only.
+
+    :param html_text: html of the page (str)
+    :param only: SoupStrainer of the elements to keep
+    :param xpath: xpath of the same elements (str)
+    :param fast: boolean option - false to build the full html.parser
+        tree, as the scrapers always used to
+    :return: BeautifulSoup
+    """
+    if not fast:
+        return BeautifulSoup(html_text, 'html.parser')
+    if lxml is not None and xpath is not None and \
+            not _LXML_DIFFERS.search(html_text):
+        try:
+            tree = lxml.html.document_fromstring(html_text)
+        except (ValueError, etree.ParserError):
+            tree = None
+        if tree is not None:
+            return BeautifulSoup(_outer_markup(tree.xpath(xpath)),
+                                 'html.parser')
+    return BeautifulSoup(html_text, 'html.parser', parse_only=only)
+
+
+def _outer_markup(elements: list) -> str:
+    """
+    Serializes the matched elements not nested in another match,
+    nested ones come along inside their ancestor
+
+    :param elements: list of lxml elements in document order
+    :return: html (str)
+    """
+    matched = set(elements)
+    return ''.join(lxml.html.tostring(el, encoding='unicode', with_tail=False)
+                   for el in elements
+                   if not any(parent in matched
+                              for parent in el.iterancestors()))
@@ -1,14 +1,28 @@
-import requests
 import string
-from bs4 import BeautifulSoup
+from bs4 import SoupStrainer
+from datasources import htmlparse
+from datasources import sessions
+from processing import streamstats
+
+VERSES_ONLY = SoupStrainer("p", class_=htmlparse.has_class("verse"))
+VERSES_XPATH = htmlparse.class_xpath("p", "verse")
 
 
 class MetroLyrics:
 
-    def __init__(self):
+    def __init__(self, session_pool=None):
+        """
+        Initialize MetroLyrics Object
+
+        :param session_pool: shared sessions.SessionPool, a private
+            one is made if not given
+        """
+        self.session_pool = session_pool or sessions.SessionPool()
+        self.hosts = ['www.metrolyrics.com']
         self.base_url = 'http://www.metrolyrics.com/'
         self.lyrics_not_found = 0
         self.total_count = 0
+        self.latency = streamstats.LatencyTracker()     # Fetch, Parse
 
     def get_song_data(self, artist_name: str, track_title: str,
                       flatten_lyrics=False) -> dict:
@@ -31,6 +45,36 @@ class MetroLyrics:
             lyrics = self._string_strip_lyrics(lyrics)
         return {"MetroLyrics": lyrics}
 
+    async def get_song_data_async(self, session, artist_name: str,
+                                  track_title: str,
+                                  flatten_lyrics=False) -> dict:
+        """
+        Async variant of get_song_data, fetches the lyrics page
+        through the given aiohttp session
+
+        :param session: aiohttp ClientSession
+        :param artist_name: name of artist (str)
+        :param track_title: name of song title (str)
+        :param flatten_lyrics: boolean option as described above
+        :return: dict of lyrics or empty string if no lyrics found
+        """
+        self.total_count += 1
+        url = self._build_url(artist_name=artist_name,
+                              track_title=track_title)
+        try:
+            with self.latency.time("Fetch"):
+                async with session.get(url) as html_doc:
+                    html_text = await html_doc.text()
+            with self.latency.time("Parse"):
+                lyrics = self._extract_lyrics(html_text)
+        except Exception as e:
+            print({"MetroLyrics Error": repr(e)})
+            self.lyrics_not_found += 1
+            return {"MetroLyrics": ""}
+        if flatten_lyrics:
+            lyrics = self._string_strip_lyrics(lyrics)
+        return {"MetroLyrics": lyrics}
+
     def get_usage_report(self):
         """
         Gets usage report of total entries processed and
@@ -39,14 +83,42 @@ class MetroLyrics:
         :return: dict of form {
             "MetroLyrics_Usage_Report": {
                 "Song_Not_Found": int,,
-                "Total_Attempts": int
+                "Total_Attempts": int,
+                "Connection_Pool": {
+                    "Requests": int,
+                    "New_Connections": int,
+                    "Reused_Connections": int
+                },
+                "Response_Cache": {
+                    "Hits": int,
+                    "Misses": int
+                },
+                "Rate_Limit": {
+                    "host": dict (see ratelimit.RateLimiter)
+                },
+                "Latency": {
+                    "Fetch": dict (see streamstats.LatencyHistogram),
+                    "Parse": dict
+                },
+                "Request_Latency": {
+                    "host": dict (see streamstats.LatencyHistogram)
+                }
             }
         }
         """
         usage = {
             "MetroLyrics_Usage_Report": {
                 "Song_Not_Found": self.lyrics_not_found,
-                "Total_Attempts": self.total_count
+                "Total_Attempts": self.total_count,
+                "Connection_Pool":
+                    self.session_pool.get_usage_report(self.hosts),
+                "Response_Cache":
+                    self.session_pool.get_cache_report(self.hosts),
+                "Rate_Limit":
+                    self.session_pool.get_rate_report(self.hosts),
+                "Latency": self.latency.get_report(),
+                "Request_Latency":
+                    self.session_pool.get_latency_report(self.hosts)
             }
         }
         return usage
@@ -54,6 +126,8 @@ class MetroLyrics:
     def clear_usage_stats(self):
         self.lyrics_not_found = 0
         self.total_count = 0
+        self.latency.clear_usage_stats()
+        self.session_pool.clear_usage_stats(self.hosts)
 
     def _build_url(self, artist_name, track_title):
         """
@@ -76,8 +150,24 @@ class MetroLyrics:
         :param url: url of metrolyrics lyrics page
         :return: string of raw lyrics or empty string if not found
         """
-        html_doc = requests.get(url)
-        soup = BeautifulSoup(html_doc.text, 'html.parser')
+        with self.latency.time("Fetch"):
+            html_doc = self.session_pool.get(url)
+        with self.latency.time("Parse"):
+            return self._extract_lyrics(html_doc.text)
+
+    def _extract_lyrics(self, html_text: str, fast=True) -> str:
+        """
+        Parses the verses out of a metrolyrics page
+
+        :param html_text: html of metrolyrics lyrics page (str)
+        :param fast: boolean option - false to parse the whole page
+            with html.parser instead of only the verses
+        :return: string of raw lyrics or empty string if not found
+        """
+        xpath = VERSES_XPATH
+        if htmlparse.closes_paragraphs(html_text, "verse"):
+            xpath = None
+        soup = htmlparse.parse(html_text, VERSES_ONLY, xpath, fast)
         complete_lyrics = []
         for i in soup.find_all("p", class_='verse'):
             complete_lyrics.append(i.get_text())
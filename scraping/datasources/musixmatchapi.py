@@ -1,13 +1,25 @@
 from musixmatch import Musixmatch
+from datasources import ratelimit
+from processing import streamstats
 
 
 class MusiXMatchAPI:
 
-    def __init__(self, key):
+    def __init__(self, key, limiter=None):
+        """
+        Initialize MusiXMatchAPI Object
+
+        :param key: api key for musixmatch (str)
+        :param limiter: ratelimit.RateLimiter lookups wait on,
+            no limits if not given
+        """
         self.MM = Musixmatch(key)
+        self.limiter = limiter
+        self.host = 'api.musixmatch.com'
         self.track_not_found = 0
         self.total_count = 0
         self.error_codes = []
+        self.latency = streamstats.LatencyTracker()     # Search
 
     def get_song_data(self, artist_name: str, track_title: str) -> dict:
         """
@@ -25,8 +37,11 @@ class MusiXMatchAPI:
         }
         """
         self.total_count += 1
-        result = self.MM.matcher_track_get(q_artist=artist_name,
-                                           q_track=track_title)
+        with ratelimit.limited(self.limiter, self.host) as outcome:
+            with self.latency.time("Search"):
+                result = self.MM.matcher_track_get(q_artist=artist_name,
+                                                   q_track=track_title)
+            outcome["status"] = result["message"]["header"]["status_code"]
 
         result = result["message"]
         if result["header"]["status_code"] != 200 or \
@@ -53,14 +68,23 @@ class MusiXMatchAPI:
         :return: dict of form {
             "Musixmatch_Usage_Reports": {
                 "Missed_Searches": int,
-                "Total_Attempts": int
+                "Total_Attempts": int,
+                "Rate_Limit": {
+                    "host": dict (see ratelimit.RateLimiter)
+                },
+                "Latency": {
+                    "Search": dict (see streamstats.LatencyHistogram)
+                }
             }
         }
         """
         usage = {
             "Musixmatch_Usage_Reports": {
                 "Missed_Searches": self.track_not_found,
-                "Total_Attempts": self.total_count
+                "Total_Attempts": self.total_count,
+                "Rate_Limit": self.limiter.get_usage_report([self.host])
+                if self.limiter is not None else {},
+                "Latency": self.latency.get_report()
             }
         }
         return usage
@@ -68,6 +92,9 @@ class MusiXMatchAPI:
     def clear_usage_stats(self):
         self.track_not_found = 0
         self.total_count = 0
+        self.latency.clear_usage_stats()
+        if self.limiter is not None:
+            self.limiter.clear_usage_stats([self.host])
 
 
 if __name__ == "__main__":
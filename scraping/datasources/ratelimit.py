@@ -0,0 +1,309 @@
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+
+class HostLimiter:
+
+    def __init__(self, host: str, rate=5.0, min_rate=0.5, max_rate=50.0,
+                 burst=5, concurrency=4, min_concurrency=1,
+                 max_concurrency=32, rate_step=0.5, decrease_factor=0.5,
+                 slow_seconds=5.0, decrease_cooldown=1.0):
+        """
+        Token bucket plus adaptive concurrency limit for one host.
+
+        Requests take a token from a bucket refilled at `rate` per second
+        and a slot out of `concurrency`. Both limits adapt AIMD style:
+        every healthy response adds a little (about rate_step per second
+        to the rate and one slot per round trip to the concurrency), and
+        a 429, a 5xx, a failed request or a reply slower than
+        slow_seconds multiplies both by decrease_factor. Decreases are at
+        most once per decrease_cooldown, so a burst of failures from one
+        congested moment only backs off once. A Retry-After header
+        blocks the host for that long.
+
+        :param host: host name (str)
+        :param rate: starting requests per second (float)
+        :param min_rate: lowest requests per second (float)
+        :param max_rate: highest requests per second (float)
+        :param burst: max tokens saved up in the bucket (int)
+        :param concurrency: starting requests in flight (float)
+        :param min_concurrency: lowest requests in flight (int)
+        :param max_concurrency: highest requests in flight (int)
+        :param rate_step: requests per second added per second of
+            healthy responses (float)
+        :param decrease_factor: factor applied on back off (float)
+        :param slow_seconds: replies slower than this back off (float)
+        :param decrease_cooldown: min seconds between back offs (float)
+        """
+        self.host = host
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.concurrency = float(concurrency)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.rate_step = rate_step
+        self.decrease_factor = decrease_factor
+        self.slow_seconds = slow_seconds
+        self.decrease_cooldown = decrease_cooldown
+
+        self.lock = threading.Lock()
+        self.tokens = float(burst)
+        self.last_refill = time.time()
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+
+        self.throttled = 0      # 429 / 5xx / failed responses
+        self.slow = 0           # responses slower than slow_seconds
+        self.waits = 0          # requests that had to wait for the limiter
+
+    def acquire(self):
+        """
+        Blocks until the host's limits allow another request
+
+        :return: None
+        """
+        waited = False
+        while True:
+            wait = self._try_acquire(waited)
+            if wait == 0:
+                return
+            waited = True
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """
+        Async variant of acquire
+
+        :return: None
+        """
+        waited = False
+        while True:
+            wait = self._try_acquire(waited)
+            if wait == 0:
+                return
+            waited = True
+            await asyncio.sleep(wait)
+
+    def release(self, status, elapsed: float, retry_after=None):
+        """
+        Frees the request's slot and adapts the limits to how
+        the request went
+
+        :param status: http status code (int) or None if the request failed
+        :param elapsed: seconds the request took (float)
+        :param retry_after: value of a Retry-After header (str)
+        :return: None
+        """
+        now = time.time()
+        with self.lock:
+            self.in_flight -= 1
+            throttled = status is None or status == 429 or status >= 500
+            slow = elapsed > self.slow_seconds
+            if throttled:
+                self.throttled += 1
+            if slow:
+                self.slow += 1
+
+            if retry_after is not None:
+                try:
+                    self.blocked_until = max(self.blocked_until,
+                                             now + float(retry_after))
+                except ValueError:
+                    pass
+
+            if throttled or slow:
+                if now - self.last_decrease >= self.decrease_cooldown:
+                    self.last_decrease = now
+                    self.rate = max(self.min_rate,
+                                    self.rate * self.decrease_factor)
+                    self.concurrency = max(self.min_concurrency,
+                                           self.concurrency * self.decrease_factor)
+                    self.tokens = min(self.tokens, 1.0)
+            else:
+                self.rate = min(self.max_rate,
+                                self.rate + self.rate_step / self.rate)
+                self.concurrency = min(self.max_concurrency,
+                                       self.concurrency + 1.0 / self.concurrency)
+
+    def get_usage_report(self) -> dict:
+        with self.lock:
+            return {
+                "Rate_Per_Sec": round(self.rate, 2),
+                "Concurrency_Limit": int(self.concurrency),
+                "In_Flight": self.in_flight,
+                "Throttled": self.throttled,
+                "Slow_Responses": self.slow,
+                "Waits": self.waits
+            }
+
+    def clear_usage_stats(self):
+        with self.lock:
+            self.throttled = 0
+            self.slow = 0
+            self.waits = 0
+
+    def _try_acquire(self, waited: bool) -> float:
+        """
+        Takes a token and a slot if both are free
+
+        :param waited: boolean of whether the caller already waited
+        :return: 0 if acquired, else seconds to wait before retrying
+        """
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+            if now < self.blocked_until:
+                wait = self.blocked_until - now
+            elif self.in_flight >= int(self.concurrency):
+                wait = 0.05
+            elif self.tokens < 1:
+                wait = (1 - self.tokens) / self.rate
+            else:
+                self.tokens -= 1
+                self.in_flight += 1
+                return 0
+            if not waited:
+                self.waits += 1
+            return wait
+
+
+class RateLimiter:
+
+    def __init__(self, defaults=None, hosts=None):
+        """
+        Registry of one HostLimiter per host
+
+        :param defaults: dict of HostLimiter keyword arguments used
+            for every host
+        :param hosts: dict of {"host": dict of HostLimiter keyword
+            arguments} overriding the defaults for that host
+        """
+        self.defaults = defaults or {}
+        self.hosts = hosts or {}
+        self.limiters = {}
+        self.lock = threading.Lock()
+
+    def for_host(self, host: str) -> HostLimiter:
+        with self.lock:
+            if host not in self.limiters:
+                settings = dict(self.defaults)
+                settings.update(self.hosts.get(host, {}))
+                self.limiters[host] = HostLimiter(host, **settings)
+            return self.limiters[host]
+
+    def for_url(self, url: str) -> HostLimiter:
+        return self.for_host(urlsplit(url).hostname)
+
+    def get_usage_report(self, hosts: list) -> dict:
+        """
+        Returns current limits and counters of the given hosts
+
+        :param hosts: list of host names (str)
+        :return: dict of form {
+            "host": {
+                "Rate_Per_Sec": float,
+                "Concurrency_Limit": int,
+                "In_Flight": int,
+                "Throttled": int,
+                "Slow_Responses": int,
+                "Waits": int
+            }
+        }
+        """
+        with self.lock:
+            limiters = [self.limiters[h] for h in hosts if h in self.limiters]
+        return {limiter.host: limiter.get_usage_report()
+                for limiter in limiters}
+
+    def clear_usage_stats(self, hosts: list):
+        with self.lock:
+            limiters = [self.limiters[h] for h in hosts if h in self.limiters]
+        for limiter in limiters:
+            limiter.clear_usage_stats()
+
+
+@contextmanager
+def limited(limiter, host: str):
+    """
+    Runs the body of a with block as one request to host under the
+    host's limits. The body sets "status" (and optionally
+    "retry_after") on the yielded dict; if it raises, or never sets
+    a status, the request counts as failed. Does nothing if limiter
+    is None.
+
+    :param limiter: RateLimiter or None
+    :param host: host name (str)
+    :return: context manager yielding a dict
+    """
+    outcome = {"status": None, "retry_after": None}
+    if limiter is None:
+        yield outcome
+        return
+    host_limiter = limiter.for_host(host)
+    host_limiter.acquire()
+    start = time.time()
+    try:
+        yield outcome
+    finally:
+        host_limiter.release(outcome["status"], time.time() - start,
+                             outcome["retry_after"])
+
+
+class ThrottledClientSession:
+
+    def __init__(self, session, limiter: RateLimiter):
+        """
+        Wraps an aiohttp ClientSession so the async scrapers go
+        through the same per host limits as the sync ones
+
+        :param session: aiohttp ClientSession
+        :param limiter: RateLimiter
+        """
+        self.session = session
+        self.limiter = limiter
+
+    def get(self, url: str, **kwargs):
+        """
+        Same call signature as aiohttp's ClientSession.get, use
+        with "async with"
+
+        :param url: url of request (str)
+        :return: async context manager yielding the response
+        """
+        return _ThrottledRequest(self, url, kwargs)
+
+
+class _ThrottledRequest:
+
+    def __init__(self, client, url, kwargs):
+        self.host_limiter = client.limiter.for_url(url)
+        self.request = client.session.get(url, **kwargs)
+        self.response = None
+        self.start = None
+
+    async def __aenter__(self):
+        await self.host_limiter.acquire_async()
+        self.start = time.time()
+        try:
+            self.response = await self.request.__aenter__()
+        except BaseException:
+            self.host_limiter.release(None, time.time() - self.start)
+            raise
+        return self.response
+
+    async def __aexit__(self, *exc):
+        try:
+            return await self.request.__aexit__(*exc)
+        finally:
+            status = self.response.status if exc[0] is None else None
+            self.host_limiter.release(
+                status, time.time() - self.start,
+                self.response.headers.get('Retry-After'))
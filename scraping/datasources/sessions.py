@@ -0,0 +1,209 @@
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from datasources import ratelimit
+from processing import streamstats
+
+
+class SessionPool:
+
+    def __init__(self, pool_sizes=None, default_pool_size=10, cache=None,
+                 limiter=None):
+        """
+        Shared keep-alive HTTP session for all datasources. Every host
+        named in pool_sizes gets its own connection pool of that size,
+        every other host uses a pool of default_pool_size. Connections
+        are kept alive and reused across calls and threads, so repeat
+        lookups against the same host skip the TCP and TLS handshake.
+
+        :param pool_sizes: dict of {"host": max pooled connections (int)}
+        :param default_pool_size: pool size for all other hosts (int)
+        :param cache: cache.ResponseCache to serve GET requests from,
+            no caching if not given
+        :param limiter: ratelimit.RateLimiter every request that goes
+            to the network waits on, no limits if not given
+        """
+        self.cache = cache
+        self.limiter = limiter
+        self.pool_sizes = pool_sizes or {}
+        self.default_pool_size = default_pool_size
+        self.session = requests.Session()
+        self.lock = threading.Lock()
+        self.baseline = {}      # per host counts as of last clear
+        self.latency = streamstats.LatencyTracker()     # per host
+
+        default_adapter = HTTPAdapter(pool_connections=len(self.pool_sizes) + 10,
+                                      pool_maxsize=default_pool_size)
+        self.session.mount('http://', default_adapter)
+        self.session.mount('https://', default_adapter)
+        for host, size in self.pool_sizes.items():
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=size)
+            self.session.mount('http://' + host, adapter)
+            self.session.mount('https://' + host, adapter)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """
+        Sends a GET request over a pooled connection, or answers
+        it from the response cache if there is one
+
+        :param url: url to request (str)
+        :param kwargs: any other requests.get arguments
+        :return: requests Response
+        """
+        if self.cache is None or not self.cache.cacheable(url):
+            return self._send('GET', url, **kwargs)
+
+        params = kwargs.get('params')
+        cached = self.cache.lookup(url, params)
+        if cached is not None:
+            return self._cached_response(url, *cached)
+        response = self._send('GET', url, **kwargs)
+        self.cache.store(url, params, response.status_code,
+                         response.content, response.encoding)
+        return response
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        """
+        Sends a POST request over a pooled connection
+
+        :param url: url to request (str)
+        :param kwargs: any other requests.post arguments
+        :return: requests Response
+        """
+        return self._send('POST', url, **kwargs)
+
+    def get_usage_report(self, hosts: list) -> dict:
+        """
+        Returns connection reuse statistics for the given hosts
+        since the last call to clear_usage_stats
+
+        :param hosts: list of host names (str)
+        :return: dict of form {
+            "Requests": int,
+            "New_Connections": int,
+            "Reused_Connections": int
+        }
+        """
+        total_requests = 0
+        new_connections = 0
+        with self.lock:
+            for host in hosts:
+                count = self._connection_counts(host)
+                base = self.baseline.get(host, (0, 0))
+                total_requests += count[0] - base[0]
+                new_connections += count[1] - base[1]
+        return {
+            "Requests": total_requests,
+            "New_Connections": new_connections,
+            "Reused_Connections": max(total_requests - new_connections, 0)
+        }
+
+    def get_cache_report(self, hosts: list) -> dict:
+        """
+        Returns response cache hits and misses for the given hosts
+
+        :param hosts: list of host names (str)
+        :return: dict of form {
+            "Hits": int,
+            "Misses": int
+        }
+        """
+        if self.cache is None:
+            return {"Hits": 0, "Misses": 0}
+        return self.cache.get_usage_report(hosts)
+
+    def get_rate_report(self, hosts: list) -> dict:
+        """
+        Returns current rate limits of the given hosts
+
+        :param hosts: list of host names (str)
+        :return: dict (see ratelimit.RateLimiter.get_usage_report)
+        """
+        if self.limiter is None:
+            return {}
+        return self.limiter.get_usage_report(hosts)
+
+    def get_latency_report(self, hosts: list) -> dict:
+        """
+        Returns latency of the requests sent over the network to the
+        given hosts, cached responses left out. Failed requests,
+        raised or answered with a 5xx or 429, are counted as Errors
+
+        :param hosts: list of host names (str)
+        :return: dict of {"host": dict (see
+            streamstats.LatencyHistogram.get_report)}
+        """
+        return {host: report
+                for host, report in self.latency.get_report().items()
+                if host in hosts}
+
+    def clear_usage_stats(self, hosts: list):
+        with self.lock:
+            for host in hosts:
+                self.baseline[host] = self._connection_counts(host)
+        self.latency.clear_usage_stats(hosts)
+        if self.cache is not None:
+            self.cache.clear_usage_stats(hosts)
+        if self.limiter is not None:
+            self.limiter.clear_usage_stats(hosts)
+
+    def _send(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Sends a request over the network, within the host's rate limits
+
+        :param method: http method (str)
+        :param url: url to request (str)
+        :param kwargs: any other requests arguments
+        :return: requests Response
+        """
+        host = urlsplit(url).hostname
+        with ratelimit.limited(self.limiter, host) as outcome:
+            with self.latency.time(host):
+                response = self.session.request(method, url, **kwargs)
+            if response.status_code >= 500 or response.status_code == 429:
+                self.latency.add_error(host)
+            outcome["status"] = response.status_code
+            outcome["retry_after"] = response.headers.get('Retry-After')
+        return response
+
+    def _connection_counts(self, host: str) -> tuple:
+        """
+        Sums request and connection counts of every urllib3 pool
+        (http and https) open to the given host
+
+        :param host: host name (str)
+        :return: tuple of (requests made, connections opened)
+        """
+        total_requests = 0
+        connections = 0
+        adapters = {id(a): a for a in self.session.adapters.values()}
+        for adapter in adapters.values():
+            manager = adapter.poolmanager
+            for key in manager.pools.keys():
+                pool = manager.pools.get(key)
+                if pool is not None and pool.host == host:
+                    total_requests += pool.num_requests
+                    connections += pool.num_connections
+        return total_requests, connections
+
+    @staticmethod
+    def _cached_response(url: str, status: int, body: bytes,
+                         encoding: str) -> requests.Response:
+        """
+        Builds a requests Response out of a cached entry
+
+        :param url: url of request (str)
+        :param status: http status code (int)
+        :param body: raw response body (bytes)
+        :param encoding: text encoding of the body (str)
+        :return: requests Response
+        """
+        response = requests.Response()
+        response.status_code = status
+        response._content = body
+        response.encoding = encoding
+        response.url = url
+        return response
@@ -1,21 +1,28 @@
 import json
 
-import requests
+from datasources import sessions
+from processing import streamstats
 
 
 class SpotifyScraper:
 
-    def __init__(self, client_id: list, client_secret: list):
+    def __init__(self, client_id: list, client_secret: list,
+                 session_pool=None):
         """
         Initialize spotify scraper object
 
         :param client_id: API client ID (str)
         :param client_secret: API client secret (str)
+        :param session_pool: shared sessions.SessionPool, a private
+            one is made if not given
         """
+        self.session_pool = session_pool or sessions.SessionPool()
+        self.hosts = ['api.spotify.com', 'accounts.spotify.com']
         self.song_not_found_count = 0   # count of soungs not found by spotify
         self.total_attempts = 0         # count of all attempts to find songs
         self.token_1_calls = 0
         self.token_2_calls = 0
+        self.latency = streamstats.LatencyTracker()     # per stage
         self.client_id = client_id
         self.client_secret = client_secret
         self.token = self._get_token(client_id[0], client_secret[0])
@@ -39,16 +46,41 @@ class SpotifyScraper:
             "Artist_Popularity": int
         }
         """
-        self.total_attempts += 1
-        if self.total_attempts % 2 != 0:
-            token = self.token2
-            self.token_2_calls += 1
-        else:
-            token = self.token
-            self.token_1_calls += 1
         song_data = self._search_artist_track(song_key=track_title,
                                               artist_key=artist_name,
-                                              token=token)
+                                              token=self._next_token())
+        if song_data == {}:
+            song_data = {"Spotify_Artist_ID": "Not Found"}
+        return song_data
+
+    async def get_song_data_async(self, session, artist_name: str,
+                                  track_title: str,
+                                  flatten_lyrics=True) -> dict:
+        """
+        Async variant of get_song_data, searches spotify through
+        the given aiohttp session
+
+        :param session: aiohttp ClientSession
+        :param artist_name: name of artist (str)
+        :param track_title: name of song (str)
+        :return: dict of form described in get_song_data
+        """
+        song_url = "https://api.spotify.com/v1/search/"
+        p = self._search_params(song_key=track_title,
+                                artist_key=artist_name,
+                                token=self._next_token())
+        try:
+            with self.latency.time("Search"):
+                async with session.get(song_url, params=p) as response:
+                    if response.status > 210:
+                        song_data = self._handle_bad_search(response.status)
+                    else:
+                        song_data = self._match_track(await response.json(),
+                                                      artist_key=artist_name)
+        except Exception as e:
+            print("Spotify problems:", repr(e))
+            self.song_not_found_count += 1
+            song_data = {}
         if song_data == {}:
             song_data = {"Spotify_Artist_ID": "Not Found"}
         return song_data
@@ -60,7 +92,27 @@ class SpotifyScraper:
         :return: dict of form {
             "Spotify_Usage_Report": {
                 "Missed Searches": int,
-                "Total_Attempts": int
+                "Total_Attempts": int,
+                "Connection_Pool": {
+                    "Requests": int,
+                    "New_Connections": int,
+                    "Reused_Connections": int
+                },
+                "Response_Cache": {
+                    "Hits": int,
+                    "Misses": int
+                },
+                "Rate_Limit": {
+                    "host": dict (see ratelimit.RateLimiter)
+                },
+                "Latency": {
+                    "Search": dict (see streamstats.LatencyHistogram),
+                    "Artist_Info": dict,
+                    "Token": dict
+                },
+                "Request_Latency": {
+                    "host": dict (see streamstats.LatencyHistogram)
+                }
             }
         }
         """
@@ -70,6 +122,15 @@ class SpotifyScraper:
                 "Token1_Calls": self.token_1_calls,
                 "Token2_Calls": self.token_2_calls,
                 "Total_Attempts": self.total_attempts,
+                "Connection_Pool":
+                    self.session_pool.get_usage_report(self.hosts),
+                "Response_Cache":
+                    self.session_pool.get_cache_report(self.hosts),
+                "Rate_Limit":
+                    self.session_pool.get_rate_report(self.hosts),
+                "Latency": self.latency.get_report(),
+                "Request_Latency":
+                    self.session_pool.get_latency_report(self.hosts)
             }
         }
         return usage
@@ -79,6 +140,8 @@ class SpotifyScraper:
         self.total_attempts = 0
         self.token_1_calls = 0
         self.token_2_calls = 0
+        self.latency.clear_usage_stats()
+        self.session_pool.clear_usage_stats(self.hosts)
 
     def _search_artist_track(self, song_key: str, artist_key: str,
                              token: str) -> dict:
@@ -96,21 +159,70 @@ class SpotifyScraper:
         }
         """
         song_url = "https://api.spotify.com/v1/search/"
-        p = {
+        p = self._search_params(song_key=song_key, artist_key=artist_key,
+                                token=token)
+        with self.latency.time("Search"):
+            response = self.session_pool.get(song_url, params=p)
+        if response.status_code > 210:
+            return self._handle_bad_search(response.status_code)
+        return self._match_track(response.json(), artist_key=artist_key)
+
+    def _next_token(self) -> str:
+        """
+        Alternates between the two api tokens so calls are split
+        evenly across both rate limits
+
+        :return: api token (str)
+        """
+        self.total_attempts += 1
+        if self.total_attempts % 2 != 0:
+            self.token_2_calls += 1
+            return self.token2
+        self.token_1_calls += 1
+        return self.token
+
+    @staticmethod
+    def _search_params(song_key: str, artist_key: str, token: str) -> dict:
+        """
+        Builds query params for a spotify track search
+
+        :param song_key: name of song (str)
+        :param artist_key: name of artist (str)
+        :param token: api token (str)
+        :return: dict of query params
+        """
+        return {
             'access_token': token,
             'q': 'track:' + song_key + " artist:" + artist_key,
             'type': "track",
         }
-        response = requests.get(song_url, params=p)
-        if response.status_code > 210:
-            if response.status_code == 401:
-                print("\n\n--- Refresehd Spotify Token ---\n\n")
-                self.token = self._get_token(self.client_id[0], self.client_secret[0])
-                self.token2 = self._get_token(self.client_id[1], self.client_secret[1])
-            self.song_not_found_count += 1
-            print("Spotify problems:", response.status_code)
-            return {}
-        tracks = response.json().get('tracks').get('items')
+
+    def _handle_bad_search(self, status_code: int) -> dict:
+        """
+        Handles a failed search response, refreshing tokens if
+        they have expired
+
+        :param status_code: http status code of search response (int)
+        :return: empty dict
+        """
+        if status_code == 401:
+            print("\n\n--- Refresehd Spotify Token ---\n\n")
+            self.token = self._get_token(self.client_id[0], self.client_secret[0])
+            self.token2 = self._get_token(self.client_id[1], self.client_secret[1])
+        self.song_not_found_count += 1
+        print("Spotify problems:", status_code)
+        return {}
+
+    def _match_track(self, json_response: dict, artist_key: str) -> dict:
+        """
+        Finds the first track in a search response whose main
+        artist matches the given artist name
+
+        :param json_response: decoded search response (dict)
+        :param artist_key: name of artist (str)
+        :return: dict of song data or empty dict if no match
+        """
+        tracks = json_response.get('tracks').get('items')
 
         for item in tracks:
             artist = [x["name"] for x in item["artists"]]
@@ -155,7 +267,9 @@ class SpotifyScraper:
             return []
         artist_url = "https://api.spotify.com/v1/artists?ids=" + \
                      (",".join(artist_ids))
-        response = requests.get(artist_url, params={'access_token': self.token})
+        with self.latency.time("Artist_Info"):
+            response = self.session_pool.get(
+                artist_url, params={'access_token': self.token})
         artist_info = response.json()
         return artist_info["artists"]
 
@@ -176,8 +290,7 @@ class SpotifyScraper:
         return ret_dict
 
 
-    @staticmethod
-    def _get_token(client_id: str, client_secret: str) -> str:
+    def _get_token(self, client_id: str, client_secret: str) -> str:
         """
         Establishes access token
 
@@ -189,7 +302,9 @@ class SpotifyScraper:
         body_params = {'grant_type': 'client_credentials'}
         client_id = client_id
         client_secret = client_secret
-        token_response = requests.post(url, data=body_params, auth=(client_id, client_secret))
+        with self.latency.time("Token"):
+            token_response = self.session_pool.post(
+                url, data=body_params, auth=(client_id, client_secret))
         token = token_response.json().get('access_token')
         return token
 
@@ -1,13 +1,24 @@
 from PyLyrics import *
 import string
 import time
+from datasources import ratelimit
+from processing import streamstats
 
 
 class WikiaScraper:
 
-    def __init__(self):
+    def __init__(self, limiter=None):
+        """
+        Initialize WikiaScraper Object
+
+        :param limiter: ratelimit.RateLimiter lookups wait on,
+            no limits if not given
+        """
+        self.limiter = limiter
+        self.host = 'lyrics.wikia.com'
         self.song_not_found = 0
         self.total_attempts = 0
+        self.latency = streamstats.LatencyTracker()     # Fetch
 
     def get_song_data(self, artist_name: str, track_title: str,
                    flatten_lyrics=False) -> dict:
@@ -22,11 +33,14 @@ class WikiaScraper:
         }
         """
         self.total_attempts += 1
-        try:
-            lyrics = PyLyrics.getLyrics(artist_name, track_title)
-        except ValueError:
-            self.song_not_found += 1
-            lyrics = ""
+        with ratelimit.limited(self.limiter, self.host) as outcome:
+            try:
+                with self.latency.time("Fetch"):
+                    lyrics = PyLyrics.getLyrics(artist_name, track_title)
+            except ValueError:
+                self.song_not_found += 1
+                lyrics = ""
+            outcome["status"] = 200
         return {"Wikia_Lyrics": self._string_strip_lyrics(lyrics)}
 
     def get_usage_report(self):
@@ -36,14 +50,23 @@ class WikiaScraper:
         :return: dict of form {
             "Wikia_Usage_Report": {
                 "Song_Not_Found": int,
-                "Total_Attempts": int
+                "Total_Attempts": int,
+                "Rate_Limit": {
+                    "host": dict (see ratelimit.RateLimiter)
+                },
+                "Latency": {
+                    "Fetch": dict (see streamstats.LatencyHistogram)
+                }
             }
         }
         """
         usage = {
             "Wikia_Usage_Report": {
                 "Song_Not_Found": self.song_not_found,
-                "Total_Attempts": self.total_attempts
+                "Total_Attempts": self.total_attempts,
+                "Rate_Limit": self.limiter.get_usage_report([self.host])
+                if self.limiter is not None else {},
+                "Latency": self.latency.get_report()
             }
         }
         return usage
@@ -51,6 +74,9 @@ class WikiaScraper:
     def clear_usage_stats(self):
         self.song_not_found = 0
         self.total_attempts = 0
+        self.latency.clear_usage_stats()
+        if self.limiter is not None:
+            self.limiter.clear_usage_stats([self.host])
 
     @staticmethod
     def _string_strip_lyrics(raw_string: str) -> str:
@@ -0,0 +1,108 @@
+"""
+Builds or extends the columnar copy of the song stats from the scraper's
+file output: the JSONL sink's songs-*.jsonl[.gz|.zst] files and the
+older per chart {chart}_{date}.json files. Only records not yet in the
+store are read, so it can be rerun while a scrape is going:
+
+    python export_columns.py --input sample_results --output columns
+"""
+import argparse
+import json
+import os
+import time
+
+from processing import columnar
+from processing import jsonlsink
+
+
+def song_files(directory: str) -> list:
+    """
+    Lists the scraper output files of a directory, oldest first
+
+    :param directory: scraper output directory (str)
+    :return: list of file names (str)
+    """
+    names = []
+    for name in os.listdir(directory):
+        if name.startswith('songs-') and '.jsonl' in name:
+            names.append(name)
+        elif name.endswith('.json') and not name.startswith('usage'):
+            names.append(name)
+    return sorted(names, key=lambda name:
+                  os.path.getmtime(os.path.join(directory, name)))
+
+
+def read_chart_file(path: str) -> list:
+    """
+    Reads a per chart JSON file of {master key: song dict}
+
+    :param path: file path (str)
+    :return: list of song dicts with a "Master_Key" field
+    """
+    with open(path, 'r') as file:
+        master_dict = json.load(file)
+    records = []
+    for key, val in master_dict.items():
+        if isinstance(val, dict):
+            record = dict(val)
+            record["Master_Key"] = key
+            records.append(record)
+    return records
+
+
+def export(store: columnar.ColumnStore, directory: str,
+           batch_size=10000) -> int:
+    """
+    Appends every record of the output files the store has not seen
+
+    :param store: ColumnStore to extend
+    :param directory: scraper output directory (str)
+    :param batch_size: records per append (int)
+    :return: number of rows added (int)
+    """
+    added = 0
+    for name in song_files(directory):
+        path = os.path.join(directory, name)
+        done = store.consumed(name)
+        if name.endswith('.json'):
+            if not done:
+                added += store.append(read_chart_file(path), name, 1)
+            continue
+        batch = []
+        for record in jsonlsink.read_records(path, skip=done):
+            batch.append(record)
+            if len(batch) >= batch_size:
+                done += len(batch)
+                added += store.append(batch, name, done)
+                batch = []
+        if batch:
+            done += len(batch)
+            added += store.append(batch, name, done)
+    return added
+
+
+if __name__ == "__main__":
+    with open('run.json', 'r') as file:
+        param = json.load(file)
+    sink_config = param.get("jsonl_sink") or {}
+    export_config = param.get("columnar_export") or {}
+
+    parser = argparse.ArgumentParser(description="Export song stats columns")
+    parser.add_argument("--input", default=sink_config.get("directory",
+                                                           "sample_results"))
+    parser.add_argument("--output", default=export_config.get(
+        "directory", "sample_results/columns"))
+    parser.add_argument("--batch-size", type=int,
+                        default=export_config.get("batch_size", 10000))
+    args = parser.parse_args()
+
+    print("Exporting For Parameters:")
+    print("Input :", args.input)
+    print("Output :", args.output)
+
+    begin = time.time()
+    CS = columnar.ColumnStore(args.output)
+    added = export(CS, args.input, batch_size=args.batch_size)
+    print("Added", added, "rows in", time.time() - begin, "seconds,",
+          CS.rows, "rows total")
+    print(json.dumps(CS.summarize(), indent=4))
@@ -0,0 +1,199 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+
+class LeaseTable:
+
+    def __init__(self, path='cache/leases.sqlite', lease_seconds=600,
+                 max_attempts=3):
+        """
+        Table of (chart, date) work units shared by any number of worker
+        processes or containers through one sqlite file. A worker claims
+        a unit by taking a lease on it, renews the lease while it works,
+        and marks the unit done at the end. A lease that isn't renewed
+        expires, and the unit can then be claimed by someone else, so
+        units held by a crashed worker are picked up again on their own.
+
+        The file has to live on storage all workers can lock, e.g. the
+        cache volume shared by scaled docker-compose services.
+
+        :param path: path to sqlite file (str)
+        :param lease_seconds: seconds a lease is valid without being
+            renewed (int)
+        :param max_attempts: claims after which a unit that keeps
+            failing is given up on (int)
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.worker_id = socket.gethostname() + ':' + str(os.getpid())
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None,
+                                  check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS units ('
+                        'id INTEGER PRIMARY KEY, chart TEXT, date TEXT, '
+                        'status TEXT, owner TEXT, expires REAL, '
+                        'attempts INTEGER DEFAULT 0, UNIQUE (chart, date))')
+        self.db.execute('CREATE INDEX IF NOT EXISTS units_status '
+                        'ON units (status, date)')
+
+    def populate(self, charts: list, start_date: str, stop_date: str,
+                 rewind_one_week) -> int:
+        """
+        Splits the date range x charts space into work units, units
+        that already exist are left as they are
+
+        :param charts: list of chart names (str)
+        :param start_date: newest date (str) (YYYY-MM-DD)
+        :param stop_date: oldest date, exclusive (str) (YYYY-MM-DD)
+        :param rewind_one_week: callable that steps a date back a week
+        :return: number of units added (int)
+        """
+        units = []
+        cur_date = start_date
+        while cur_date > stop_date:
+            for chart in charts:
+                units.append((chart, cur_date))
+            cur_date = rewind_one_week(cur_date)
+
+        with self.lock:
+            before = self._count()
+            self.db.execute('BEGIN IMMEDIATE')
+            self.db.executemany('INSERT OR IGNORE INTO units '
+                                '(chart, date, status) VALUES (?, ?, ?)',
+                                [(c, d, 'pending') for c, d in units])
+            self.db.execute('COMMIT')
+            return self._count() - before
+
+    def claim(self):
+        """
+        Leases the newest unit that is pending or whose lease expired.
+        An expired unit that has been claimed max_attempts times most
+        likely crashes its worker, so it is marked failed instead
+
+        :return: tuple of (unit id, chart, date) or None if nothing
+            can be claimed right now
+        """
+        now = time.time()
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            self.db.execute(
+                'UPDATE units SET status = ?, owner = NULL, expires = NULL '
+                'WHERE status = ? AND expires < ? AND attempts >= ?',
+                ('failed', 'leased', now, self.max_attempts))
+            row = self.db.execute(
+                'SELECT id, chart, date FROM units '
+                'WHERE status = ? OR (status = ? AND expires < ?) '
+                'ORDER BY date DESC, id LIMIT 1',
+                ('pending', 'leased', now)).fetchone()
+            if row is not None:
+                self.db.execute('UPDATE units SET status = ?, owner = ?, '
+                                'expires = ?, attempts = attempts + 1 '
+                                'WHERE id = ?',
+                                ('leased', self.worker_id,
+                                 now + self.lease_seconds, row[0]))
+            self.db.execute('COMMIT')
+        return row
+
+    def heartbeat(self, unit_id: int) -> bool:
+        """
+        Renews this worker's lease on a unit
+
+        :param unit_id: id of unit (int)
+        :return: boolean of whether the lease was still held
+        """
+        with self.lock:
+            cursor = self.db.execute(
+                'UPDATE units SET expires = ? '
+                'WHERE id = ? AND owner = ? AND status = ?',
+                (time.time() + self.lease_seconds, unit_id,
+                 self.worker_id, 'leased'))
+        return cursor.rowcount == 1
+
+    def complete(self, unit_id: int) -> bool:
+        """
+        Marks a leased unit as done
+
+        :param unit_id: id of unit (int)
+        :return: boolean of whether the lease was still held
+        """
+        with self.lock:
+            cursor = self.db.execute(
+                'UPDATE units SET status = ?, expires = NULL '
+                'WHERE id = ? AND owner = ? AND status = ?',
+                ('done', unit_id, self.worker_id, 'leased'))
+        return cursor.rowcount == 1
+
+    def release(self, unit_id: int):
+        """
+        Gives a unit back without finishing it, e.g. after an error.
+        A unit that has been tried max_attempts times is marked failed
+
+        :param unit_id: id of unit (int)
+        :return: None
+        """
+        with self.lock:
+            self.db.execute(
+                'UPDATE units SET status = CASE WHEN attempts >= ? '
+                'THEN ? ELSE ? END, owner = NULL, expires = NULL '
+                'WHERE id = ? AND owner = ? AND status = ?',
+                (self.max_attempts, 'failed', 'pending', unit_id,
+                 self.worker_id, 'leased'))
+
+    def populated(self) -> bool:
+        """
+        Checks if any units have been added yet
+
+        :return: boolean
+        """
+        with self.lock:
+            return self._count() > 0
+
+    def remaining(self) -> int:
+        """
+        Returns number of units still pending or leased
+
+        :return: int
+        """
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM units '
+                                   'WHERE status IN (?, ?)',
+                                   ('pending', 'leased')).fetchone()[0]
+
+    def get_usage_report(self) -> dict:
+        """
+        Returns progress of the whole table
+
+        :return: dict of form {
+            "Lease_Table_Report": {
+                "Pending": int,
+                "Leased": int,
+                "Expired": int,
+                "Done": int,
+                "Failed": int
+            }
+        }
+        """
+        now = time.time()
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT status, expires < ?, COUNT(*) FROM units '
+                'GROUP BY status, expires < ?', (now, now)).fetchall()
+        usage = {"Pending": 0, "Leased": 0, "Expired": 0, "Done": 0,
+                 "Failed": 0}
+        for status, expired, count in rows:
+            if status == 'leased' and expired:
+                usage["Expired"] += count
+            else:
+                usage[status.capitalize()] += count
+        return {"Lease_Table_Report": usage}
+
+    def _count(self) -> int:
+        return self.db.execute('SELECT COUNT(*) FROM units').fetchone()[0]
@@ -1,25 +1,45 @@
 import json
+import os
+import queue
 import time
-from threading import Thread
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from threading import Event, Lock, Thread
 from elasticsearch import Elasticsearch
+import checkpoint
 import keys
+import leases
+import metrics
 from datasources import azlyrics
 from datasources import genius
 from datasources import spotify
 from datasources import wikia
 from datasources import metrolyrics
 from datasources import musixmatchapi
+from datasources import sessions
+from datasources import cache
+from datasources import ratelimit
 from processing import elasticsearchdb
-from processing import processing
+from processing import jsonlsink
+from processing import analysispool
+from processing import seenindex
 
 from datasources import billboards
+from datasources import chartstore
 
 
 class LyricScraper:
 
     def __init__(self, charts, start_date="2018-10-13",
                  stop_date='1958-01-01', backtrack=False,
-                 es=False, max_records=20, max_threads=3):
+                 es=False, max_records=20, max_threads=3,
+                 fan_out=False, pool_sizes=None, cache_config=None,
+                 chart_store_path=None, seen_index_config=None,
+                 bulk_config=None, queue_size=None, rate_config=None,
+                 checkpoint_config=None, stem_cache_config=None,
+                 pos_cache_config=None, union_engine="dict",
+                 nltk_config=None, analysis_workers=0, sink_config=None,
+                 es_config=None, es_client=None, metrics_config=None):
         """
 
         :param charts:
@@ -28,6 +48,68 @@ class LyricScraper:
         :param backtrack:
         :param es:
         :param max_records:
+        :param max_threads:
+        :param fan_out: boolean option - true to query all data sources
+            for a song concurrently instead of one after another
+        :param pool_sizes: dict of {"host": max pooled connections (int)}
+            for the keep-alive session shared by all data sources
+        :param cache_config: dict of on-disk response cache settings of
+            form {"cache_dir": str, "max_megabytes": int,
+            "ttls": {"host": seconds or None}, "not_found_ttl": seconds
+            or None}, no cache if not given
+        :param chart_store_path: path of local billboard chart store
+            (str), charts are always fetched if not given
+        :param seen_index_config: dict of in-process seen song index
+            settings of form {"warm_from_es": bool, "bloom_path": str,
+            "bloom_capacity": int, "bloom_error_rate": float,
+            "single_writer": bool}, every existence check goes to ES
+            if not given. single_writer has to be false when other
+            processes write to the index too (see seenindex.SeenIndex).
+            The Bloom filter settings only matter for a single writer
+            with warm_from_es false
+        :param bulk_config: dict of ES bulk writer settings of form
+            {"batch_size": int, "max_megabytes": float,
+            "flush_interval": float, "max_retries": int,
+            "retry_backoff": float}, one index request per song
+            if not given
+        :param queue_size: max (chart, date) tasks waiting for a worker,
+            defaults to twice max_threads
+        :param rate_config: dict of per host rate limits of form
+            {"default": dict, "hosts": {"host": dict}}, each dict of
+            ratelimit.HostLimiter keyword arguments, no limits if not given
+        :param checkpoint_config: dict of crash safe progress journal
+            settings of form {"path": str, "resume": bool}, a run starts
+            over from start_date if not given. With resume false the
+            journal is cleared and the run starts over
+        :param stem_cache_config: dict of stem cache settings of form
+            {"max_size": int, "lexicon_path": str}, every word is
+            stemmed if not given
+        :param pos_cache_config: dict of POS tag cache settings of form
+            {"max_size": int, "lexicon_path": str}, every word is
+            tagged if not given
+        :param union_engine: "dict" to union lyric BoWs with nested
+            dicts, "matrix" to use the numpy words x sources engine
+        :param nltk_config: dict of NLTK data settings of form
+            {"data_dirs": list of str, "allow_download": bool,
+            "resources": {"package": "resource path"}}, NLTK's default
+            data locations and no downloads if not given
+        :param analysis_workers: number of processes lyric analysis
+            runs in, -1 for one per cpu, analysis runs on the scraping
+            threads if 0
+        :param sink_config: dict of JSONL output settings of form
+            {"directory": str, "max_megabytes": float,
+            "compression": None, "gzip" or "zstd",
+            "fsync_interval": float, "queue_size": int}, used instead of
+            one pretty printed file per chart when not using ES
+        :param es_config: dict of ES connection settings of form
+            {"hosts": list, "startup_delay": float}, the docker-compose
+            'elasticsearch' service if not given
+        :param es_client: elasticsearch client to use instead of
+            connecting, e.g. an in-process stand-in for benchmarks
+        :param metrics_config: dict of live metrics endpoint settings of
+            form {"host": str, "port": int}, served for Prometheus at
+            /metrics for as long as the process runs, no endpoint if
+            not given
         """
         self.start_date = start_date
         self.stop_date = stop_date
@@ -36,63 +118,306 @@ class LyricScraper:
         self.charts = charts
         self.max_records = max_records
         self.max_threads = max_threads
+        self.fan_out = fan_out
         self.records_processed = 0
         self.unique_songs  = 0
+        self.queue_size = queue_size or self.max_threads * 2
+        self.week_pending = {}      # date: charts of that week not done yet
+        self.week_lock = Lock()
+        self.log_lock = Lock()
+        self.lease_table = None     # leases.LeaseTable of a sharded run
+        self.held_units = {}        # (chart, date): id of unit this process holds
+        self.units_done = 0         # lease table units finished
+        self.stored_units = []      # (chart, date, keys) not yet flushed
+        self.task_queue = None      # (chart, date) tasks of the current run
 
-        self.chart_partition = []
-        for thread in range(self.max_threads):
-            self.chart_partition.append([])
-        for num in range(len(self.charts)):
-            self.chart_partition[num%self.max_threads].\
-                append(self.charts[num])
+        self.checkpoint = None
+        if checkpoint_config:
+            self.checkpoint = checkpoint.Checkpoint(
+                checkpoint_config.get("path", "cache/checkpoint.sqlite"))
+            if checkpoint_config.get("resume", True):
+                print({"Resuming": self.checkpoint.get_resume_report()})
+            else:
+                self.checkpoint.reset()
 
         api_keys = keys.Keys()
+        self.response_cache = None
+        if cache_config:
+            self.response_cache = cache.ResponseCache(
+                cache_dir=cache_config.get("cache_dir", "cache/http"),
+                max_bytes=cache_config.get("max_megabytes", 2048) * 1024 ** 2,
+                ttls=cache_config.get("ttls"),
+                not_found_ttl=cache_config.get("not_found_ttl", 86400))
+        self.rate_limiter = None
+        if rate_config:
+            self.rate_limiter = ratelimit.RateLimiter(
+                defaults=rate_config.get("default"),
+                hosts=rate_config.get("hosts"))
+        self.session_pool = sessions.SessionPool(pool_sizes=pool_sizes,
+                                                 cache=self.response_cache,
+                                                 limiter=self.rate_limiter)
         self.SS = spotify.SpotifyScraper(
             client_id=[api_keys.spotify_client_id,
                        api_keys.spotify_client_id2],
             client_secret=[api_keys.spotify_client_secret,
-                           api_keys.spotify_client_secret2]
+                           api_keys.spotify_client_secret2],
+            session_pool=self.session_pool
         )
         self.data_sources = [
-            azlyrics.AZLyricsScraper(),
+            azlyrics.AZLyricsScraper(session_pool=self.session_pool),
             genius.GeniusScraper(
-                token=api_keys.genius_token
+                token=api_keys.genius_token,
+                session_pool=self.session_pool
             ),
-            wikia.WikiaScraper(),
-            metrolyrics.MetroLyrics(),
+            wikia.WikiaScraper(limiter=self.rate_limiter),
+            metrolyrics.MetroLyrics(session_pool=self.session_pool),
             self.SS
         ]
-        self.BB = billboards.BillboardScraper()
-        self.MM = musixmatchapi.MusiXMatchAPI(key=api_keys.musixmatch_key)
-        self.Proc = processing.LyricAnalyst()
+        # Shared pool for per-song source fan out, sized so every
+        # chart thread can have all of its sources in flight at once:
+        self.source_pool = None
+        if self.fan_out:
+            self.source_pool = ThreadPoolExecutor(
+                max_workers=self.max_threads * len(self.data_sources))
+        chart_store = None
+        if chart_store_path:
+            chart_store = chartstore.ChartStore(chart_store_path)
+        self.BB = billboards.BillboardScraper(chart_store=chart_store,
+                                              limiter=self.rate_limiter)
+        self.MM = musixmatchapi.MusiXMatchAPI(key=api_keys.musixmatch_key,
+                                              limiter=self.rate_limiter)
+        analyst_config = {"nltk": nltk_config,
+                          "stem_cache": stem_cache_config,
+                          "pos_cache": pos_cache_config,
+                          "union_engine": union_engine}
+        self.Proc = analysispool.build_analyst(analyst_config)
+        self.song_sink = None
+        self.usage_sink = None
+        if sink_config and not self.use_es:
+            sink_settings = dict(
+                directory=sink_config.get("directory", "sample_results"),
+                max_megabytes=sink_config.get("max_megabytes", 256),
+                compression=sink_config.get("compression"),
+                fsync_interval=sink_config.get("fsync_interval", 1.0),
+                queue_size=sink_config.get("queue_size", 10000))
+            self.song_sink = jsonlsink.JsonlSink(prefix="songs",
+                                                 **sink_settings)
+            self.usage_sink = jsonlsink.JsonlSink(prefix="usage",
+                                                  **sink_settings)
+        self.analysis_pool = None
+        if analysis_workers:
+            self.analysis_pool = analysispool.AnalysisPool(
+                self.Proc, analyst_config,
+                max_workers=analysis_workers if analysis_workers > 0 else None)
         if self.use_es:
-            self.ES = elasticsearchdb.ElasticSearch("song_data")
+            seen = None
+            warm = False
+            if seen_index_config:
+                seen = seenindex.SeenIndex(
+                    bloom_path=seen_index_config.get("bloom_path"),
+                    bloom_capacity=seen_index_config.get("bloom_capacity",
+                                                         5000000),
+                    bloom_error_rate=seen_index_config.get("bloom_error_rate",
+                                                           0.001),
+                    single_writer=seen_index_config.get("single_writer",
+                                                        True))
+                warm = seen_index_config.get("warm_from_es", True)
+            es_config = es_config or {}
+            self.ES = elasticsearchdb.ElasticSearch(
+                "song_data",
+                seen_index=seen,
+                warm_seen_index=warm,
+                bulk_config=bulk_config,
+                es_client=es_client,
+                hosts=es_config.get("hosts"),
+                startup_delay=es_config.get("startup_delay", 5))
+        self.metrics = None
+        if metrics_config:
+            self.metrics = metrics.MetricsServer(
+                self, host=metrics_config.get("host", "0.0.0.0"),
+                port=metrics_config.get("port", 9108))
+            print("Serving metrics at", self.metrics.start())
 
     def run(self):
         """
-        Main run loop
+        Main run loop. A producer thread queues a (chart, date) task for
+        every chart of every week in the date range, and a fixed pool of
+        max_threads workers drains the queue continuously, so a slow
+        chart never holds up the other workers. The queue is bounded so
+        the producer only runs a little ahead of the workers.
 
         :return: None
         """
         begin = time.time()
-        cur_date = self.start_date
+        tasks = queue.Queue(maxsize=self.queue_size)
+        self.task_queue = tasks
+
+        producer = Thread(target=self._produce_tasks, args=(tasks,),
+                          daemon=True)
+        producer.start()
+        workers = []
+        for _ in range(self.max_threads):
+            t = Thread(target=self._consume_tasks, args=(tasks, begin),
+                       daemon=True)
+            t.start()
+            workers.append(t)
+        producer.join()
+        for t in workers:
+            t.join()
+
+        self._close_storage()
+
+    def _produce_tasks(self, tasks: queue.Queue):
+        """
+        Queues every chart of every week from start_date back to
+        stop_date that the checkpoint doesn't have as done, then one
+        stop sentinel per worker
 
+        :param tasks: queue of (chart, date) tasks
+        :return: None
+        """
+        cur_date = self.start_date
         while (time.strptime(cur_date, "%Y-%m-%d") > time.strptime(self.stop_date, "%Y-%m-%d")) and \
                 (self.max_records == 0 or self.records_processed < self.max_records):
+            charts = [chart for chart in self.charts
+                      if not self._unit_done(chart, cur_date)]
+            if charts:
+                with self.week_lock:
+                    self.week_pending[cur_date] = len(charts)
+                for chart in charts:
+                    tasks.put((chart, cur_date))
+            cur_date = self.BB.rewind_one_week(cur_date)
+
+        for _ in range(self.max_threads):
+            tasks.put(None)
 
-            threads = []
+    def _consume_tasks(self, tasks: queue.Queue, begin: float):
+        """
+        Worker loop, processes (chart, date) tasks until it
+        gets the stop sentinel
+
+        :param tasks: queue of (chart, date) tasks
+        :param begin: timestamp from start of calling run()
+        :return: None
+        """
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            chart, date = task
+            try:
+                self.get_augmented_chart_list(chart=chart, date=date)
+            except Exception:
+                traceback.print_exc()
+            self._chart_done(date, begin)
 
-            # Main process for data collection:
-            for charts in self.chart_partition:
-                t = Thread(target=self.get_data_load_balanced, args=(charts, cur_date), daemon=True)
-                t.start()
-                threads.append(t)
-            for t in threads:
-                t.join()
+    def _chart_done(self, date: str, begin: float):
+        """
+        Marks one chart of a week as done, and logs usage once
+        every chart of that week is done
 
-            # All charts are done for this time period. Cleanup:
+        :param date: date of finished chart (str)
+        :param begin: timestamp from start of calling run()
+        :return: None
+        """
+        with self.week_lock:
+            self.week_pending[date] -= 1
+            week_done = self.week_pending[date] == 0
+            if week_done:
+                del self.week_pending[date]
+        if week_done:
             self.log_performance(begin)
-            cur_date = self.BB.rewind_one_week(cur_date)
+
+    def run_leased(self, lease_table: leases.LeaseTable, poll_seconds=10):
+        """
+        Worker run loop for sharded runs. Instead of walking the date
+        range itself, each of max_threads threads claims (chart, date)
+        units from the shared lease table until none are left, so any
+        number of processes or containers can split one backfill. A
+        heartbeat thread keeps the leases of units in progress alive.
+        Usage is logged once every len(charts) units.
+
+        :param lease_table: lease table of work units
+        :param poll_seconds: seconds to wait when every unit left is
+            leased by other workers (int)
+        :return: None
+        """
+        begin = time.time()
+        self.lease_table = lease_table
+        stop = Event()
+        heartbeat = Thread(target=self._renew_leases, args=(lease_table, stop),
+                           daemon=True)
+        heartbeat.start()
+        workers = []
+        for _ in range(self.max_threads):
+            t = Thread(target=self._consume_leases,
+                       args=(lease_table, begin, poll_seconds), daemon=True)
+            t.start()
+            workers.append(t)
+        for t in workers:
+            t.join()
+        stop.set()
+        heartbeat.join()
+
+        self.log_performance(begin)
+        self._close_storage()
+
+    def _consume_leases(self, lease_table: leases.LeaseTable, begin: float,
+                        poll_seconds: int):
+        """
+        Worker loop for sharded runs, claims and processes units
+        until every unit in the table is done. A stored unit keeps its
+        lease until its data has been flushed (see _complete_units), so
+        when there is nothing left to claim the units this process
+        stored are flushed before checking if the table is done
+
+        :param lease_table: lease table of work units
+        :param begin: timestamp from start of calling run_leased()
+        :param poll_seconds: seconds to wait between claim attempts
+        :return: None
+        """
+        while self.max_records == 0 or self.records_processed < self.max_records:
+            unit = lease_table.claim()
+            if unit is None:
+                if self.stored_units:
+                    with self.log_lock:
+                        self._flush_storage()
+                if lease_table.populated() and lease_table.remaining() == 0:
+                    return
+                time.sleep(poll_seconds)
+                continue
+
+            unit_id, chart, date = unit
+            with self.week_lock:
+                self.held_units[(chart, date)] = unit_id
+            try:
+                if not self.get_augmented_chart_list(chart=chart, date=date):
+                    # Nothing to store, e.g. a bad billboard chart
+                    self._finish_units([(chart, date)])
+            except Exception:
+                traceback.print_exc()
+                self._fail_units([(chart, date)])
+            with self.week_lock:
+                self.units_done += 1
+                log_now = self.units_done % len(self.charts) == 0
+            if log_now:
+                self.log_performance(begin)
+
+    def _renew_leases(self, lease_table: leases.LeaseTable, stop: Event):
+        """
+        Renews the leases of all units in progress three times
+        per lease period
+
+        :param lease_table: lease table of work units
+        :param stop: event set when the run is over
+        :return: None
+        """
+        while not stop.wait(lease_table.lease_seconds / 3.0):
+            with self.week_lock:
+                held = list(self.held_units.values())
+            for unit_id in held:
+                if not lease_table.heartbeat(unit_id):
+                    print({"Lease Lost": unit_id})
 
     def log_performance(self, begin):
         """
@@ -101,15 +426,47 @@ class LyricScraper:
         :param begin: timestamp from start of calling run()
         :return: None
         """
+        with self.log_lock:
+            self._flush_storage()
+            if self.use_es:
+                self.ES.log_usage(self.get_usage_reports(),
+                                  (time.time() - begin),
+                                  self.records_processed)
+                self.ES.save_seen_index()
+                self.Proc.save_lexicons()
+            elif self.song_sink is not None:
+                report = self.get_usage_reports()
+                report["Timestamp"] = time.time()
+                self.usage_sink.write(report)
+                self.Proc.save_lexicons()
+            else:
+                self._log_to_file(self.get_usage_reports(),
+                                  "usage",
+                                  (str(self.records_processed) + "records"))
+                self.Proc.save_lexicons()
+            self.clear_usage()
+
+    def _flush_storage(self):
+        """
+        Flushes ES or the JSONL sink and completes the units the flush
+        covers, call with log_lock held. If the sink couldn't write
+        everything the units are given back instead
+
+        :return: None
+        """
+        # Units stored after this point may not be covered by the
+        # flush, they wait for the next one
+        units = self._take_stored_units()
         if self.use_es:
-            self.ES.log_usage(self.get_usage_reports(),
-                              (time.time() - begin),
-                              self.records_processed)
-        else:
-            self._log_to_file(self.get_usage_reports(),
-                              "usage",
-                              (str(self.records_processed) + "records"))
-        self.clear_usage()
+            self.ES.flush()
+        elif self.song_sink is not None:
+            try:
+                self.song_sink.flush()
+            except IOError:
+                traceback.print_exc()
+                self._fail_units([(chart, date) for chart, date, _ in units])
+                return
+        self._complete_units(units)
 
     def get_data_load_balanced(self, chart_list: list, date: str):
         """
@@ -128,19 +485,20 @@ class LyricScraper:
         """
         Takes a billboard charts and gets
         all of the artist and track names from them and all song info
-        ans lyrics, returns a dictionary of results
+        ans lyrics, and stores them
 
         :param chart: name of billboard chart (str)
         :param date: date to poll charts for
-        :return: dictionary of chart info
+        :return: boolean of whether the chart was stored
         """
         master_dict = {}
-        artist_id_list = []
-        sub_artist_id_list = []
         chart_dict = self.BB.get_chart(chart_name=chart, date_str=date)
         if "Error" in chart_dict.keys():
             print({"Bad Billboard Chart": chart_dict["Error"]})
-            return
+            return False
+        known_songs = self._get_known_songs(chart_dict)
+        restored = self._restore_songs(chart, date)
+        pending = []    # analyses still running in the analysis pool
 
         for key, val in chart_dict.items():
 
@@ -152,60 +510,231 @@ class LyricScraper:
                 continue
 
             # setup main key and date str
-            master_key = val["BB_Artist"] + "_" + val["BB_Song_Title"]
+            master_key = self._master_key(val)
             date_str = val["BB_Chart_Discovered"]["Date"]
 
             # If new song:
-            if (self.use_es and not self.ES.song_in_db(
-                    master_key)) or not self.use_es:
+            if master_key not in known_songs:
 
-                song_dict = self._get_song_data(val, True)
-                if song_dict["Genius_Lyrics"] == "" and song_dict["AZ_Lyrics"] == "" \
-                    and song_dict["Wikia_Lyrics"] == "" and song_dict["MetroLyrics"] == "":
+                if master_key in restored:
+                    song_dict = restored[master_key]
+                else:
+                    self._start_song(chart, date, master_key)
+                    song_dict = self._get_song_data(val, True)
+                    analysis = self._analyze_song(chart, date, master_key,
+                                                  song_dict)
+                    if analysis is not None:
+                        pending.append(analysis)
+                if not self._has_lyrics(song_dict):
                     continue
                 status = "New Entry"
                 self.unique_songs += 1
                 master_dict[master_key] = song_dict
 
-                # Keep track of spotify artist id for batch processing:
-                if song_dict["Spotify_Artist_ID"] != "Not Found":
-                    sub_artist_id_list.append(song_dict["Spotify_Artist_ID"])
-                    if len(sub_artist_id_list) > 45:
-                        artist_id_list.append(sub_artist_id_list)
-
             # Finished Message so we know there's progress
             print(self._progress_message(status, chart, date_str,
                                          val, self.records_processed))
             self.records_processed += 1
 
-        # Append Spotify Artist info in batch
-        if sub_artist_id_list != []:
-            artist_id_list.append(sub_artist_id_list)
+        for analysis in pending:
+            analysis.result()
+        self._add_spotify_artist_info(master_dict)
+        self._store_chart(master_dict, chart, date)
+        self._unit_stored(chart, date, list(master_dict))
+        return True
+
+    def _unit_done(self, chart: str, date: str) -> bool:
+        """
+        Checks if the checkpoint has a unit as done
+
+        :param chart: name of billboard chart (str)
+        :param date: date of chart (str)
+        :return: boolean, always false without a checkpoint
+        """
+        return self.checkpoint is not None and \
+            self.checkpoint.is_done(chart, date)
+
+    def _restore_songs(self, chart: str, date: str) -> dict:
+        """
+        Reads songs of a unit an interrupted run already scraped
+
+        :param chart: name of billboard chart (str)
+        :param date: date of chart (str)
+        :return: dict of {"master key": song dict}
+        """
+        if self.checkpoint is None:
+            return {}
+        return self.checkpoint.restore_songs(chart, date)
+
+    def _start_song(self, chart: str, date: str, master_key: str):
+        if self.checkpoint is not None:
+            self.checkpoint.start_song(chart, date, master_key)
+
+    def _finish_song(self, chart: str, date: str, master_key: str,
+                     song_dict: dict):
+        if self.checkpoint is not None:
+            self.checkpoint.finish_song(chart, date, master_key, song_dict)
+
+    def _unit_stored(self, chart: str, date: str, keys: list):
+        """
+        Records a unit whose data has been handed to storage. Files are
+        written synchronously so the unit is done right away, ES and
+        JSONL writes may still sit in a buffer so the unit waits for
+        the next flush
+
+        :param chart: name of billboard chart (str)
+        :param date: date of chart (str)
+        :param keys: master keys of the songs stored for the unit (str)
+        :return: None
+        """
+        if self.checkpoint is None and self.lease_table is None:
+            return
+        if self.use_es or self.song_sink is not None:
+            with self.week_lock:
+                self.stored_units.append((chart, date, keys))
+        else:
+            self._finish_units([(chart, date)])
+
+    def _take_stored_units(self) -> list:
+        """
+        Takes the units stored so far, call before flushing so only
+        units whose data the flush covers are completed after it
+
+        :return: list of (chart, date, keys) tuples
+        """
+        with self.week_lock:
+            units, self.stored_units = self.stored_units, []
+        return units
+
+    def _complete_units(self, units: list):
+        """
+        Marks units done once ES or the JSONL sink has been flushed.
+        A unit with songs still waiting in the bulk writer goes back
+        for the next flush, one with songs ES didn't take is left
+        undone so a resumed run, or another lease worker, scrapes it
+        again
+
+        :param units: list of (chart, date, keys) tuples taken before
+            the flush
+        :return: None
+        """
+        done = []
+        failed_units = []
+        for chart, date, keys in units:
+            if self.use_es:
+                pending, failed = self.ES.unwritten(keys)
+                if failed:
+                    print({"Unit Not Stored": [chart, date, len(failed)]})
+                    failed_units.append((chart, date))
+                    continue
+                if pending:
+                    with self.week_lock:
+                        self.stored_units.append((chart, date, keys))
+                    continue
+            done.append((chart, date))
+        self._finish_units(done)
+        self._fail_units(failed_units)
+
+    def _finish_units(self, units: list):
+        """
+        Marks units done in the checkpoint and the lease table
+
+        :param units: list of (chart, date) tuples
+        :return: None
+        """
+        if self.checkpoint is not None:
+            self.checkpoint.complete(units)
+        for unit_id in self._drop_leases(units):
+            self.lease_table.complete(unit_id)
+
+    def _fail_units(self, units: list):
+        """
+        Gives the leases of units that couldn't be stored back
+
+        :param units: list of (chart, date) tuples
+        :return: None
+        """
+        for unit_id in self._drop_leases(units):
+            self.lease_table.release(unit_id)
+
+    def _drop_leases(self, units: list) -> list:
+        """
+        :param units: list of (chart, date) tuples
+        :return: list of ids of the units' leases this process held
+        """
+        with self.week_lock:
+            return [unit_id for unit_id in
+                    (self.held_units.pop(unit, None) for unit in units)
+                    if unit_id is not None]
+
+    def _get_known_songs(self, chart_dict: dict) -> set:
+        """
+        Resolves which songs of a chart are already in elasticsearch
+        with one batched lookup, before any scraping starts
+
+        :param chart_dict: dict of chart entries from get_chart
+        :return: set of master keys already stored
+        """
+        if not self.use_es:
+            return set()
+        return self.ES.songs_in_db([
+            self._master_key(val) for key, val in chart_dict.items()
+            if key not in ["Billboard_Chart", "Year", "Month", "Day"]
+        ])
+
+    def _add_spotify_artist_info(self, master_dict: dict):
+        """
+        Appends Spotify artist info (genres, followers, popularity) to
+        every song in the chart that was found on Spotify. Artist ids are
+        sent in batches of 45 to stay under the API's per request limit
+
+        :param master_dict: dict of augmented chart/song data
+        :return: None
+        """
+        artist_ids = [val["Spotify_Artist_ID"] for val in master_dict.values()
+                      if val["Spotify_Artist_ID"] != "Not Found"]
 
         ss_artist_info = {}
-        for id_list in artist_id_list:
+        for i in range(0, len(artist_ids), 45):
             ss_artist_info.update(
-                self.SS.get_artist_info_list(id_list))
+                self.SS.get_artist_info_list(artist_ids[i:i + 45]))
 
         for key, val in master_dict.items():
-            if val["Spotify_Artist_ID"] != "Not Found":
+            if val["Spotify_Artist_ID"] in ss_artist_info:
                 master_dict[key].update(ss_artist_info[val["Spotify_Artist_ID"]])
 
-        # Log data:
+    def _store_chart(self, master_dict: dict, chart: str, date: str):
+        """
+        Logs augmented chart data in elasticsearch or in file
+
+        :param master_dict: dict of augmented chart/song data
+        :param chart: name of billboard chart (str)
+        :param date: date of chart (str)
+        :return: None
+        """
         if self.use_es:
-            self._put_data_in_es(master_dict)
+            # Songs of master_dict were all found missing by
+            # _get_known_songs, no need to ask ES again
+            self._put_data_in_es(master_dict, checked=True)
+        elif self.song_sink is not None:
+            for key, val in master_dict.items():
+                record = dict(val)
+                record["Master_Key"] = key
+                self.song_sink.write(record)
         else:
             self._log_to_file(master_dict, chart, date)
 
-    def _put_data_in_es(self, master_dict: dict):
+    def _put_data_in_es(self, master_dict: dict, checked=False):
         """
         puts augmented chart data into elasticsearch
 
         :param master_dict: dict of augmented chart/song data
+        :param checked: boolean option - true if every song was already
+            looked up and found missing, so none is checked again
         :return: none
         """
         for key, val in master_dict.items():
-            if not self.ES.song_in_db(key):
+            if checked or not self.ES.song_in_db(key):
                 self.ES.put_new_data(song_data=val, unique_key=key)
 
     def _get_song_data(self, val: dict, flatten_lyrics=False) -> dict:
@@ -220,23 +749,119 @@ class LyricScraper:
         artist_name = val["BB_Artist"]
         track_title = val["BB_Song_Title"]
 
-        for data in self.data_sources:
-            song_dict.update(data.get_song_data(artist_name=artist_name,
-                                                track_title=track_title,
-                                                flatten_lyrics=flatten_lyrics))
+        if self.fan_out:
+            song_dict.update(self._get_song_data_fan_out(
+                artist_name, track_title, flatten_lyrics))
+        else:
+            for data in self.data_sources:
+                song_dict.update(data.get_song_data(artist_name=artist_name,
+                                                    track_title=track_title,
+                                                    flatten_lyrics=flatten_lyrics))
         if song_dict["Spotify_Artist_ID"] == "Not Found":
             song_dict.update(
                 self.MM.get_song_data(artist_name, track_title)
             )
-        # Add basic lyric analytics:
-        results = self.Proc.get_lyric_stats([
+        return song_dict
+
+    def _analyze_song(self, chart: str, date: str, master_key: str,
+                      song_dict: dict):
+        """
+        Adds basic lyric analytics to a scraped song and journals it.
+        With an analysis pool the analysis runs in another process and
+        is merged into song_dict when it's done, so the thread can go
+        on scraping in the meantime
+
+        :param chart: name of billboard chart (str)
+        :param date: date of chart (str)
+        :param master_key: unique key identifying song (str)
+        :param song_dict: dict of aggregate song data
+        :return: Future done once the stats are merged, or None if
+            they already are
+        """
+        if self.analysis_pool is None:
+            song_dict.update(self._get_lyric_stats(song_dict))
+            self._finish_song(chart, date, master_key, song_dict)
+            return None
+
+        def merge(stats):
+            song_dict.update(stats)
+            self._finish_song(chart, date, master_key, song_dict)
+
+        return self.analysis_pool.submit(self._lyrics_list(song_dict), merge)
+
+    def _get_lyric_stats(self, song_dict: dict) -> dict:
+        """
+        Runs lyric analytics over the lyrics of every source
+
+        :param song_dict: dict of aggregate song data
+        :return: dict of lyric stats
+        """
+        return self.Proc.get_lyric_stats(self._lyrics_list(song_dict))
+
+    def _close_analysis_pool(self):
+        if self.analysis_pool is not None:
+            self.analysis_pool.close()
+
+    def _close_storage(self):
+        """
+        Shuts down analysis and output at the end of a run, once
+        everything is written the remaining units are marked done
+
+        :return: None
+        """
+        self._close_analysis_pool()
+        units = self._take_stored_units()
+        if self.use_es:
+            self.ES.close()
+        if self.song_sink is not None:
+            try:
+                self.usage_sink.close()
+            except IOError:
+                traceback.print_exc()
+            try:
+                self.song_sink.close()
+            except IOError:
+                traceback.print_exc()
+                self._fail_units([(chart, date) for chart, date, _ in units])
+                return
+        self._complete_units(units)
+
+    @staticmethod
+    def _lyrics_list(song_dict: dict) -> list:
+        """
+        Picks the lyrics of every source out of a song
+
+        :param song_dict: dict of aggregate song data
+        :return: list of lyric dictionaries
+        """
+        return [
             {"Genius": song_dict["Genius_Lyrics"]},
             {"AZ": song_dict["AZ_Lyrics"]},
             {"Wikia": song_dict["Wikia_Lyrics"]},
             {"Metro": song_dict["MetroLyrics"]}
-        ])
-        song_dict.update(results)
-        return song_dict
+        ]
+
+    def _get_song_data_fan_out(self, artist_name: str, track_title: str,
+                               flatten_lyrics=False) -> dict:
+        """
+        Queries all data sources for a song at the same time and merges
+        their dicts as they finish, so a song costs roughly the slowest
+        source rather than the sum of all of them
+
+        :param artist_name: name of artist (str)
+        :param track_title: name of track (str)
+        :param flatten_lyrics: boolean value to flatten lyrics
+        :return: dict of merged data from all sources
+        """
+        merged = {}
+        futures = [self.source_pool.submit(data.get_song_data,
+                                           artist_name=artist_name,
+                                           track_title=track_title,
+                                           flatten_lyrics=flatten_lyrics)
+                   for data in self.data_sources]
+        for future in as_completed(futures):
+            merged.update(future.result())
+        return merged
 
     def get_usage_reports(self):
         """
@@ -252,16 +877,34 @@ class LyricScraper:
             report_dict.update(data.get_usage_report())
         report_dict.update(self.MM.get_usage_report())
         report_dict.update(self.Proc.get_usage_report())
+        if self.response_cache is not None:
+            report_dict.update(self.response_cache.get_cache_report())
+        if self.checkpoint is not None:
+            report_dict.update(self.checkpoint.get_usage_report())
+        if self.song_sink is not None:
+            report_dict.update(self.song_sink.get_usage_report())
         if self.use_es:
             report_dict.update(self.ES.get_usage_report())
         return report_dict
 
     def clear_usage(self):
+        if self.metrics is not None:
+            self.metrics.carry_over(self._clear_usage_stats)
+        else:
+            self._clear_usage_stats()
+
+    def _clear_usage_stats(self):
         self.BB.clear_usage_stats()
         for data in self.data_sources:
             data.clear_usage_stats()
         self.MM.clear_usage_stats()
         self.Proc.clear_usage_stats()
+        if self.response_cache is not None:
+            self.response_cache.clear_usage_stats()
+        if self.checkpoint is not None:
+            self.checkpoint.clear_usage_stats()
+        if self.song_sink is not None:
+            self.song_sink.clear_usage_stats()
         if self.use_es:
             self.ES.clear_usage_stats()
 
@@ -279,6 +922,29 @@ class LyricScraper:
         with open(file_path, 'w') as outfile:
             json.dump(data, outfile, indent=4)
 
+    @staticmethod
+    def _master_key(val: dict) -> str:
+        """
+        Builds the unique key of a chart entry
+
+        :param val: dict of song info
+        :return: master key (str)
+        """
+        return val["BB_Artist"] + "_" + val["BB_Song_Title"]
+
+    @staticmethod
+    def _has_lyrics(song_dict: dict) -> bool:
+        """
+        Checks if at least one lyric source found lyrics for a song
+
+        :param song_dict: dict of aggregate song data
+        :return: boolean of whether any lyrics were found
+        """
+        return not (song_dict["Genius_Lyrics"] == "" and
+                    song_dict["AZ_Lyrics"] == "" and
+                    song_dict["Wikia_Lyrics"] == "" and
+                    song_dict["MetroLyrics"] == "")
+
     @staticmethod
     def _progress_message(status: str, chart: str, date_str: str,
                           val: dict, records_processed: int) -> str:
@@ -308,6 +974,46 @@ if __name__ == "__main__":
     es = param["use_elastic_search"]
     max_entries = param["max_entries"]
     max_threads = param["max_threads"]
+    queue_size = param.get("task_queue_size")
+    fan_out = param.get("fan_out_sources", False)
+    use_async = param.get("use_async_engine", False)
+    pool_sizes = param.get("connection_pool_sizes")
+    cache_config = param.get("response_cache")
+    if cache_config is not None and not cache_config.get("enabled", True):
+        cache_config = None
+    chart_store_path = param.get("chart_store")
+    seen_index_config = param.get("seen_index")
+    if seen_index_config is not None and \
+            not seen_index_config.get("enabled", True):
+        seen_index_config = None
+    bulk_config = param.get("es_bulk")
+    if bulk_config is not None and not bulk_config.get("enabled", True):
+        bulk_config = None
+    rate_config = param.get("rate_limits")
+    if rate_config is not None and not rate_config.get("enabled", True):
+        rate_config = None
+    stem_cache_config = param.get("stem_cache")
+    if stem_cache_config is not None and \
+            not stem_cache_config.get("enabled", True):
+        stem_cache_config = None
+    pos_cache_config = param.get("pos_cache")
+    if pos_cache_config is not None and \
+            not pos_cache_config.get("enabled", True):
+        pos_cache_config = None
+    union_engine = param.get("bow_union_engine", "dict")
+    nltk_config = param.get("nltk")
+    analysis_workers = param.get("analysis_processes", 0)
+    sink_config = param.get("jsonl_sink")
+    if sink_config is not None and not sink_config.get("enabled", True):
+        sink_config = None
+    checkpoint_config = param.get("checkpoint")
+    if checkpoint_config is not None and \
+            not checkpoint_config.get("enabled", True):
+        checkpoint_config = None
+    es_config = param.get("elasticsearch")
+    metrics_config = param.get("metrics")
+    if metrics_config is not None and not metrics_config.get("enabled", True):
+        metrics_config = None
 
     print("Running For Parameters:")
     print("Charts :", charts)
@@ -316,16 +1022,104 @@ if __name__ == "__main__":
     print("Use ES? :", es)
     print("Max Entries :", max_entries)
     print("Max Threads :", max_threads)
+    print("Fan Out Sources? :", fan_out)
+    print("Use Async Engine? :", use_async)
+    print("Resume? :", checkpoint_config is not None and
+          checkpoint_config.get("resume", True))
+
+    lease_config = param.get("lease_table")
+    if lease_config is not None and not lease_config.get("enabled", True):
+        lease_config = None
+    role = os.environ.get("SCRAPER_ROLE",
+                          (lease_config or {}).get("role", "worker"))
+    if lease_config is not None and seen_index_config is not None:
+        # Lease workers write to the index side by side, a warmed seen
+        # index only knows about the songs of its own worker
+        seen_index_config = dict(seen_index_config, single_writer=False)
+
+    if lease_config is not None and role == "coordinator":
+        # Coordinator only splits the run into units and reports progress,
+        # the work itself is done by any number of workers
+        LT = leases.LeaseTable(lease_config.get("path", "cache/leases.sqlite"),
+                               lease_config.get("lease_seconds", 600),
+                               lease_config.get("max_attempts", 3))
+        added = LT.populate(charts, start_date, end_date,
+                            billboards.BillboardScraper.rewind_one_week)
+        print("Added", added, "work units")
+        while LT.remaining() > 0:
+            print(LT.get_usage_report())
+            time.sleep(60)
+        print(LT.get_usage_report())
+        exit(0)
+
+    if lease_config is not None and use_async:
+        raise ValueError("Lease table workers run on the threaded engine, "
+                         "set use_async_engine to false or disable "
+                         "lease_table")
 
     if es:
         time.sleep(20)
         Elasticsearch()
 
-    LS = LyricScraper(charts=charts,
-                      start_date=start_date,
-                      stop_date=end_date,
-                      backtrack=True,
-                      es=es,
-                      max_records=max_entries,
-                      max_threads=max_threads)
-    LS.run()
+    if use_async:
+        from async_main import AsyncLyricScraper
+        LS = AsyncLyricScraper(
+            charts=charts,
+            start_date=start_date,
+            stop_date=end_date,
+            backtrack=True,
+            es=es,
+            max_records=max_entries,
+            max_threads=max_threads,
+            pool_sizes=pool_sizes,
+            cache_config=cache_config,
+            chart_store_path=chart_store_path,
+            seen_index_config=seen_index_config,
+            bulk_config=bulk_config,
+            rate_config=rate_config,
+            checkpoint_config=checkpoint_config,
+            stem_cache_config=stem_cache_config,
+            pos_cache_config=pos_cache_config,
+            union_engine=union_engine,
+            nltk_config=nltk_config,
+            analysis_workers=analysis_workers,
+            sink_config=sink_config,
+            es_config=es_config,
+            metrics_config=metrics_config,
+            max_connections=param.get("async_max_connections", 1000),
+            max_connections_per_host=param.get(
+                "async_max_connections_per_host", 50),
+            max_songs_in_flight=param.get("async_max_songs_in_flight", 500),
+            max_blocking_threads=param.get("async_max_blocking_threads", 32))
+    else:
+        LS = LyricScraper(charts=charts,
+                          start_date=start_date,
+                          stop_date=end_date,
+                          backtrack=True,
+                          es=es,
+                          max_records=max_entries,
+                          max_threads=max_threads,
+                          fan_out=fan_out,
+                          pool_sizes=pool_sizes,
+                          cache_config=cache_config,
+                          chart_store_path=chart_store_path,
+                          seen_index_config=seen_index_config,
+                          bulk_config=bulk_config,
+                          queue_size=queue_size,
+                          rate_config=rate_config,
+                          checkpoint_config=checkpoint_config,
+                          stem_cache_config=stem_cache_config,
+                          pos_cache_config=pos_cache_config,
+                          union_engine=union_engine,
+                          nltk_config=nltk_config,
+                          analysis_workers=analysis_workers,
+                          sink_config=sink_config,
+                          es_config=es_config,
+                          metrics_config=metrics_config)
+    if lease_config is not None:
+        LS.run_leased(leases.LeaseTable(
+            lease_config.get("path", "cache/leases.sqlite"),
+            lease_config.get("lease_seconds", 600),
+            lease_config.get("max_attempts", 3)))
+    else:
+        LS.run()
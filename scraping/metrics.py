@@ -0,0 +1,359 @@
+import math
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+PREFIX = 'lyric_scraper_'
+PROMETHEUS_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+OPENMETRICS_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class _ThreadingServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class MetricsServer:
+
+    def __init__(self, scraper, host='0.0.0.0', port=9108):
+        """
+        Serves live metrics of a LyricScraper at /metrics, in the
+        Prometheus text format or, if the scraper asks for it, in
+        OpenMetrics. Values are read from the scraper's own usage
+        counters and latency trackers on every request, so nothing
+        is updated on the scraping threads for it: records/sec, calls
+        in flight per source, latency and errors per source and stage,
+        HTTP requests and errors per host, cache hit ratios, queue
+        depths and ES bulk latency.
+
+        The usage counters start over every time usage is logged, so
+        the scraper clears them through carry_over and the counters
+        served here keep counting across logs.
+
+        :param scraper: main.LyricScraper
+        :param host: address to listen on (str)
+        :param port: port to listen on, 0 for any free one (int)
+        """
+        self.scraper = scraper
+        self.host = host
+        self.port = port
+        self.lock = threading.RLock()   # held by scrapes and carry_over
+        self.carried = {}       # (name, labels): count from before clears
+        self.started = time.time()
+        self.server = None
+        self.thread = None
+
+    def start(self) -> str:
+        """
+        Starts serving on a background thread
+
+        :return: url of the metrics page (str)
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/metrics', '/'):
+                    self.send_error(404)
+                    return
+                openmetrics = 'application/openmetrics-text' in \
+                              self.headers.get('Accept', '')
+                body = metrics.render(openmetrics).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', OPENMETRICS_TYPE
+                                 if openmetrics else PROMETHEUS_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = _ThreadingServer((self.host, self.port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+        return 'http://{}:{}/metrics'.format(
+            self.host, self.server.server_address[1])
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def carry_over(self, clear):
+        """
+        Adds the counts of the current usage period to the carried
+        totals and clears the scraper's usage stats. Scrapes wait for
+        both, so none of them sees a period counted twice or not at all
+
+        :param clear: callable clearing the scraper's usage stats
+        :return: None
+        """
+        with self.lock:
+            for name, kind, _, samples in self.collect():
+                if kind not in ('counter', 'summary'):
+                    continue
+                for suffix, labels, value, carry in samples:
+                    if carry:
+                        key = (name + suffix, labels)
+                        self.carried[key] = self.carried.get(key, 0) + value
+            clear()
+
+    def render(self, openmetrics=False) -> str:
+        """
+        :param openmetrics: boolean option - true for the OpenMetrics
+            text format, false for the Prometheus one
+        :return: metrics page (str)
+        """
+        with self.lock:
+            carried = dict(self.carried)
+            families = self.collect()
+        lines = []
+        for name, kind, help_text, samples in families:
+            family = PREFIX + name
+            if kind == 'counter' and not openmetrics:
+                family += '_total'
+            lines.append('# HELP {} {}'.format(family, help_text))
+            lines.append('# TYPE {} {}'.format(family, kind))
+            # Stages and hosts with no calls since the last clear keep
+            # their carried counts
+            seen = {(name + suffix, labels)
+                    for suffix, labels, _, carry in samples if carry}
+            samples = samples + [
+                (key[len(name):], labels, 0, True)
+                for key, labels in sorted(carried)
+                if key in (name + '_total', name + '_sum', name + '_count')
+                and (key, labels) not in seen]
+            # Samples of one label set have to be next to each other
+            groups = {}
+            for suffix, labels, value, carry in samples:
+                if carry:
+                    value += carried.get((name + suffix, labels), 0)
+                base = tuple(pair for pair in labels if pair[0] != 'quantile')
+                groups.setdefault(base, []).append(
+                    _format_sample(name + suffix, labels, value))
+            for group in groups.values():
+                lines += group
+        if openmetrics:
+            lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+    def collect(self) -> list:
+        """
+        Reads the current values off the scraper
+
+        :return: list of metric families, tuples of (name, type, help,
+            samples), every sample a tuple of (name suffix, labels as a
+            tuple of (key, value) pairs, value, boolean of whether the
+            value starts over when usage stats are cleared)
+        """
+        ls = self.scraper
+        elapsed = max(time.time() - self.started, 1e-9)
+        families = [
+            ('records_processed', 'counter',
+             'Chart entries processed',
+             [('_total', (), ls.records_processed, False)]),
+            ('unique_songs', 'counter',
+             'Songs scraped for the first time',
+             [('_total', (), ls.unique_songs, False)]),
+            ('records_per_second', 'gauge',
+             'Chart entries processed per second since startup',
+             [('', (), ls.records_processed / elapsed, False)])
+        ]
+        families += self._stage_families()
+        families += self._http_families()
+        families += self._cache_families()
+        families.append(('queue_depth', 'gauge',
+                         'Items waiting in each internal queue',
+                         [('', (('queue', name),), depth, False)
+                          for name, depth in self._queue_depths()]))
+        families += self._bulk_families()
+        return families
+
+    def _trackers(self) -> list:
+        """
+        :return: list of (source name, streamstats.LatencyTracker) of
+            every datasource, the analyst and ES
+        """
+        ls = self.scraper
+        components = [ls.BB] + list(ls.data_sources) + [ls.MM, ls.Proc]
+        if ls.use_es:
+            components.append(ls.ES)
+        return [(type(component).__name__, component.latency)
+                for component in components
+                if getattr(component, 'latency', None) is not None]
+
+    def _stage_families(self) -> list:
+        in_flight = []
+        calls = []
+        errors = []
+        ratios = []
+        latency = []
+        for source, tracker in self._trackers():
+            report = tracker.get_report()
+            in_flight.append(('', (('source', source),),
+                              sum(tracker.get_in_flight().values()), False))
+            source_calls = 0
+            source_errors = 0
+            for stage, stats in report.items():
+                labels = (('source', source), ('stage', stage))
+                calls.append(('_total', labels, stats["Count"], True))
+                errors.append(('_total', labels, stats["Errors"], True))
+                latency += _summary_samples(labels, stats)
+                source_calls += stats["Count"]
+                source_errors += stats["Errors"]
+            with self.lock:
+                source_calls += sum(
+                    value for (name, labels), value in self.carried.items()
+                    if name == 'source_calls_total' and labels[0][1] == source)
+                source_errors += sum(
+                    value for (name, labels), value in self.carried.items()
+                    if name == 'source_errors_total' and labels[0][1] == source)
+            ratios.append(('', (('source', source),),
+                           source_errors / source_calls if source_calls
+                           else 0.0, False))
+        return [
+            ('in_flight_requests', 'gauge',
+             'Calls of each source in progress', in_flight),
+            ('source_calls', 'counter',
+             'Calls of each source and stage', calls),
+            ('source_errors', 'counter',
+             'Calls of each source and stage that raised', errors),
+            ('source_error_ratio', 'gauge',
+             'Share of the calls of each source that raised', ratios),
+            ('stage_latency_seconds', 'summary',
+             'Latency of each source and stage, quantiles since the '
+             'last usage log', latency)
+        ]
+
+    def _http_families(self) -> list:
+        requests = []
+        errors = []
+        in_flight = []
+        tracker = self.scraper.session_pool.latency
+        for host, stats in tracker.get_report().items():
+            labels = (('host', host),)
+            requests.append(('_total', labels, stats["Count"], True))
+            errors.append(('_total', labels, stats["Errors"], True))
+        for host, count in sorted(tracker.get_in_flight().items()):
+            in_flight.append(('', (('host', host),), count, False))
+        return [
+            ('http_requests', 'counter',
+             'Requests sent over the network per host', requests),
+            ('http_errors', 'counter',
+             'Requests per host that failed or got a 5xx or 429', errors),
+            ('http_in_flight_requests', 'gauge',
+             'Requests per host in progress', in_flight)
+        ]
+
+    def _cache_families(self) -> list:
+        ls = self.scraper
+        caches = []
+        if ls.response_cache is not None:
+            report = ls.response_cache.get_usage_report()
+            caches.append(('response', report["Hits"], report["Misses"]))
+        for name, cache in [('stem', ls.Proc.stem_cache),
+                            ('pos', ls.Proc.pos_cache)]:
+            if cache is not None:
+                report = cache.get_usage_report()
+                caches.append((name, report["Hits"], report["Misses"]))
+        if ls.use_es and ls.ES.seen_index is not None:
+            caches.append(('seen_index', ls.ES.local_checks,
+                           ls.ES.exists_calls + ls.ES.mget_calls))
+
+        hits = []
+        misses = []
+        ratios = []
+        with self.lock:
+            carried = dict(self.carried)
+        for name, hit_count, miss_count in caches:
+            labels = (('cache', name),)
+            hits.append(('_total', labels, hit_count, True))
+            misses.append(('_total', labels, miss_count, True))
+            hit_count += carried.get(('cache_hits_total', labels), 0)
+            miss_count += carried.get(('cache_misses_total', labels), 0)
+            lookups = hit_count + miss_count
+            ratios.append(('', labels,
+                           hit_count / lookups if lookups else 0.0, False))
+        return [
+            ('cache_hits', 'counter', 'Cache lookups answered', hits),
+            ('cache_misses', 'counter', 'Cache lookups missed', misses),
+            ('cache_hit_ratio', 'gauge',
+             'Share of cache lookups answered since startup', ratios)
+        ]
+
+    def _queue_depths(self) -> list:
+        """
+        :return: list of (queue name, items waiting (int))
+        """
+        ls = self.scraper
+        depths = []
+        if getattr(ls, 'task_queue', None) is not None:
+            depths.append(('tasks', ls.task_queue.qsize()))
+        if ls.analysis_pool is not None:
+            depths.append(('analysis', ls.analysis_pool.pending))
+        if ls.song_sink is not None:
+            depths.append(('song_sink', ls.song_sink.queue.qsize()))
+            depths.append(('usage_sink', ls.usage_sink.queue.qsize()))
+        if ls.use_es and ls.ES.bulk_writer is not None:
+            depths.append(('es_bulk', ls.ES.bulk_writer.buffered()))
+        return depths
+
+    def _bulk_families(self) -> list:
+        ls = self.scraper
+        if not ls.use_es or ls.ES.bulk_writer is None:
+            return []
+        report = ls.ES.bulk_writer.get_usage_report()
+        return [
+            ('es_bulk_latency_seconds', 'summary',
+             'Latency of ES bulk requests, quantiles since the last '
+             'usage log', _summary_samples((), report["Bulk_Latency"])),
+            ('es_docs_indexed', 'counter', 'Documents ES accepted',
+             [('_total', (), report["Docs_Indexed"], True)]),
+            ('es_docs_failed', 'counter', 'Documents ES rejected',
+             [('_total', (), report["Docs_Failed"], True)])
+        ]
+
+
+def _summary_samples(labels: tuple, stats: dict) -> list:
+    """
+    Turns a LatencyHistogram report into summary samples
+
+    :param labels: labels of the summary, tuple of (key, value) pairs
+    :param stats: dict (see streamstats.LatencyHistogram.get_report)
+    :return: list of samples (see MetricsServer.collect)
+    """
+    samples = [('', labels + (('quantile', str(q)),),
+                stats["P" + str(int(q * 100)) + "_ms"] / 1000.0, False)
+               for q in QUANTILES]
+    samples.append(('_sum', labels,
+                    stats["Mean_ms"] * stats["Count"] / 1000.0, True))
+    samples.append(('_count', labels, stats["Count"], True))
+    return samples
+
+
+def _format_sample(name: str, labels: tuple, value) -> str:
+    return '{}{}{} {}'.format(PREFIX, name, _format_labels(labels),
+                              _format_value(value))
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(key, str(value).replace('\\', '\\\\')
+                         .replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels) + '}'
+
+
+def _format_value(value) -> str:
+    if isinstance(value, int):
+        return str(value)
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
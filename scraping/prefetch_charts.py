@@ -0,0 +1,40 @@
+"""
+Fills the local billboard chart store ahead of a run. Reads charts, date
+window and store path from run.json, any of which can be overridden on
+the command line:
+
+    python prefetch_charts.py --start 2018-10-13 --end 1958-01-01
+"""
+import argparse
+import json
+import time
+
+from datasources import billboards
+from datasources import chartstore
+
+
+if __name__ == "__main__":
+    with open('run.json', 'r') as file:
+        param = json.load(file)
+
+    parser = argparse.ArgumentParser(description="Prefetch billboard charts")
+    parser.add_argument("--charts", nargs="+", default=param["charts"])
+    parser.add_argument("--start", default=param["start_date"])
+    parser.add_argument("--end", default=param["end_date"])
+    parser.add_argument("--store", default=param.get("chart_store",
+                                                     "cache/charts.sqlite"))
+    parser.add_argument("--threads", type=int, default=param["max_threads"])
+    args = parser.parse_args()
+
+    print("Prefetching For Parameters:")
+    print("Charts :", args.charts)
+    print("Start Date : ", args.start)
+    print("End Date :", args.end)
+    print("Chart Store :", args.store)
+
+    begin = time.time()
+    BB = billboards.BillboardScraper(
+        chart_store=chartstore.ChartStore(args.store))
+    fetched = BB.prefetch_range(args.charts, args.start, args.end,
+                                max_threads=args.threads)
+    print("Fetched", fetched, "charts in", time.time() - begin, "seconds")
@@ -0,0 +1,166 @@
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from processing import nltkdata
+from processing import processing
+from processing import wordcache
+
+_worker_analyst = None      # LyricAnalyst of a pool worker process
+
+
+def build_analyst(config: dict) -> processing.LyricAnalyst:
+    """
+    Builds a LyricAnalyst with its NLTK resources, caches and union
+    engine set up from run.json settings
+
+    :param config: dict of form {
+        "nltk": dict of NltkResources settings or None,
+        "stem_cache": dict of WordCache settings or None,
+        "pos_cache": dict of WordCache settings or None,
+        "union_engine": "dict" or "matrix"
+    }
+    :return: LyricAnalyst
+    """
+    nltk_config = config.get("nltk") or {}
+    resources = nltkdata.NltkResources(
+        data_dirs=nltk_config.get("data_dirs"),
+        allow_download=nltk_config.get("allow_download", False),
+        resources=nltk_config.get("resources"))
+    stem_cache = None
+    stem_cache_config = config.get("stem_cache")
+    if stem_cache_config:
+        stem_cache = wordcache.WordCache(
+            resources.stem,
+            max_size=stem_cache_config.get("max_size", 200000),
+            path=stem_cache_config.get("lexicon_path"))
+    pos_cache = None
+    pos_cache_config = config.get("pos_cache")
+    if pos_cache_config:
+        pos_cache = wordcache.WordCache(
+            max_size=pos_cache_config.get("max_size", 200000),
+            path=pos_cache_config.get("lexicon_path"),
+            batch_func=resources.tag_words)
+    union_engine = None
+    if config.get("union_engine", "dict") == "matrix":
+        from processing import bowmatrix
+        union_engine = bowmatrix.MatrixUnion()
+    return processing.LyricAnalyst(stem_cache=stem_cache,
+                                   pos_cache=pos_cache,
+                                   union_engine=union_engine,
+                                   resources=resources)
+
+
+def _analyze(config: dict, lyrics_list: list) -> tuple:
+    """
+    Runs in a pool worker, builds the worker's analyst on first use
+
+    :param config: analyst settings (see build_analyst)
+    :param lyrics_list: list of lyric dictionaries
+    :return: tuple of (stats dict, seconds spent, dict of seconds
+        per stage, dict of cache activity, see _worker_caches)
+    """
+    global _worker_analyst
+    if _worker_analyst is None:
+        _worker_analyst = build_analyst(config)
+        for cache in _worker_caches().values():
+            cache.track_new_words()
+    lookups = {name: (cache.hits, cache.misses)
+               for name, cache in _worker_caches().items()}
+    before = _worker_analyst.elapsed_time_sum
+    _worker_analyst.last_stage_times = {}
+    stats = _worker_analyst.get_lyric_stats(lyrics_list)
+    caches = {name: (cache.hits - lookups[name][0],
+                     cache.misses - lookups[name][1],
+                     cache.take_new_words())
+              for name, cache in _worker_caches().items()}
+    return stats, _worker_analyst.elapsed_time_sum - before, \
+        _worker_analyst.last_stage_times, caches
+
+
+def _worker_caches() -> dict:
+    """
+    :return: dict of {"stem" or "pos": wordcache.WordCache} of the
+        worker's analyst, whose lookups and new words of every song
+        go back to the parent as tuples of (hits, misses, new words)
+    """
+    caches = {"stem": _worker_analyst.stem_cache,
+              "pos": _worker_analyst.pos_cache}
+    return {name: cache for name, cache in caches.items()
+            if cache is not None}
+
+
+class AnalysisPool:
+
+    def __init__(self, analyst: processing.LyricAnalyst, config: dict,
+                 max_workers=None):
+        """
+        Runs lyric analysis (stemming, union, POS tagging) in worker
+        processes, so it neither holds the GIL against the scraping
+        threads nor is limited to one core. Every worker builds its own
+        LyricAnalyst from config. Stats of every finished analysis are
+        also recorded on the parent's analyst, and the workers' cache
+        lookups and newly computed words are merged into the parent's
+        caches, so its usage report and the lexicons it saves cover
+        all songs.
+
+        :param analyst: LyricAnalyst of the parent process
+        :param config: analyst settings (see build_analyst)
+        :param max_workers: number of worker processes (int),
+            defaults to the number of cpus
+        """
+        self.analyst = analyst
+        self.config = config
+        self.max_workers = max_workers or os.cpu_count()
+        self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        self.lock = threading.Lock()
+        self.pending = 0        # songs submitted and not analysed yet
+
+    def submit(self, lyrics_list: list, callback=None) -> Future:
+        """
+        Queues a song's lyrics for analysis
+
+        :param lyrics_list: list of lyric dictionaries
+        :param callback: callable taking the stats dict, run as soon as
+            the stats are back, e.g. to merge them into the song
+        :return: Future that resolves to the stats dict once callback
+            has run
+        """
+        done = Future()
+
+        def finished(future):
+            with self.lock:
+                self.pending -= 1
+            try:
+                stats, elapsed, stage_times, caches = future.result()
+                self.analyst.record_stats(stats, elapsed, stage_times)
+                self._merge_caches(caches)
+                if callback is not None:
+                    callback(stats)
+            except BaseException as e:
+                done.set_exception(e)
+            else:
+                done.set_result(stats)
+
+        with self.lock:
+            self.pending += 1
+        self.executor.submit(_analyze, self.config,
+                             lyrics_list).add_done_callback(finished)
+        return done
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def _merge_caches(self, caches: dict):
+        """
+        Adds a worker's cache activity to the parent's caches
+
+        :param caches: dict of {"stem" or "pos": (hits, misses,
+            new words)} (see _worker_caches)
+        :return: None
+        """
+        parent = {"stem": self.analyst.stem_cache,
+                  "pos": self.analyst.pos_cache}
+        for name, (hits, misses, words) in caches.items():
+            if parent.get(name) is not None:
+                parent[name].merge(words, hits, misses)
@@ -0,0 +1,209 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+# Typed column of every song metric, in on-disk byte layout
+COLUMNS = [
+    ("Percent_Agreed", "<f8"),
+    ("Unique_Word_Count", "<i4"),
+    ("Total_Word_Count", "<i4"),
+    ("Repetition_Coeff", "<f8"),
+    ("Lyric_Sources", "<i1"),
+    ("Peak_Position", "<i2"),
+    ("Chart", "<i2"),
+    ("Chart_Date", "<M8[D]")
+]
+
+
+class ColumnStore:
+
+    def __init__(self, directory: str):
+        """
+        Columnar copy of the song stats for offline analytics. Every
+        metric is a raw little endian array file of one dtype, so a
+        column can be memory mapped and reduced with numpy without
+        parsing any JSON. Rows are appended in batches; index.json holds
+        the committed row count, the chart name of every Chart code and
+        how far each scraper output file has been ingested, and keys.txt
+        holds the Master_Key of every row. A batch only counts once
+        index.json is replaced, so a crash mid append leaves a tail that
+        is cut off the next time the store is opened.
+
+        :param directory: store directory (str)
+        """
+        self.directory = directory
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.index_path = os.path.join(directory, 'index.json')
+        self.keys_path = os.path.join(directory, 'keys.txt')
+        self.index = {"Rows": 0, "Keys_Bytes": 0, "Charts": [], "Sources": {}}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as file:
+                self.index = json.load(file)
+        self.chart_codes = {name: code for code, name
+                            in enumerate(self.index["Charts"])}
+        self._truncate()
+
+    @property
+    def rows(self) -> int:
+        return self.index["Rows"]
+
+    @property
+    def charts(self) -> list:
+        return list(self.index["Charts"])
+
+    def append(self, records: list, source=None, consumed=None) -> int:
+        """
+        Appends the songs that have lyric stats as one batch of rows,
+        songs without stats are skipped
+
+        :param records: list of song dicts as written by the scraper,
+            with a "Master_Key" field
+        :param source: name of the scraper output file the records
+            came from (str), to be recorded with consumed
+        :param consumed: number of records of source ingested so
+            far (int)
+        :return: number of rows added (int)
+        """
+        records = [rec for rec in records if "Percent_Agreed" in rec]
+        with self.lock:
+            if records:
+                columns = self._to_columns(records)
+                for name, dtype in COLUMNS:
+                    self._append_bytes(self._column_path(name),
+                                       columns[name].tobytes())
+                keys = ''.join(rec.get("Master_Key", "").replace('\n', ' ') +
+                               '\n' for rec in records).encode('utf-8')
+                self._append_bytes(self.keys_path, keys)
+                self.index["Rows"] += len(records)
+                self.index["Keys_Bytes"] += len(keys)
+            if source is not None:
+                self.index["Sources"][source] = consumed
+            self._save_index()
+        return len(records)
+
+    def consumed(self, source: str) -> int:
+        """
+        :param source: name of a scraper output file (str)
+        :return: number of its records already ingested (int)
+        """
+        return self.index["Sources"].get(source, 0)
+
+    def column(self, name: str) -> np.ndarray:
+        """
+        Memory maps a column, read only
+
+        :param name: column name, one of COLUMNS (str)
+        :return: numpy array of the committed rows
+        """
+        dtype = np.dtype(dict(COLUMNS)[name])
+        if self.rows == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(self._column_path(name), dtype=dtype, mode='r',
+                         shape=(self.rows,))
+
+    def keys(self) -> list:
+        """
+        :return: Master_Key of every row (str)
+        """
+        with open(self.keys_path, 'rb') as file:
+            data = file.read(self.index["Keys_Bytes"])
+        return data.decode('utf-8').splitlines()
+
+    def summarize(self, names=None) -> dict:
+        """
+        Mean, max and min of metric columns, computed on the memory
+        mapped arrays
+
+        :param names: list of column names, defaults to the song metrics
+        :return: dict of form {
+            "column name": {
+                "Count": int,
+                "Mean": float,
+                "Max": float,
+                "Min": float
+            }
+        }
+        """
+        if names is None:
+            names = ["Percent_Agreed", "Unique_Word_Count",
+                     "Total_Word_Count", "Repetition_Coeff"]
+        summary = {}
+        for name in names:
+            col = self.column(name)
+            if len(col) == 0:
+                summary[name] = {"Count": 0}
+                continue
+            summary[name] = {
+                "Count": int(len(col)),
+                "Mean": float(col.mean(dtype=np.float64)),
+                "Max": col.max().item(),
+                "Min": col.min().item()
+            }
+        return summary
+
+    def _to_columns(self, records: list) -> dict:
+        """
+        Converts a batch of song dicts to one typed array per column
+
+        :param records: list of song dicts with lyric stats
+        :return: dict of {"column name": numpy array}
+        """
+        charts = []
+        dates = []
+        peaks = []
+        for rec in records:
+            discovered = rec.get("BB_Chart_Discovered", {})
+            name = discovered.get("Chart_Name", "")
+            if name not in self.chart_codes:
+                self.chart_codes[name] = len(self.index["Charts"])
+                self.index["Charts"].append(name)
+            charts.append(self.chart_codes[name])
+            dates.append(discovered.get("Date") or 'NaT')
+            peaks.append(discovered.get("Peak_Position", 0))
+        columns = {
+            "Chart": np.array(charts, dtype="<i2"),
+            "Chart_Date": np.array(dates, dtype="<M8[D]"),
+            "Peak_Position": np.array(peaks, dtype="<i2")
+        }
+        for name, dtype in COLUMNS:
+            if name not in columns:
+                columns[name] = np.array([rec[name] for rec in records],
+                                         dtype=dtype)
+        return columns
+
+    def _column_path(self, name: str) -> str:
+        return os.path.join(self.directory, name + '.col')
+
+    @staticmethod
+    def _append_bytes(path: str, data: bytes):
+        with open(path, 'ab') as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+
+    def _save_index(self):
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(self.index, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.index_path)
+
+    def _truncate(self):
+        """
+        Cuts every file back to the committed rows, dropping whatever
+        a crashed append left behind
+
+        :return: None
+        """
+        sizes = [(self._column_path(name),
+                  self.rows * np.dtype(dtype).itemsize)
+                 for name, dtype in COLUMNS]
+        sizes.append((self.keys_path, self.index["Keys_Bytes"]))
+        for path, size in sizes:
+            with open(path, 'ab') as file:
+                if file.tell() != size:
+                    file.truncate(size)
@@ -1,23 +1,356 @@
 from elasticsearch import Elasticsearch
 import json
+import threading
 import time
 
+from processing import streamstats
+
+
+class BulkWriter:
+
+    def __init__(self, es_client, index: str, doc_type='entry',
+                 batch_size=500, max_bytes=5 * 1024 ** 2, flush_interval=5.0,
+                 on_failure=None, max_retries=3, retry_backoff=1.0):
+        """
+        Buffers documents and writes them with the ES bulk API. A batch
+        is sent once it holds batch_size documents or max_bytes of JSON,
+        and a background thread sends whatever is buffered every
+        flush_interval seconds so nothing sits in memory for long.
+        A bulk request that raises is retried with exponential backoff,
+        and if it still fails the batch goes back in the buffer for the
+        next flush.
+
+        :param es_client: elasticsearch.Elasticsearch client
+        :param index: name of index (str)
+        :param doc_type: mapping type of documents (str)
+        :param batch_size: max documents per bulk request (int)
+        :param max_bytes: max bytes of JSON per bulk request (int)
+        :param flush_interval: seconds between timed flushes (float)
+        :param on_failure: callable(unique_key) run for every document
+            ES rejected, or that could not be sent by close
+        :param max_retries: retries of a bulk request that raised (int)
+        :param retry_backoff: seconds before the first retry, doubled
+            for every further one (float)
+        """
+        self.ES = es_client
+        self.index = index
+        self.doc_type = doc_type
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.on_failure = on_failure
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)  # no batch in flight
+        self.buffer = []
+        self.buffer_bytes = 0
+        self.in_flight = 0          # batches being sent
+        self.unacked = {}           # key: copies not yet accepted or failed
+
+        self.docs_indexed = 0       # documents ES accepted
+        self.docs_failed = 0        # documents ES rejected
+        self.bulk_requests = 0      # bulk requests sent
+        self.bulk_retries = 0       # bulk requests sent again after raising
+        self.docs_requeued = 0      # documents put back after all retries
+        self.bytes_sent = 0         # bytes of bulk bodies sent
+        self.bulk_time = 0.0        # seconds spent in bulk requests
+        self.latency = streamstats.LatencyHistogram()   # of bulk requests
+        self.failures = []          # last few per item failures
+
+        self.stop_event = threading.Event()
+        self.flusher = threading.Thread(target=self._timed_flush, daemon=True)
+        self.flusher.start()
+
+    def add(self, unique_key: str, song_data: dict):
+        """
+        Queues a document, sending the batch if it is full
+
+        :param unique_key: unique key for song (str)
+        :param song_data: song data (dict)
+        :return: None
+        """
+        action = json.dumps({"index": {"_index": self.index,
+                                       "_type": self.doc_type,
+                                       "_id": unique_key}})
+        doc = json.dumps(song_data)
+        size = len(action) + len(doc) + 2
+        with self.lock:
+            self.buffer.append((unique_key, action, doc))
+            self.buffer_bytes += size
+            self.unacked[unique_key] = self.unacked.get(unique_key, 0) + 1
+            full = len(self.buffer) >= self.batch_size or \
+                self.buffer_bytes >= self.max_bytes
+        if full:
+            self._send_buffer()
+
+    def flush(self, requeue=True):
+        """
+        Sends everything buffered in one bulk request, and waits for
+        any batch the timed flush or a full buffer already has in
+        flight, so every document added before the call has been
+        accepted, failed or, if requeue, put back by the time it returns
+
+        :param requeue: boolean option - true to put the batch back in
+            the buffer if the request keeps raising, false to give up
+            on its documents
+        :return: None
+        """
+        self._send_buffer(requeue)
+        with self.idle:
+            while self.in_flight:
+                self.idle.wait()
+
+    def pending(self, unique_keys: list) -> set:
+        """
+        :param unique_keys: list of unique keys for songs (str)
+        :return: set of the keys still buffered or in flight
+        """
+        with self.lock:
+            return {key for key in unique_keys if key in self.unacked}
+
+    def _send_buffer(self, requeue=True):
+        """
+        Sends everything buffered in one bulk request without waiting
+        for other batches
+
+        :param requeue: see flush
+        :return: None
+        """
+        with self.lock:
+            batch = self.buffer
+            self.buffer = []
+            self.buffer_bytes = 0
+            if not batch:
+                return
+            self.in_flight += 1
+        try:
+            self._send_batch(batch, requeue)
+        finally:
+            with self.idle:
+                self.in_flight -= 1
+                self.idle.notify_all()
+
+    def _send_batch(self, batch: list, requeue: bool):
+        body = "".join(action + "\n" + doc + "\n" for _, action, doc in batch)
+        response, elapsed, error = self._send(body)
+        if response is None:
+            if requeue:
+                print("Bulk request failed, requeued", len(batch), "docs:",
+                      error)
+                with self.lock:
+                    self.buffer = batch + self.buffer
+                    self.buffer_bytes += sum(len(action) + len(doc) + 2
+                                             for _, action, doc in batch)
+                    self.docs_requeued += len(batch)
+            else:
+                self._record_failures([(key, str(error))
+                                       for key, _, _ in batch])
+                self._acknowledge(batch)
+            return
+
+        failed = []
+        for key, item in zip([key for key, _, _ in batch],
+                             response["items"]):
+            result = item.get("index", {})
+            if result.get("status", 500) >= 300 or "error" in result:
+                failed.append((key, result.get("error")))
+        with self.lock:
+            self.bulk_requests += 1
+            self.bytes_sent += len(body)
+            self.bulk_time += elapsed
+            self.docs_indexed += len(batch) - len(failed)
+        # Failures first, so a key is always either pending or failed
+        self._record_failures(failed)
+        self._acknowledge(batch)
+
+    def _acknowledge(self, batch: list):
+        """
+        Drops the documents of a batch ES answered for from the
+        unacknowledged keys
+
+        :param batch: list of (unique key, action, doc) tuples
+        :return: None
+        """
+        with self.lock:
+            for key, _, _ in batch:
+                count = self.unacked.get(key, 0) - 1
+                if count > 0:
+                    self.unacked[key] = count
+                else:
+                    self.unacked.pop(key, None)
+
+    def _send(self, body: str) -> tuple:
+        """
+        Sends a bulk request, retrying with backoff while it raises
+
+        :param body: NDJSON bulk body (str)
+        :return: tuple of (response or None, seconds the request took,
+            last error or None)
+        """
+        error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+                with self.lock:
+                    self.bulk_retries += 1
+            start = time.time()
+            try:
+                response = self.ES.bulk(body=body)
+            except Exception as e:
+                error = e
+                continue
+            elapsed = time.time() - start
+            self.latency.add(elapsed)
+            return response, elapsed, None
+        return None, 0.0, error
+
+    def buffered(self) -> int:
+        """
+        :return: number of documents waiting for the next bulk request
+        """
+        with self.lock:
+            return len(self.buffer)
+
+    def close(self):
+        """
+        Stops the timed flushes and sends what is left, documents that
+        still can't be sent are handed to on_failure
+
+        :return: None
+        """
+        self.stop_event.set()
+        self.flusher.join()
+        self.flush(requeue=False)
+
+    def get_usage_report(self) -> dict:
+        """
+        Returns throughput and failure counters
+
+        :return: dict of form {
+            "Bulk_Requests": int,
+            "Bulk_Retries": int,
+            "Docs_Requeued": int,
+            "Docs_Indexed": int,
+            "Docs_Failed": int,
+            "Megabytes_Sent": float,
+            "Docs_Per_Sec": float,
+            "Avg_Bulk_Time_ms": float,
+            "Bulk_Latency": dict (see streamstats.LatencyHistogram),
+            "Recent_Failures": [{"Id": str, "Error": str}]
+        }
+        """
+        with self.lock:
+            return {
+                "Bulk_Requests": self.bulk_requests,
+                "Bulk_Retries": self.bulk_retries,
+                "Docs_Requeued": self.docs_requeued,
+                "Docs_Indexed": self.docs_indexed,
+                "Docs_Failed": self.docs_failed,
+                "Megabytes_Sent": self.bytes_sent / 1024.0 ** 2,
+                "Docs_Per_Sec": self.docs_indexed / self.bulk_time
+                if self.bulk_time else 0.0,
+                "Avg_Bulk_Time_ms": self.bulk_time / self.bulk_requests * 1000.0
+                if self.bulk_requests else 0.0,
+                "Bulk_Latency": self.latency.get_report(),
+                "Recent_Failures": list(self.failures)
+            }
+
+    def clear_usage_stats(self):
+        with self.lock:
+            self.docs_indexed = 0
+            self.docs_failed = 0
+            self.bulk_requests = 0
+            self.bulk_retries = 0
+            self.docs_requeued = 0
+            self.bytes_sent = 0
+            self.bulk_time = 0.0
+            self.failures = []
+        self.latency.clear()
+
+    def _record_failures(self, failed: list):
+        """
+        Counts and prints rejected documents, keeping the last 20
+        for the usage report
+
+        :param failed: list of (unique key, error) tuples
+        :return: None
+        """
+        if not failed:
+            return
+        for key, error in failed:
+            print("Bulk index failed :", key, ":", error)
+            if self.on_failure is not None:
+                self.on_failure(key)
+        with self.lock:
+            self.docs_failed += len(failed)
+            self.failures.extend({"Id": key, "Error": str(error)}
+                                 for key, error in failed)
+            self.failures = self.failures[-20:]
+
+    def _timed_flush(self):
+        while not self.stop_event.wait(self.flush_interval):
+            self._send_buffer()
+
+
 class ElasticSearch:
 
-    def __init__(self, index):
-        self.ES = Elasticsearch(hosts=[{"host":'elasticsearch'}])
+    def __init__(self, index, seen_index=None, warm_seen_index=True,
+                 bulk_config=None, es_client=None, hosts=None,
+                 startup_delay=5):
+        """
+        Connects to elasticsearch and creates the index
+
+        :param index: name of index (str)
+        :param seen_index: seenindex.SeenIndex of songs known to be in
+            the index, every existence check goes to ES if not given
+        :param warm_seen_index: boolean option - true to load every id
+            of the index into seen_index at startup
+        :param bulk_config: dict of bulk writer settings of form
+            {"batch_size": int, "max_megabytes": float,
+            "flush_interval": float, "max_retries": int,
+            "retry_backoff": float}, one index request per song
+            if not given
+        :param es_client: client to use instead of connecting to hosts,
+            e.g. an in-process stand-in (see benchmarks.fakees)
+        :param hosts: list of ES hosts, the docker-compose
+            'elasticsearch' service if not given
+        :param startup_delay: seconds to give ES before the first ping
+            (float)
+        """
+        self.ES = es_client or \
+            Elasticsearch(hosts=hosts or [{"host": 'elasticsearch'}])
         self.index = index
-        time.sleep(5)
+        self.seen_index = seen_index
+        time.sleep(startup_delay)
         while not self.ES.ping():
             print("Trying to connect to ES")
             time.sleep(1)
         print("Successfully connected to ES")
         self.items_posted = 0
         self.song_match_count = 0
+        self.exists_calls = 0       # existence checks sent to ES
+        self.mget_calls = 0         # batched existence checks sent to ES
+        self.local_checks = 0       # existence checks answered locally
+        self.failed_keys = set()    # songs ES didn't take, until put again
+        self.latency = streamstats.LatencyTracker()     # per ES call
         with open('processing/mapping.json', 'r') as file:
             mapping = json.load(file)
         self.ES.indices.create(index=self.index, body=mapping)
         print("Mapping...worked?")
+        if self.seen_index is not None and warm_seen_index:
+            loaded = self.seen_index.warm(self.ES, self.index)
+            print("Loaded", loaded, "known songs from ES")
+        self.bulk_writer = None
+        if bulk_config:
+            self.bulk_writer = BulkWriter(
+                self.ES, self.index,
+                batch_size=bulk_config.get("batch_size", 500),
+                max_bytes=int(bulk_config.get("max_megabytes", 5) * 1024 ** 2),
+                flush_interval=bulk_config.get("flush_interval", 5.0),
+                max_retries=bulk_config.get("max_retries", 3),
+                retry_backoff=bulk_config.get("retry_backoff", 1.0),
+                on_failure=self._forget_song)
 
     def song_in_db(self, unique_key: str) -> bool:
         """
@@ -27,10 +360,58 @@ class ElasticSearch:
         :param unique_key: unique key identifying song
         :return: boolean of whether entry exists
         """
-        found = self.ES.exists(index=self.index,doc_type="entry",
-                               id=unique_key)
+        if self.seen_index is not None:
+            if unique_key in self.seen_index:
+                self.local_checks += 1
+                self.song_match_count += 1
+                return True
+            if self.seen_index.definitely_new(unique_key):
+                self.local_checks += 1
+                return False
+
+        self.exists_calls += 1
+        with self.latency.time("Exists"):
+            found = self.ES.exists(index=self.index,doc_type="entry",
+                                   id=unique_key)
         if found:
             self.song_match_count += 1
+            if self.seen_index is not None:
+                self.seen_index.add(unique_key)
+        return found
+
+    def songs_in_db(self, unique_keys: list) -> set:
+        """
+        Batch version of song_in_db. Keys the seen index can answer
+        are resolved locally, all others in a single mget request
+
+        :param unique_keys: list of unique keys identifying songs (str)
+        :return: set of the keys that are already in db
+        """
+        found = set()
+        remote = []
+        for unique_key in set(unique_keys):
+            if self.seen_index is not None:
+                if unique_key in self.seen_index:
+                    self.local_checks += 1
+                    found.add(unique_key)
+                    continue
+                if self.seen_index.definitely_new(unique_key):
+                    self.local_checks += 1
+                    continue
+            remote.append(unique_key)
+
+        if remote:
+            self.mget_calls += 1
+            with self.latency.time("Mget"):
+                response = self.ES.mget(index=self.index, doc_type="entry",
+                                        body={"ids": remote}, _source=False)
+            for doc in response["docs"]:
+                if doc.get("found"):
+                    found.add(doc["_id"])
+                    if self.seen_index is not None:
+                        self.seen_index.add(doc["_id"])
+
+        self.song_match_count += len(found)
         return found
 
     def put_new_data(self, song_data: dict, unique_key: str):
@@ -41,13 +422,23 @@ class ElasticSearch:
         :param unique_key: unique key for song (str)
         :return: none
         """
+        self.failed_keys.discard(unique_key)
+        if self.bulk_writer is not None:
+            if self.seen_index is not None:
+                self.seen_index.add(unique_key)
+            self.bulk_writer.add(unique_key, song_data)
+            return
         try:
-            self.ES.index(index=self.index,
-                          doc_type='entry',
-                          id=unique_key, body=song_data)
+            with self.latency.time("Index"):
+                self.ES.index(index=self.index,
+                              doc_type='entry',
+                              id=unique_key, body=song_data)
             self.items_posted += 1
+            if self.seen_index is not None:
+                self.seen_index.add(unique_key)
         except Exception as e:
             print(e, '\n', song_data)
+            self._forget_song(unique_key)
 
     def log_usage(self, usage_data, ts, records):
         """
@@ -59,8 +450,9 @@ class ElasticSearch:
         :return:
         """
         unique_key = str(ts) + ':' + str(records)
-        self.ES.index(index="usage_data", doc_type='entry',
-                      id=unique_key, body=usage_data)
+        with self.latency.time("Log_Usage"):
+            self.ES.index(index="usage_data", doc_type='entry',
+                          id=unique_key, body=usage_data)
 
     def get_usage_report(self) -> dict:
         """
@@ -69,18 +461,97 @@ class ElasticSearch:
         :return: dict of form {
             "ES_Usage_Report": {
                 "Total_Posts": int,
-                "Song_Already_Found": int
+                "Song_Already_Found": int,
+                "Exists_Calls": int,
+                "Mget_Calls": int,
+                "Local_Existence_Checks": int,
+                "Latency": {
+                    "Exists": dict (see streamstats.LatencyHistogram),
+                    "Mget": dict,
+                    "Index": dict,
+                    "Log_Usage": dict
+                },
+                "Bulk": dict (see BulkWriter.get_usage_report)
             }
         }
         """
         usage = {
             "ES_Usage_Report": {
                 "Total_Posts": self.items_posted,
-                "Song_Already_Found": self.song_match_count
+                "Song_Already_Found": self.song_match_count,
+                "Exists_Calls": self.exists_calls,
+                "Mget_Calls": self.mget_calls,
+                "Local_Existence_Checks": self.local_checks,
+                "Latency": self.latency.get_report()
             }
         }
+        if self.bulk_writer is not None:
+            bulk = self.bulk_writer.get_usage_report()
+            usage["ES_Usage_Report"]["Total_Posts"] = bulk["Docs_Indexed"]
+            usage["ES_Usage_Report"]["Bulk"] = bulk
         return usage
 
     def clear_usage_stats(self):
         self.items_posted = 0
         self.song_match_count = 0
+        self.exists_calls = 0
+        self.mget_calls = 0
+        self.local_checks = 0
+        self.latency.clear_usage_stats()
+        if self.bulk_writer is not None:
+            self.bulk_writer.clear_usage_stats()
+
+    def flush(self):
+        """
+        Sends any songs still buffered by the bulk writer and waits
+        for bulk requests already in flight
+
+        :return: None
+        """
+        if self.bulk_writer is not None:
+            self.bulk_writer.flush()
+
+    def unwritten(self, unique_keys: list) -> tuple:
+        """
+        Checks which songs put so far aren't safely in ES yet
+
+        :param unique_keys: list of unique keys for songs (str)
+        :return: tuple of (set of keys still waiting in the bulk
+            writer, set of keys ES didn't take)
+        """
+        pending = set()
+        if self.bulk_writer is not None:
+            pending = self.bulk_writer.pending(unique_keys)
+        return pending, {key for key in unique_keys
+                         if key in self.failed_keys}
+
+    def close(self):
+        """
+        Flushes and stops the bulk writer
+
+        :return: None
+        """
+        if self.bulk_writer is not None:
+            self.bulk_writer.close()
+
+    def _forget_song(self, unique_key: str):
+        """
+        Drops a song ES rejected from the seen index, so it
+        is scraped and written again next time it charts, and
+        keeps its unit from being marked done
+
+        :param unique_key: unique key for song (str)
+        :return: None
+        """
+        self.failed_keys.add(unique_key)
+        if self.seen_index is not None:
+            self.seen_index.discard(unique_key)
+
+    def save_seen_index(self):
+        """
+        Persists the seen song index so the next run starts warm
+
+        :return: None
+        """
+        if self.seen_index is not None:
+            self.seen_index.save()
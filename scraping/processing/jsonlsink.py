@@ -0,0 +1,263 @@
+import gzip
+import io
+import json
+import os
+import queue
+import threading
+import time
+import traceback
+
+
+def read_records(path: str, skip=0):
+    """
+    Reads the records of a file written by JsonlSink, plain or
+    compressed. A compressed file cut short by a crash is read
+    up to its last complete line
+
+    :param path: file path (str)
+    :param skip: number of records to skip from the start (int)
+    :return: generator of record dicts
+    """
+    if path.endswith('.gz'):
+        file = gzip.open(path, 'rb')
+    elif path.endswith('.zst'):
+        import zstandard
+        file = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'),
+                                                          closefd=True)
+        file = io.BufferedReader(file)
+    else:
+        file = open(path, 'rb')
+    with file:
+        try:
+            for i, line in enumerate(file):
+                if i < skip:
+                    continue
+                if not line.endswith(b'\n'):
+                    return
+                yield json.loads(line.decode('utf-8'))
+        except EOFError:
+            return
+
+
+class _FlushRequest:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.error = None       # first write error since the last flush
+
+
+class JsonlSink:
+
+    def __init__(self, directory='sample_results', prefix='songs',
+                 max_megabytes=256, compression=None, fsync_interval=1.0,
+                 queue_size=10000):
+        """
+        Streams records to rotating JSONL files, one compact JSON object
+        per line. Records are queued and written by a background thread,
+        so callers never block on disk, and files are fsynced in
+        batches, at most once per fsync_interval, instead of per record.
+        Files are named {prefix}-{timestamp}-{pid}-{seq}.jsonl[.gz|.zst]
+        so several processes can share one directory.
+
+        :param directory: output directory (str)
+        :param prefix: file name prefix (str)
+        :param max_megabytes: uncompressed size after which a new file
+            is started (float)
+        :param compression: None, "gzip" or "zstd" (needs the
+            zstandard package)
+        :param fsync_interval: max seconds written records can wait for
+            an fsync (float)
+        :param queue_size: max records waiting for the writer (int)
+        """
+        if compression not in (None, "gzip", "zstd"):
+            raise ValueError("Unknown compression: " + str(compression))
+        self.directory = directory
+        self.prefix = prefix
+        self.max_bytes = int(max_megabytes * 1024 ** 2)
+        self.compression = compression
+        self.fsync_interval = fsync_interval
+        os.makedirs(directory, exist_ok=True)
+
+        self.raw_file = None        # file on disk
+        self.file = None            # raw_file or its compressing wrapper
+        self.file_bytes = 0
+        self.file_seq = 0
+        self.last_fsync = time.time()
+        self.unsynced = False
+        self.error = None           # first write error since the last flush
+
+        self.records_written = 0
+        self.bytes_written = 0
+        self.files_opened = 0
+        self.fsyncs = 0
+        self.write_errors = 0
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+
+    def write(self, record: dict):
+        """
+        Queues a record, blocks only if the queue is full
+
+        :param record: JSON serializable dict
+        :return: None
+        """
+        self.queue.put(record)
+
+    def flush(self):
+        """
+        Blocks until every record queued so far is written and fsynced
+
+        :return: None
+        :raises IOError: if a record queued since the last flush couldn't
+            be written or synced, so it may not be on disk
+        """
+        request = _FlushRequest()
+        self.queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise IOError("JSONL sink write failed") from request.error
+
+    def close(self):
+        """
+        Writes everything still queued and closes the current file
+
+        :return: None
+        :raises IOError: if a record queued since the last flush couldn't
+            be written or synced
+        """
+        self.queue.put(None)
+        self.writer.join()
+        if self.error is not None:
+            raise IOError("JSONL sink write failed") from self.error
+
+    def get_usage_report(self) -> dict:
+        """
+        Returns writer activity since the last clear
+
+        :return: dict of form {
+            "JSONL_Sink_Report": {
+                "Records_Written": int,
+                "Bytes_Written": int,
+                "Files_Opened": int,
+                "Fsyncs": int,
+                "Write_Errors": int,
+                "Queue_Depth": int
+            }
+        }
+        """
+        return {
+            "JSONL_Sink_Report": {
+                "Records_Written": self.records_written,
+                "Bytes_Written": self.bytes_written,
+                "Files_Opened": self.files_opened,
+                "Fsyncs": self.fsyncs,
+                "Write_Errors": self.write_errors,
+                "Queue_Depth": self.queue.qsize()
+            }
+        }
+
+    def clear_usage_stats(self):
+        self.records_written = 0
+        self.bytes_written = 0
+        self.files_opened = 0
+        self.fsyncs = 0
+        self.write_errors = 0
+
+    def _write_loop(self):
+        """
+        Writer thread, drains the queue until it gets None. A record
+        that can't be written is dropped and the error is handed to the
+        next flush, so callers don't take it as stored
+
+        :return: None
+        """
+        while True:
+            try:
+                item = self.queue.get(timeout=self.fsync_interval)
+            except queue.Empty:
+                item = False
+            try:
+                if item is None:
+                    self._close_file()
+                    return
+                elif isinstance(item, _FlushRequest):
+                    self._fsync()
+                    self._answer(item)
+                elif item is not False:
+                    self._write_record(item)
+                if self.unsynced and \
+                        time.time() - self.last_fsync >= self.fsync_interval:
+                    self._fsync()
+            except Exception as e:
+                traceback.print_exc()
+                self.write_errors += 1
+                if self.error is None:
+                    self.error = e
+                if item is None:
+                    return
+                if isinstance(item, _FlushRequest):
+                    self._answer(item)
+
+    def _answer(self, request: _FlushRequest):
+        request.error, self.error = self.error, None
+        request.done.set()
+
+    def _write_record(self, record: dict):
+        line = (json.dumps(record, separators=(',', ':')) + '\n').encode('utf-8')
+        if self.file is None or self.file_bytes + len(line) > self.max_bytes:
+            self._close_file()
+            self._open_file()
+        self.file.write(line)
+        self.file_bytes += len(line)
+        self.records_written += 1
+        self.bytes_written += len(line)
+        self.unsynced = True
+
+    def _open_file(self):
+        self.file_seq += 1
+        name = '{}-{}-{}-{:05d}.jsonl'.format(
+            self.prefix, time.strftime('%Y%m%d-%H%M%S'), os.getpid(),
+            self.file_seq)
+        if self.compression == "gzip":
+            name += '.gz'
+        elif self.compression == "zstd":
+            name += '.zst'
+        self.raw_file = open(os.path.join(self.directory, name), 'wb')
+        if self.compression == "gzip":
+            self.file = gzip.GzipFile(fileobj=self.raw_file, mode='wb')
+        elif self.compression == "zstd":
+            import zstandard
+            self.file = zstandard.ZstdCompressor().stream_writer(self.raw_file)
+        else:
+            self.file = self.raw_file
+        self.file_bytes = 0
+        self.files_opened += 1
+
+    def _fsync(self):
+        """
+        Pushes everything written so far through the compressor and
+        onto disk. Compressed files stay readable up to this point
+        even if the process dies before the file is closed
+
+        :return: None
+        """
+        if self.file is None or not self.unsynced:
+            return
+        self.file.flush()
+        self.raw_file.flush()
+        os.fsync(self.raw_file.fileno())
+        self.last_fsync = time.time()
+        self.unsynced = False
+        self.fsyncs += 1
+
+    def _close_file(self):
+        if self.file is None:
+            return
+        self._fsync()
+        if self.file is not self.raw_file:
+            self.file.close()
+        self.raw_file.close()
+        self.file = None
+        self.raw_file = None
@@ -0,0 +1,150 @@
+import os
+import sys
+import threading
+import time
+
+
+class NltkResources:
+
+    def __init__(self, data_dirs=None, allow_download=False, resources=None):
+        """
+        Local NLTK data and lazily loaded NLTK models. Startup only
+        checks that the data is on disk, without importing nltk. nltk,
+        the stemmer and the POS tagger are loaded the first time a word
+        needs them, so a worker starts in milliseconds and never
+        touches the network unless allow_download is set.
+
+        :param data_dirs: list of pre-baked nltk_data directories (str),
+            searched before NLTK's default locations
+        :param allow_download: boolean option - true to download data
+            missing from every data dir
+        :param resources: dict of {"package name": "resource path"} that
+            have to be available, e.g. {"averaged_perceptron_tagger":
+            "taggers/averaged_perceptron_tagger"}
+        """
+        start = time.time()
+        self.data_dirs = data_dirs or []
+        self.allow_download = allow_download
+        if resources is None:
+            resources = {
+                "averaged_perceptron_tagger":
+                    "taggers/averaged_perceptron_tagger"
+            }
+        self.resources = resources
+
+        self.lock = threading.Lock()
+        self.stemmer = None
+        self.tagger = None
+        self.downloads = 0
+        self.stemmer_load_time = 0.0
+        self.tagger_load_time = 0.0
+
+        self.missing = self._find_missing()
+        if self.missing and self.allow_download:
+            nltk = self._import_nltk()
+            for package in self.missing:
+                nltk.download(package, download_dir=self.data_dirs[0]
+                              if self.data_dirs else None)
+                self.downloads += 1
+            self.missing = self._find_missing()
+        if self.missing:
+            print({"Missing NLTK Data": self.missing})
+        self.check_time = time.time() - start
+
+    def stem(self, word: str) -> str:
+        """
+        Porter stems a word
+
+        :param word: word (str)
+        :return: stemmed word (str)
+        """
+        if self.stemmer is None:
+            self._load_stemmer()
+        return self.stemmer.stem(word)
+
+    def tag_words(self, words: list) -> list:
+        """
+        POS tags every word on its own, the same as calling
+        nltk.pos_tag([word]) per word, but with one tagger
+        loaded once for the life of the process
+
+        :param words: list of words (str)
+        :return: list of POS tags (str)
+        """
+        if self.tagger is None:
+            self._load_tagger()
+        return [self.tagger.tag([word])[0][1] for word in words]
+
+    def get_usage_report(self) -> dict:
+        """
+        Returns startup and model load times
+
+        :return: dict of form {
+            "Data_Check_Time_ms": float,
+            "Stemmer_Load_Time_ms": float,
+            "Tagger_Load_Time_ms": float,
+            "Downloads": int,
+            "Missing": list of package names (str)
+        }
+        """
+        return {
+            "Data_Check_Time_ms": self.check_time * 1000.0,
+            "Stemmer_Load_Time_ms": self.stemmer_load_time * 1000.0,
+            "Tagger_Load_Time_ms": self.tagger_load_time * 1000.0,
+            "Downloads": self.downloads,
+            "Missing": self.missing
+        }
+
+    def _load_stemmer(self):
+        with self.lock:
+            if self.stemmer is None:
+                start = time.time()
+                self._import_nltk()
+                from nltk.stem import PorterStemmer
+                self.stemmer = PorterStemmer()
+                self.stemmer_load_time = time.time() - start
+
+    def _load_tagger(self):
+        with self.lock:
+            if self.tagger is None:
+                start = time.time()
+                self._import_nltk()
+                from nltk.tag.perceptron import PerceptronTagger
+                self.tagger = PerceptronTagger()
+                self.tagger_load_time = time.time() - start
+
+    def _import_nltk(self):
+        """
+        Imports nltk and puts the data dirs at the front of its path
+
+        :return: nltk module
+        """
+        import nltk
+        for path in reversed(self.data_dirs):
+            if path not in nltk.data.path:
+                nltk.data.path.insert(0, path)
+        return nltk
+
+    def _find_missing(self) -> list:
+        """
+        Checks every resource against the data dirs and the places
+        nltk.data looks by default, as a directory or a zip
+
+        :return: list of package names not found (str)
+        """
+        search = list(self.data_dirs)
+        search += [path for path in
+                   os.environ.get('NLTK_DATA', '').split(os.pathsep) if path]
+        search += [os.path.expanduser('~/nltk_data'),
+                   os.path.join(sys.prefix, 'nltk_data'),
+                   os.path.join(sys.prefix, 'share', 'nltk_data'),
+                   os.path.join(sys.prefix, 'lib', 'nltk_data'),
+                   '/usr/share/nltk_data', '/usr/local/share/nltk_data',
+                   '/usr/lib/nltk_data', '/usr/local/lib/nltk_data']
+        missing = []
+        for package, path in self.resources.items():
+            if not any(os.path.exists(os.path.join(root, path)) or
+                       os.path.exists(os.path.join(root, path + '.zip'))
+                       for root in search):
+                missing.append(package)
+        return missing
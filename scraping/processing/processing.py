@@ -1,11 +1,27 @@
 import json
 import time
-from nltk.stem import PorterStemmer
-import nltk
+from processing import nltkdata
+from processing import streamstats
 
 class LyricAnalyst:
 
-    def __init__(self):
+    def __init__(self, stem_cache=None, pos_cache=None, union_engine=None,
+                 resources=None):
+        """
+        Initialize LyricAnalyst Object
+
+        :param stem_cache: wordcache.WordCache of resources.stem,
+            every word is stemmed if not given
+        :param pos_cache: wordcache.WordCache of word -> POS tag, with
+            resources.tag_words as its batch_func, every word is tagged
+            if not given
+        :param union_engine: object with a shared_bow method of the same
+            signature as self._shared_bow, e.g. bowmatrix.MatrixUnion,
+            used instead of the dict union if given
+        :param resources: nltkdata.NltkResources the stemmer and tagger
+            are loaded from, NLTK's default data locations if not given
+        """
+        start = time.time()
 
         # Aggregator Values:
         self.perc_agreed_sum = 0.0
@@ -14,11 +30,15 @@ class LyricAnalyst:
         self.repetition_count_sum = 0.0
         self.records_processed = 0
         self.elapsed_time_sum = 0.0
+        self.latency = streamstats.LatencyTracker()     # Analysis, Stem, Union
+        self.last_stage_times = {}  # Stem and Union seconds of the last song
 
-        nltk.download('punkt')
-        nltk.download('averaged_perceptron_tagger')
-        self.ps = PorterStemmer()   # Word Stemmer
+        self.resources = resources or nltkdata.NltkResources()
+        self.stem_cache = stem_cache
+        self.pos_cache = pos_cache
+        self.union_engine = union_engine
         self.union_dict = {}        # Dict for lyric BoW Unions
+        self.startup_time = time.time() - start
 
     def get_lyric_stats(self, lyrics_list: list) -> dict:
         """
@@ -37,17 +57,36 @@ class LyricAnalyst:
                 else:
                     bow_list.append({key: self._bag_of_words_stemmed(val)})
                     source_count += 1
+        stemmed = time.time()
         if len(bow_list) == 0:
             return {}
         elif len(bow_list) == 1:
             stats = self._BoW_union_stats_single(bow_list[0], source_count)
         else:
             stats = self._BoW_union_stats_multiple(bow_list, source_count)
-        self._increment_aggr_values(stats)
-
-        self.elapsed_time_sum += (time.time() - start)
+        end = time.time()
+        self.last_stage_times = {"Stem": stemmed - start, "Union": end - stemmed}
+        self.record_stats(stats, end - start, self.last_stage_times)
         return stats
 
+    def record_stats(self, stats: dict, elapsed: float, stage_times=None):
+        """
+        Adds the stats of one analysed song to the aggregator values,
+        also used for songs analysed in another process
+
+        :param stats: dict of stats from get_lyric_stats
+        :param elapsed: seconds the analysis took (float)
+        :param stage_times: dict of {"stage": seconds} of the analysis,
+            e.g. last_stage_times of the analyst that ran it
+        :return: None
+        """
+        if stats:
+            self._increment_aggr_values(stats)
+            self.latency.add("Analysis", elapsed)
+            for stage, seconds in (stage_times or {}).items():
+                self.latency.add(stage, seconds)
+        self.elapsed_time_sum += elapsed
+
     def get_usage_report(self):
         """
         Returns usage statistics of the processing module
@@ -59,7 +98,21 @@ class LyricAnalyst:
                 "Avg_Unique_Word_Count": float,
                 "Avg_Total_Word_Count": float,
                 "Avg_Repetitions_Count": float,
-                "Avg_Analysis_Time_ms": float
+                "Avg_Analysis_Time_ms": float,
+                "Latency": {
+                    "Analysis": dict (see streamstats.LatencyHistogram),
+                    "Stem": dict,
+                    "Union": dict
+                },
+                "Stem_Cache": {
+                    "Hits": int,
+                    "Misses": int,
+                    "Hit_Rate": float,
+                    "Size": int
+                },
+                "POS_Cache": dict of same form as Stem_Cache,
+                "Startup_Time_ms": float,
+                "NLTK_Resources": dict (see nltkdata.NltkResources)
             }
         }
         """
@@ -73,7 +126,14 @@ class LyricAnalyst:
                 "Avg_Unique_Word_Count": self.unique_word_count_sum / count,
                 "Avg_Total_Word_Count": self.total_word_count_sum / count,
                 "Avg_Repetitions_Count": self.repetition_count_sum / count,
-                "Avg_Analysis_Time_ms": self.elapsed_time_sum / count * 1000.0
+                "Avg_Analysis_Time_ms": self.elapsed_time_sum / count * 1000.0,
+                "Latency": self.latency.get_report(),
+                "Stem_Cache": self.stem_cache.get_usage_report()
+                if self.stem_cache is not None else {},
+                "POS_Cache": self.pos_cache.get_usage_report()
+                if self.pos_cache is not None else {},
+                "Startup_Time_ms": self.startup_time * 1000.0,
+                "NLTK_Resources": self.resources.get_usage_report()
             }
         }
         return usage
@@ -85,25 +145,72 @@ class LyricAnalyst:
         self.repetition_count_sum = 0.0
         self.records_processed = 0
         self.elapsed_time_sum = 0.0
+        self.latency.clear_usage_stats()
+        if self.stem_cache is not None:
+            self.stem_cache.clear_usage_stats()
+        if self.pos_cache is not None:
+            self.pos_cache.clear_usage_stats()
+
+    def save_lexicons(self):
+        """
+        Persists the stem and POS caches, if there are any
+
+        :return: None
+        """
+        if self.stem_cache is not None:
+            self.stem_cache.save()
+        if self.pos_cache is not None:
+            self.pos_cache.save()
 
     def _bag_of_words_stemmed(self, lyrics: str) -> dict:
         """
         Takes a string of words, stems each words
         and creates a word bag of the word count.
+        Words are counted first so each distinct word
+        is only stemmed once per lyric.
 
         :param lyrics: string of flattened lyrics
         :return: bag of words as dict
         """
+        word_counts = {}
+        for word in lyrics.split():
+            if word in word_counts:
+                word_counts[word] += 1
+            else:
+                word_counts[word] = 1
+
         ret_dict = {}
-        lyric_list = lyrics.split()
-        for word in lyric_list:
-            stemmed_word = self.ps.stem(word)
-            if stemmed_word in ret_dict.keys():
-                ret_dict[stemmed_word] += 1
+        for word, count in word_counts.items():
+            stemmed_word = self._stem(word)
+            if stemmed_word in ret_dict:
+                ret_dict[stemmed_word] += count
             else:
-                ret_dict[stemmed_word] = 1
+                ret_dict[stemmed_word] = count
         return ret_dict
 
+    def _stem(self, word: str) -> str:
+        """
+        Stems a word, through the stem cache if there is one
+
+        :param word: word (str)
+        :return: stemmed word (str)
+        """
+        if self.stem_cache is None:
+            return self.resources.stem(word)
+        return self.stem_cache.get(word)
+
+    def _pos_tags(self, words: list) -> dict:
+        """
+        POS tags a song's whole vocabulary at once, words already in
+        the POS cache are only looked up
+
+        :param words: list of words (str)
+        :return: dict of {"word": POS tag}
+        """
+        if self.pos_cache is None:
+            return dict(zip(words, self.resources.tag_words(words)))
+        return self.pos_cache.get_many(words)
+
     def _BoW_union_stats_multiple(self, list_of_bows: list,
                                   source_count: int) -> dict:
         """
@@ -124,6 +231,44 @@ class LyricAnalyst:
             }
         }
         """
+        if self.union_engine is None:
+            same_BoW, same_word_count, dif_word_count = \
+                self._shared_bow(list_of_bows)
+        else:
+            same_BoW, same_word_count, dif_word_count = \
+                self.union_engine.shared_bow(list_of_bows)
+
+        tags = self._pos_tags(list(same_BoW.keys()))
+        r = []
+        for key, val in same_BoW.items():
+            r.append({
+                "Word": key,
+                "Count": val,
+                "POS_Type": tags[key]
+            })
+
+        perc_agreed = same_word_count / (same_word_count + dif_word_count)
+        return {
+            "Percent_Agreed": perc_agreed,
+            "Unique_Word_Count": len(same_BoW.keys()),
+            "Total_Word_Count": sum([val for val in same_BoW.values()]),
+            "Repetition_Coeff":
+                len(same_BoW.keys()) /
+                sum([val for val in same_BoW.values()]),
+            "Lyric_Sources": source_count,
+            "BoW_Shared": r
+        }
+
+    def _shared_bow(self, list_of_bows: list) -> tuple:
+        """
+        Takes a list of BoW dictionaries and reduces the output of
+        self._BoW_union_raw to the words every source that has them
+        agrees on, at the lowest count any source gives them
+
+        :param list_of_bows: list of BoW dicts
+        :return: tuple of (shared BoW as dict of {"word": count},
+            same word count (int), different word count (int))
+        """
         raw_union = self._BoW_union_raw(list_of_bows)
         same_BoW = {}
         same_word_count = 0
@@ -147,26 +292,7 @@ class LyricAnalyst:
         for key, val in raw_union["Unique"].items():
             dif_word_count += raw_union["Unique"][key]["Count"]
 
-
-        r = []
-        for key, val in same_BoW.items():
-            r.append({
-                "Word": key,
-                "Count": val,
-                "POS_Type": nltk.pos_tag([key])[0][1]
-            })
-
-        perc_agreed = same_word_count / (same_word_count + dif_word_count)
-        return {
-            "Percent_Agreed": perc_agreed,
-            "Unique_Word_Count": len(same_BoW.keys()),
-            "Total_Word_Count": sum([val for val in same_BoW.values()]),
-            "Repetition_Coeff":
-                len(same_BoW.keys()) /
-                sum([val for val in same_BoW.values()]),
-            "Lyric_Sources": source_count,
-            "BoW_Shared": r
-        }
+        return same_BoW, same_word_count, dif_word_count
 
     def _BoW_union_stats_single(self, bow_raw: dict,
                                 source_count: int) -> dict:
@@ -187,12 +313,13 @@ class LyricAnalyst:
         }
         """
         bow = bow_raw[list(bow_raw.keys())[0]]
+        tags = self._pos_tags(list(bow.keys()))
         r = []
         for key,val in bow.items():
             r.append({
                 "Word": key,
                 "Count": val,
-                "POS_Type": nltk.pos_tag([key])[0][1]
+                "POS_Type": tags[key]
             })
         return {
             "Percent_Agreed": 1,
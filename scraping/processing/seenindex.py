@@ -0,0 +1,216 @@
+import hashlib
+import math
+import os
+import struct
+import threading
+
+from elasticsearch import helpers
+
+
+class BloomFilter:
+
+    HEADER = struct.Struct('<QQQ')     # bit count, hash count, items added
+
+    def __init__(self, capacity=5000000, error_rate=0.001):
+        """
+        Fixed size Bloom filter over strings
+
+        :param capacity: expected number of items (int)
+        :param error_rate: false positive rate at capacity (float)
+        """
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) /
+                                   math.log(2) ** 2))
+        self.num_hashes = max(1, int(round(self.num_bits / capacity *
+                                           math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def add(self, item: str):
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        for pos in self._positions(item):
+            if not self.bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def save(self, path: str):
+        """
+        Writes the filter to disk, atomically replacing any old copy
+
+        :param path: file path (str)
+        :return: None
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as file:
+            file.write(self.HEADER.pack(self.num_bits, self.num_hashes,
+                                        self.count))
+            file.write(self.bits)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str):
+        """
+        Reads a filter written by save
+
+        :param path: file path (str)
+        :return: BloomFilter
+        """
+        bloom = cls.__new__(cls)
+        with open(path, 'rb') as file:
+            bloom.num_bits, bloom.num_hashes, bloom.count = \
+                cls.HEADER.unpack(file.read(cls.HEADER.size))
+            bloom.bits = bytearray(file.read())
+        return bloom
+
+    def _positions(self, item: str):
+        """
+        Double hashing, k bit positions out of one 128 bit digest
+
+        :param item: item to hash (str)
+        :return: generator of bit positions (int)
+        """
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1, h2 = struct.unpack('<QQ', digest)
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+
+class SeenIndex:
+
+    def __init__(self, bloom_path=None, bloom_capacity=5000000,
+                 bloom_error_rate=0.001, single_writer=True):
+        """
+        In-process index of song master keys already in elasticsearch,
+        so most existence checks never leave the process.
+
+        Keys are kept in a hash set. Once the set has been warmed with
+        every id in the index it is authoritative: a key that isn't in
+        it is new. Without warming, an optional Bloom filter persisted
+        at bloom_path answers "definitely new" for keys it has never
+        seen, and only possible repeats need to ask elasticsearch. The
+        filter is only loaded once a check or an add happens unwarmed,
+        a warmed index never builds it and deletes the saved copy,
+        which stops following the index from then on.
+
+        Both only hold while this process is the only one writing to
+        the index. Songs another worker stores after the warm-up are
+        missing from the set and the filter, so with several writers
+        (e.g. lease table workers) single_writer has to be false: keys
+        in the set still count as stored, every other key is checked
+        against elasticsearch.
+
+        :param bloom_path: file to persist the Bloom filter to (str),
+            no Bloom filter if not given, not single_writer or warmed
+        :param bloom_capacity: expected number of songs (int)
+        :param bloom_error_rate: Bloom filter false positive rate (float)
+        :param single_writer: boolean option - false if other processes
+            write to the index too
+        """
+        self.keys = set()
+        self.warmed = False
+        self.single_writer = single_writer
+        self.lock = threading.Lock()
+        self.bloom_path = bloom_path
+        self.bloom_capacity = bloom_capacity
+        self.bloom_error_rate = bloom_error_rate
+        self.bloom = None
+
+    def warm(self, es_client, index: str) -> int:
+        """
+        Loads every document id of the index into the set
+
+        :param es_client: elasticsearch.Elasticsearch client
+        :param index: name of index (str)
+        :return: number of ids loaded (int)
+        """
+        loaded = 0
+        for hit in helpers.scan(es_client, index=index,
+                                query={"query": {"match_all": {}}},
+                                _source=False):
+            with self.lock:
+                self.keys.add(hit["_id"])
+            loaded += 1
+        with self.lock:
+            self.warmed = True
+            self.bloom = None
+        if self.bloom_path is not None and os.path.exists(self.bloom_path):
+            os.remove(self.bloom_path)
+        return loaded
+
+    def add(self, key: str):
+        """
+        Records that a song is in elasticsearch
+
+        :param key: unique key identifying song (str)
+        :return: None
+        """
+        with self.lock:
+            self.keys.add(key)
+            bloom = self._bloom_filter()
+            if bloom is not None:
+                bloom.add(key)
+
+    def discard(self, key: str):
+        """
+        Forgets a key, e.g. when writing it to elasticsearch failed.
+        The Bloom filter can't forget, so it's only dropped from the set
+
+        :param key: unique key identifying song (str)
+        :return: None
+        """
+        with self.lock:
+            self.keys.discard(key)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.keys
+
+    def definitely_new(self, key: str) -> bool:
+        """
+        Checks if a key that isn't in the set can be trusted to be
+        new without asking elasticsearch
+
+        :param key: unique key identifying song (str)
+        :return: boolean, always false without a single writer
+        """
+        if not self.single_writer:
+            return False
+        if self.warmed:
+            return key not in self.keys
+        with self.lock:
+            bloom = self._bloom_filter()
+            return bloom is not None and key not in bloom
+
+    def save(self):
+        """
+        Persists the Bloom filter, if there is one
+
+        :return: None
+        """
+        if self.bloom is not None:
+            with self.lock:
+                self.bloom.save(self.bloom_path)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _bloom_filter(self):
+        """
+        Loads or makes the Bloom filter the first time it's needed,
+        caller holds the lock
+
+        :return: BloomFilter or None if there's none to use
+        """
+        if self.bloom is None and self.bloom_path is not None and \
+                self.single_writer and not self.warmed:
+            if os.path.exists(self.bloom_path):
+                self.bloom = BloomFilter.load(self.bloom_path)
+            else:
+                self.bloom = BloomFilter(self.bloom_capacity,
+                                         self.bloom_error_rate)
+        return self.bloom
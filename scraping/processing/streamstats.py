@@ -0,0 +1,410 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+
+class TDigest:
+
+    def __init__(self, compression=100):
+        """
+        Merging t-digest, approximate quantiles of a stream in bounded
+        memory. Values are buffered and folded into at most about
+        compression weighted centroids, kept small near the tails so
+        extreme percentiles stay accurate. Digests built from different
+        parts of a stream can be merged.
+
+        :param compression: size parameter, more centroids and better
+            accuracy as it grows (int)
+        """
+        self.compression = compression
+        self.centroids = []     # list of [mean, weight], sorted by mean
+        self.buffer = []        # list of [value, weight] not yet folded in
+        self.count = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value: float, weight=1):
+        self.buffer.append([value, weight])
+        self.count += weight
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        if len(self.buffer) >= 10 * self.compression:
+            self._compress()
+
+    def merge(self, other):
+        """
+        Folds another digest into this one
+
+        :param other: TDigest
+        :return: None
+        """
+        if other.count == 0:
+            return
+        other._compress()
+        self.buffer.extend([mean, weight] for mean, weight in other.centroids)
+        self.count += other.count
+        if self.min is None or other.min < self.min:
+            self.min = other.min
+        if self.max is None or other.max > self.max:
+            self.max = other.max
+        self._compress()
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimates a quantile, interpolating between centroid centers
+
+        :param q: quantile between 0 and 1 (float)
+        :return: estimated value (float), None if nothing was added
+        """
+        self._compress()
+        if not self.centroids:
+            return None
+        if len(self.centroids) == 1 or q <= 0:
+            return self.min if q <= 0 else self.centroids[0][0]
+        if q >= 1:
+            return self.max
+        target = q * self.count
+        cumulative = 0.0
+        prev_center = 0.0
+        prev_mean = self.min
+        for mean, weight in self.centroids:
+            center = cumulative + weight / 2.0
+            if target < center:
+                if center == prev_center:
+                    return mean
+                frac = (target - prev_center) / (center - prev_center)
+                return prev_mean + frac * (mean - prev_mean)
+            cumulative += weight
+            prev_center = center
+            prev_mean = mean
+        if self.count == prev_center:
+            return self.max
+        frac = (target - prev_center) / (self.count - prev_center)
+        return prev_mean + frac * (self.max - prev_mean)
+
+    def _compress(self):
+        """
+        Folds the buffer into the centroids. Neighbouring values are
+        merged while the centroid stays within the weight the k1 scale
+        function allows at its position
+
+        :return: None
+        """
+        if not self.buffer:
+            return
+        items = sorted(self.centroids + self.buffer, key=lambda c: c[0])
+        self.buffer = []
+        total = float(sum(weight for _, weight in items))
+        merged = []
+        current_mean, current_weight = items[0]
+        weight_so_far = 0.0
+        limit = self._weight_limit(weight_so_far, total)
+        for mean, weight in items[1:]:
+            if weight_so_far + current_weight + weight <= limit:
+                current_weight += weight
+                current_mean += (mean - current_mean) * weight / current_weight
+            else:
+                merged.append([current_mean, current_weight])
+                weight_so_far += current_weight
+                limit = self._weight_limit(weight_so_far, total)
+                current_mean, current_weight = mean, weight
+        merged.append([current_mean, current_weight])
+        self.centroids = merged
+
+    def _weight_limit(self, weight_so_far: float, total: float) -> float:
+        """
+        Cumulative weight a centroid starting at weight_so_far may
+        reach, one step further along the k1 scale
+
+        :return: float
+        """
+        q = weight_so_far / total
+        k = self.compression / (2 * math.pi) * math.asin(2 * q - 1)
+        k_next = min(k + 1, self.compression / 4.0)
+        q_next = (math.sin(k_next * 2 * math.pi / self.compression) + 1) / 2
+        return q_next * total
+
+
+class OnlineStats:
+
+    def __init__(self, compression=100):
+        """
+        Count, mean, variance, min, max and approximate percentiles of
+        a stream of numbers in constant memory. Mean and variance are
+        kept with Welford's update and combined with Chan's formula
+        when summaries of separate files are merged.
+
+        :param compression: t-digest compression (int)
+        """
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.digest = TDigest(compression)
+
+    def add(self, value: float):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.digest.add(value)
+
+    def merge(self, other):
+        """
+        Folds another summary into this one
+
+        :param other: OnlineStats
+        :return: None
+        """
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.digest.merge(other.digest)
+
+    def get_report(self, percentiles=(50, 90, 99)) -> dict:
+        """
+        :param percentiles: percentiles to estimate (list of numbers)
+        :return: dict of form {
+            "Count": int,
+            "Mean": float,
+            "Variance": float (sample variance),
+            "Std_Dev": float,
+            "Max": float,
+            "Min": float,
+            "P50": float, ...
+        }
+        """
+        variance = self.m2 / (self.count - 1) if self.count > 1 else 0.0
+        report = {
+            "Count": self.count,
+            "Mean": self.mean,
+            "Variance": variance,
+            "Std_Dev": math.sqrt(variance),
+            "Max": self.digest.max,
+            "Min": self.digest.min
+        }
+        for p in percentiles:
+            report["P" + str(p)] = self.digest.quantile(p / 100.0)
+        return report
+
+
+class LatencyHistogram:
+
+    def __init__(self, highest_seconds=3600, significant_figures=2):
+        """
+        HDR style histogram of latencies in microseconds. Counts are
+        kept in a fixed array of log linear buckets: every power of two
+        range is split into the same number of linear sub-buckets, so
+        any value is off by at most one part in 10 ** significant_figures
+        whatever its magnitude. Recording is a few integer operations,
+        memory doesn't grow with the number of values and histograms
+        merge by adding counts. Values above highest_seconds are
+        counted in the top bucket, max is kept exactly.
+
+        :param highest_seconds: largest latency kept apart (float)
+        :param significant_figures: decimal digits of precision (int)
+        """
+        self.sub_bucket_bits = math.ceil(math.log2(2 * 10 ** significant_figures))
+        self.sub_bucket_count = 1 << self.sub_bucket_bits
+        self.sub_bucket_half = self.sub_bucket_count // 2
+        self.highest = int(highest_seconds * 1000000)
+        self.counts = [0] * (self._index(self.highest) + 1)
+        self.lock = threading.Lock()
+        self.count = 0
+        self.total = 0          # sum of values in microseconds
+        self.max = 0            # largest value in microseconds
+
+    def add(self, elapsed: float):
+        """
+        :param elapsed: latency in seconds (float)
+        """
+        value = max(int(elapsed * 1000000), 0)
+        index = self._index(min(value, self.highest))
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += value
+            if value > self.max:
+                self.max = value
+
+    def merge(self, other):
+        """
+        Adds the counts of a histogram of the same settings
+
+        :param other: LatencyHistogram
+        :return: None
+        """
+        with other.lock:
+            counts = list(other.counts)
+            count, total, high = other.count, other.total, other.max
+        with self.lock:
+            for index, value in enumerate(counts):
+                if value:
+                    self.counts[index] += value
+            self.count += count
+            self.total += total
+            self.max = max(self.max, high)
+
+    def value_at(self, percentile: float) -> float:
+        """
+        :param percentile: percentile between 0 and 100 (float)
+        :return: highest latency of the bucket holding the percentile,
+            in ms (float)
+        """
+        with self.lock:
+            if self.count == 0:
+                return 0.0
+            rank = max(math.ceil(percentile / 100.0 * self.count), 1)
+            seen = 0
+            for index, value in enumerate(self.counts):
+                seen += value
+                if seen >= rank:
+                    return min(self._highest_in(index), self.max) / 1000.0
+        return self.max / 1000.0
+
+    def get_report(self, percentiles=(50, 95, 99)) -> dict:
+        """
+        :param percentiles: percentiles to report (list of numbers)
+        :return: dict of form {
+            "Count": int,
+            "Mean_ms": float,
+            "P50_ms": float, ...
+            "Max_ms": float
+        }
+        """
+        with self.lock:
+            count, total, high = self.count, self.total, self.max
+        report = {
+            "Count": count,
+            "Mean_ms": total / count / 1000.0 if count else 0.0
+        }
+        for p in percentiles:
+            report["P" + str(p) + "_ms"] = self.value_at(p)
+        report["Max_ms"] = high / 1000.0
+        return report
+
+    def clear(self):
+        with self.lock:
+            self.counts = [0] * len(self.counts)
+            self.count = 0
+            self.total = 0
+            self.max = 0
+
+    def _index(self, value: int) -> int:
+        """
+        Bucket 0 holds values below sub_bucket_count one per slot,
+        every later bucket b covers twice the range of the one before
+        in sub_bucket_half slots of width 2 ** b
+
+        :param value: latency in microseconds (int)
+        :return: index into counts (int)
+        """
+        bucket = max(value.bit_length() - self.sub_bucket_bits, 0)
+        return bucket * self.sub_bucket_half + (value >> bucket)
+
+    def _highest_in(self, index: int) -> int:
+        """
+        :param index: index into counts (int)
+        :return: largest microsecond value counted at index (int)
+        """
+        if index < self.sub_bucket_count:
+            return index
+        bucket = (index - self.sub_bucket_count) // self.sub_bucket_half + 1
+        sub_bucket = index - bucket * self.sub_bucket_half
+        return ((sub_bucket + 1) << bucket) - 1
+
+
+class LatencyTracker:
+
+    def __init__(self):
+        """
+        LatencyHistograms of the named stages of one component,
+        e.g. "Search", "Fetch" and "Parse" of a datasource, with the
+        calls of each stage in flight and the ones that failed. Safe
+        to share between threads
+        """
+        self.lock = threading.Lock()
+        self.stages = {}        # stage name: LatencyHistogram
+        self.in_flight = {}     # stage name: calls not finished yet
+        self.errors = {}        # stage name: failed calls
+
+    def add(self, stage: str, elapsed: float):
+        """
+        :param stage: stage name (str)
+        :param elapsed: latency in seconds (float)
+        """
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            with self.lock:
+                histogram = self.stages.setdefault(stage, LatencyHistogram())
+        histogram.add(elapsed)
+
+    def add_error(self, stage: str):
+        """
+        Counts a failed call of a stage, e.g. a 5xx response
+
+        :param stage: stage name (str)
+        """
+        with self.lock:
+            self.errors[stage] = self.errors.get(stage, 0) + 1
+
+    @contextmanager
+    def time(self, stage: str):
+        """
+        Records how long the body of a with block takes, also when
+        it raises, in which case the call counts as failed
+
+        :param stage: stage name (str)
+        """
+        with self.lock:
+            self.in_flight[stage] = self.in_flight.get(stage, 0) + 1
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.add_error(stage)
+            raise
+        finally:
+            self.add(stage, time.perf_counter() - start)
+            with self.lock:
+                self.in_flight[stage] -= 1
+
+    def get_report(self) -> dict:
+        """
+        :return: dict of {"stage": dict (see LatencyHistogram.get_report)
+            with an "Errors" count} of every stage recorded since the
+            last clear
+        """
+        with self.lock:
+            stages = sorted(self.stages.items())
+            errors = dict(self.errors)
+        return {stage: dict(histogram.get_report(),
+                            Errors=errors.get(stage, 0))
+                for stage, histogram in stages if histogram.count}
+
+    def get_in_flight(self) -> dict:
+        """
+        :return: dict of {"stage": calls in flight (int)}
+        """
+        with self.lock:
+            return dict(self.in_flight)
+
+    def clear_usage_stats(self, stages=None):
+        """
+        :param stages: list of stage names to clear, all if not given
+        """
+        with self.lock:
+            histograms = [histogram for stage, histogram
+                          in self.stages.items()
+                          if stages is None or stage in stages]
+            for stage in list(self.errors):
+                if stages is None or stage in stages:
+                    del self.errors[stage]
+        for histogram in histograms:
+            histogram.clear()
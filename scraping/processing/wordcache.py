@@ -0,0 +1,186 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+class WordCache:
+
+    def __init__(self, func=None, max_size=200000, path=None,
+                 batch_func=None):
+        """
+        Bounded, thread safe LRU memo of a per word function, e.g.
+        stemming. Lyrics have a small vocabulary that repeats a lot, so
+        after a short warm up almost every word is a dict lookup. The
+        cache can be persisted as a JSON word -> value lexicon and
+        loaded again by the next run.
+
+        :param func: callable taking a word (str) and returning its
+            value, batch_func is called with one word if not given
+        :param max_size: max words kept, least recently used words are
+            dropped first (int)
+        :param path: JSON file to load the lexicon from and save it to
+            (str), not persisted if not given
+        :param batch_func: callable taking a list of words and returning
+            a list of their values, used by get_many to compute all
+            misses in one call, func is called per word if not given.
+            One of func or batch_func is required
+        """
+        self.func = func
+        self.batch_func = batch_func
+        self.max_size = max_size
+        self.path = path
+        self.lock = threading.Lock()
+        self.words = OrderedDict()
+        if path is not None and os.path.exists(path):
+            with open(path, 'r') as file:
+                lexicon = json.load(file)
+            for word, value in list(lexicon.items())[-max_size:]:
+                self.words[word] = value
+
+        self.hits = 0
+        self.misses = 0
+        self.new_words = None       # words computed since last taken
+
+    def get(self, word: str):
+        """
+        Returns the value of a word, computing it on a miss
+
+        :param word: word (str)
+        :return: value of func for word
+        """
+        with self.lock:
+            if word in self.words:
+                self.words.move_to_end(word)
+                self.hits += 1
+                return self.words[word]
+            self.misses += 1
+        if self.func is None:
+            value = self.batch_func([word])[0]
+        else:
+            value = self.func(word)
+        self._put(word, value)
+        return value
+
+    def get_many(self, words) -> dict:
+        """
+        Returns the values of many words, with every miss computed
+        in one call to batch_func
+
+        :param words: iterable of words (str)
+        :return: dict of {"word": value}
+        """
+        values = {}
+        missing = []
+        with self.lock:
+            for word in words:
+                if word in values:
+                    continue
+                if word in self.words:
+                    self.words.move_to_end(word)
+                    values[word] = self.words[word]
+                    self.hits += 1
+                else:
+                    values[word] = None
+                    missing.append(word)
+            self.misses += len(missing)
+        if missing:
+            if self.batch_func is None:
+                computed = [self.func(word) for word in missing]
+            else:
+                computed = self.batch_func(missing)
+            for word, value in zip(missing, computed):
+                values[word] = value
+                self._put(word, value)
+        return values
+
+    def track_new_words(self):
+        """
+        Starts keeping the words computed from now on, for a cache in a
+        worker process whose new words are sent back to the parent
+
+        :return: None
+        """
+        with self.lock:
+            self.new_words = {}
+
+    def take_new_words(self) -> dict:
+        """
+        :return: dict of {"word": value} computed since the last call,
+            empty if not tracking
+        """
+        with self.lock:
+            words = self.new_words or {}
+            if self.new_words is not None:
+                self.new_words = {}
+        return words
+
+    def merge(self, words: dict, hits=0, misses=0):
+        """
+        Adds the lookups and new words of another process's cache
+
+        :param words: dict of {"word": value}
+        :param hits: cache hits to add (int)
+        :param misses: cache misses to add (int)
+        :return: None
+        """
+        with self.lock:
+            self.hits += hits
+            self.misses += misses
+        for word, value in words.items():
+            self._put(word, value)
+
+    def save(self):
+        """
+        Writes the lexicon to path, atomically replacing any old copy
+
+        :return: None
+        """
+        if self.path is None:
+            return
+        with self.lock:
+            lexicon = dict(self.words)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(lexicon, file)
+        os.replace(tmp_path, self.path)
+
+    def get_usage_report(self) -> dict:
+        """
+        Returns hit rate of the cache
+
+        :return: dict of form {
+            "Hits": int,
+            "Misses": int,
+            "Hit_Rate": float,
+            "Size": int
+        }
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "Hits": self.hits,
+                "Misses": self.misses,
+                "Hit_Rate": self.hits / lookups if lookups else 0.0,
+                "Size": len(self.words)
+            }
+
+    def clear_usage_stats(self):
+        with self.lock:
+            self.hits = 0
+            self.misses = 0
+
+    def _put(self, word: str, value):
+        with self.lock:
+            self.words[word] = value
+            self.words.move_to_end(word)
+            if self.new_words is not None:
+                self.new_words[word] = value
+            while len(self.words) > self.max_size:
+                self.words.popitem(last=False)
+
+    def __len__(self):
+        return len(self.words)
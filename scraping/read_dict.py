@@ -1,38 +1,172 @@
+"""
+Aggregates song stats over any number of scraper output files: JSONL
+sink files (plain, .gz or .zst, truncated ones read up to their last
+complete line), per chart {chart}_{date}.json files and the old
+sample.json. Records are streamed, so memory stays constant however big
+the corpus is, and files are spread over worker processes. Reports
+count, mean, variance, min, max and approximate percentiles of every
+metric, optionally per chart, year or genre:
+
+    python read_dict.py sample_results --group-by year --workers 8
+"""
+import argparse
 import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from processing import jsonlsink
+from processing import streamstats
+
+METRICS = ["Percent_Agreed", "Unique_Word_Count", "Total_Word_Count",
+           "Repetition_Coeff"]
+SKIP_KEYS = ["AZ_Error_Log", "Records_Processed"]
+
+
+def find_files(paths: list) -> list:
+    """
+    Expands directories into the song files directly inside them
+
+    :param paths: list of file or directory paths (str)
+    :return: list of file paths (str)
+    """
+    files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            files.append(path)
+            continue
+        for name in sorted(os.listdir(path)):
+            if name.startswith('usage') or name == 'index.json':
+                continue
+            if '.jsonl' in name or name.endswith('.json'):
+                files.append(os.path.join(path, name))
+    return files
+
+
+def read_songs(path: str):
+    """
+    Reads the song dicts of a file
+
+    :param path: file path (str)
+    :return: generator of song dicts
+    """
+    if '.jsonl' in path:
+        yield from jsonlsink.read_records(path)
+        return
+    # Per chart files are a single dict of {master key: song dict}
+    with open(path, 'r') as file:
+        master_dict = json.load(file)
+    for key, val in master_dict.items():
+        if key not in SKIP_KEYS and isinstance(val, dict):
+            yield val
+
+
+def group_names(song: dict, group_by: str) -> list:
+    """
+    Names of the groups a song counts towards
+
+    :param song: song dict
+    :param group_by: "all", "chart", "year" or "genre" (str)
+    :return: list of group names (str)
+    """
+    if group_by == "all":
+        return ["All"]
+    discovered = song.get("BB_Chart_Discovered", {})
+    if group_by == "chart":
+        return [discovered.get("Chart_Name", "Unknown")]
+    if group_by == "year":
+        return [(discovered.get("Date") or "Unknown")[:4]]
+    genres = song.get("Genres")
+    if isinstance(genres, dict):
+        genres = genres.get("Names")
+    elif isinstance(genres, str):
+        genres = [genres]
+    if not isinstance(genres, list) or not genres:
+        return ["Unknown"]
+    return list(dict.fromkeys(genres))
+
+
+def aggregate_file(path: str, group_by="all", compression=100) -> dict:
+    """
+    Summarizes the songs of one file
 
-with open("sample.json", 'r') as file:
-    x = json.load(file)
+    :param path: file path (str)
+    :param group_by: see group_names (str)
+    :param compression: t-digest compression (int)
+    :return: dict of form {
+        "group name": {"metric name": streamstats.OnlineStats}
+    }
+    """
+    groups = {}
+    for song in read_songs(path):
+        if "Percent_Agreed" not in song:
+            continue
+        # Files written before the key was renamed
+        if "Repetition_Coeff" not in song and "Repition_Coeff" in song:
+            song["Repetition_Coeff"] = song["Repition_Coeff"]
+        for group in group_names(song, group_by):
+            if group not in groups:
+                groups[group] = {metric: streamstats.OnlineStats(compression)
+                                 for metric in METRICS}
+            for metric in METRICS:
+                value = song.get(metric)
+                if value is not None:
+                    groups[group][metric].add(value)
+    return groups
 
-perc_agr = []
-uniq_word = []
-total_word = []
-repition_coef = []
 
-for key, val in x.items():
-    if key == "AZ_Error_Log" or key == "Records_Processed":
-        continue
-    perc_agr.append(x[key]["Percent_Agreed"])
-    uniq_word.append(x[key]["Unique_Word_Count"]),
-    total_word.append(x[key]["Total_Word_Count"]),
-    repition_coef.append(x[key]["Repition_Coeff"])
+def aggregate(files: list, group_by="all", workers=None,
+              compression=100) -> dict:
+    """
+    Summarizes the songs of many files, one file per worker task
 
-results = [[],[],[],[]]
+    :param files: list of file paths (str)
+    :param group_by: see group_names (str)
+    :param workers: number of worker processes (int), defaults to the
+        number of cpus, 1 to read every file in this process
+    :param compression: t-digest compression (int)
+    :return: dict of form {
+        "group name": {"metric name": streamstats.OnlineStats}
+    }
+    """
+    summarize = partial(aggregate_file, group_by=group_by,
+                        compression=compression)
+    if workers == 1:
+        results = map(summarize, files)
+        return _merge_all(results)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return _merge_all(executor.map(summarize, files))
 
-results[0].append(sum(perc_agr)/len(perc_agr))
-results[0].append(max(perc_agr))
-results[0].append(min(perc_agr))
 
-results[1].append(sum(uniq_word)/len(uniq_word))
-results[1].append(max(uniq_word))
-results[1].append(min(uniq_word))
+def _merge_all(results) -> dict:
+    totals = {}
+    for groups in results:
+        for group, metrics in groups.items():
+            if group not in totals:
+                totals[group] = metrics
+                continue
+            for metric, stats in metrics.items():
+                totals[group][metric].merge(stats)
+    return totals
 
-results[2].append(sum(total_word)/len(total_word))
-results[2].append(max(total_word))
-results[2].append(min(total_word))
 
-results[3].append(sum(repition_coef)/len(repition_coef))
-results[3].append(max(repition_coef))
-results[3].append(min(repition_coef))
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Aggregate song stats")
+    parser.add_argument("paths", nargs="*", default=["sample_results"],
+                        help="song files or directories of them")
+    parser.add_argument("--group-by", default="all",
+                        choices=["all", "chart", "year", "genre"])
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--compression", type=int, default=100)
+    parser.add_argument("--percentiles", type=float, nargs="+",
+                        default=[50, 90, 99])
+    args = parser.parse_args()
 
-for t in results:
-    print(t)
+    files = find_files(args.paths)
+    totals = aggregate(files, group_by=args.group_by, workers=args.workers,
+                       compression=args.compression)
+    percentiles = [int(p) if p == int(p) else p for p in args.percentiles]
+    results = {group: {metric: stats.get_report(percentiles)
+                       for metric, stats in metrics.items()}
+               for group, metrics in sorted(totals.items())}
+    print(json.dumps(results, indent=4))